@@ -0,0 +1,74 @@
+"""Exposure-level read of all detectors: serial butler.get calls
+compared with concurrent reads by getExposureImages and getExposureCube
+
+Creates a temporary butler repository with full detector size images
+of one exposure, stored as FITS or, with --hdf5, as HDF5 files.
+"""
+
+import argparse
+import os
+import tempfile
+
+from lsst.daf.butler import Butler, ButlerURI, Config, StorageClassFactory
+from lsst.daf.butler.tests import addDatasetType, makeTestRepo
+
+from common import DETECTOR_SHAPE, make_full_frame, report, time_call
+from spherex.core import spherex_image_reader
+from spherex.instrument import getExposureCube, getExposureImages
+
+INSTRUMENT = "simulator"
+DATASET_TYPE = "rawexp"
+EXPOSURE = 1
+
+
+def make_repo(root, n_detectors, size, hdf5=False):
+    """Create butler repository with images of all detectors of one exposure"""
+    configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
+    dataIds = {"instrument": [INSTRUMENT], "detector": list(range(1, n_detectors + 1)),
+               "exposure": [EXPOSURE]}
+    config = Config(configURI.join("butler.yaml"))
+    if hdf5:
+        config["datastore", "formatters", DATASET_TYPE] = "spherex.formatters.SPHERExHDF5Formatter"
+    creator = makeTestRepo(root, dataIds, config=config, dimensionConfig=configURI.join("dimensions.yaml"))
+    storageClass = StorageClassFactory().getStorageClass("SPHERExImage")
+    addDatasetType(creator, DATASET_TYPE, set(dataIds), storageClass)
+
+    butler = Butler(butler=creator, run="bench")
+    image_path = make_full_frame(os.path.join(root, "frame.fits"), shape=(size, size))
+    image = spherex_image_reader(image_path, unit="adu")
+    for detector in dataIds["detector"]:
+        butler.put(image, DATASET_TYPE, instrument=INSTRUMENT, exposure=EXPOSURE, detector=detector)
+    return Butler(root, collections=["bench"])
+
+
+def serial_get(butler, detectors):
+    return [butler.get(DATASET_TYPE, instrument=INSTRUMENT, exposure=EXPOSURE, detector=detector)
+            for detector in detectors]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--detectors", type=int, default=6)
+    parser.add_argument("--size", type=int, default=DETECTOR_SHAPE[0],
+                        help="Image size in pixels (square image)")
+    parser.add_argument("--hdf5", action="store_true", help="Store images with SPHERExHDF5Formatter")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        butler = make_repo(root, args.detectors, args.size, hdf5=args.hdf5)
+        detectors = list(range(1, args.detectors + 1))
+        kwargs = dict(instrument=INSTRUMENT, collections=["bench"])
+
+        report("serial butler.get", time_call(serial_get, butler, detectors, repeat=args.repeat))
+        report("getExposureImages", time_call(getExposureImages, butler, DATASET_TYPE, EXPOSURE,
+                                              repeat=args.repeat, **kwargs))
+        report("getExposureImages lazy", time_call(getExposureImages, butler, DATASET_TYPE, EXPOSURE,
+                                                   parameters={"lazy": True}, repeat=args.repeat,
+                                                   **kwargs))
+        report("getExposureCube", time_call(getExposureCube, butler, DATASET_TYPE, EXPOSURE,
+                                            repeat=args.repeat, **kwargs))
+
+
+if __name__ == "__main__":
+    main()
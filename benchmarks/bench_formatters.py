@@ -0,0 +1,172 @@
+"""Put and get latency, throughput and peak memory of the image formatters
+
+Creates a temporary butler repository with one dataset type per formatter
+and write recipe, and puts and gets synthetic images of several sizes.
+Throughput is the in-memory size of the image divided by the median time.
+Peak memory is the peak of the memory allocations traced by tracemalloc
+during a separate (untimed) call, including numpy arrays, but not
+memory-mapped file pages.
+
+Results can be saved as json and compared with a saved baseline:
+
+    PYTHONPATH=python python benchmarks/bench_formatters.py --output baseline.json
+    PYTHONPATH=python python benchmarks/bench_formatters.py --compare baseline.json
+
+The comparison exits with status 1, if any latency or peak memory
+increased by more than the tolerance.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from astropy.io import fits
+from astropy.nddata import CCDData
+from lsst.daf.butler import Butler, ButlerURI, Config, StorageClassFactory
+from lsst.daf.butler.tests import addDatasetType, makeTestRepo
+
+from common import compare_results, make_synthetic_image, save_results
+
+INSTRUMENT = "simulator"
+DATA_ID = {"instrument": INSTRUMENT, "exposure": 1, "detector": 1}
+
+# configuration name: storage class, write recipe, conversion of the synthetic image
+FORMATS = {
+    "SPHERExImage": ("SPHERExImage", None, lambda image: image),
+    "SPHERExImage lossless": ("SPHERExImage", "lossless", lambda image: image),
+    "SPHERExImage rice": ("SPHERExImage", "rice", lambda image: image),
+    "CCDData": ("CCDData", None,
+                lambda image: CCDData(image.data, unit=image.unit, meta=image.meta, wcs=image.wcs,
+                                      uncertainty=image.uncertainty)),
+    "MyImage": ("MyImage", None,
+                lambda image: fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(image.data, name="IMAGE"),
+                                            fits.ImageHDU(image.flags, name="FLAGS"),
+                                            fits.ImageHDU(image.uncertainty.array, name="VARIANCE")])),
+}
+
+# record keys, which identify the configuration, and measured values
+KEYS = ["format", "size"]
+METRICS = ["put_ms", "get_ms", "put_peak_mb", "get_peak_mb"]
+
+
+def dataset_type_name(name):
+    return name.lower().replace(" ", "_")
+
+
+def make_repo(root, formats):
+    """Create butler repository with a dataset type per format"""
+    configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
+    config = Config(configURI.join("butler.yaml"))
+    for name in formats:
+        recipe = FORMATS[name][1]
+        if recipe is not None:
+            config["datastore", "formatters", dataset_type_name(name)] = {
+                "formatter": "spherex.formatters.SPHERExImageFormatter", "parameters": {"recipe": recipe}}
+    dataIds = {key: [value] for key, value in DATA_ID.items()}
+    creator = makeTestRepo(root, dataIds, config=config, dimensionConfig=configURI.join("dimensions.yaml"))
+    factory = StorageClassFactory()
+    for name in formats:
+        addDatasetType(creator, dataset_type_name(name), set(DATA_ID),
+                       factory.getStorageClass(FORMATS[name][0]))
+    return creator
+
+
+def nbytes(obj):
+    """In-memory size of the image arrays"""
+    if isinstance(obj, fits.HDUList):
+        return sum(hdu.data.nbytes for hdu in obj if hdu.data is not None)
+    arrays = [obj.data, getattr(obj, "flags", None), obj.mask,
+              None if obj.uncertainty is None else obj.uncertainty.array]
+    return sum(array.nbytes for array in arrays if array is not None)
+
+
+def get(butler, datasetType):
+    """Get the dataset and access all its arrays"""
+    obj = butler.get(datasetType, DATA_ID)
+    # HDUList and lazy reads defer reading the data until it is accessed
+    nbytes(obj)
+    return obj
+
+
+def peak_mb(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def bench_format(creator, name, size, repeat):
+    datasetType = dataset_type_name(name)
+    obj = FORMATS[name][2](make_synthetic_image((size, size)))
+    put_times = []
+    for i in range(repeat + 1):
+        butler = Butler(butler=creator, run=f"{datasetType}_{size}_{i}")
+        start = time.perf_counter()
+        butler.put(obj, datasetType, DATA_ID)
+        put_times.append(time.perf_counter() - start)
+    file_mb = os.path.getsize(butler.getURI(datasetType, DATA_ID).ospath) / 2**20
+    peakButler = Butler(butler=creator, run=f"{datasetType}_{size}_peak")
+    put_peak = peak_mb(peakButler.put, obj, datasetType, DATA_ID)
+
+    get_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        get(butler, datasetType)
+        get_times.append(time.perf_counter() - start)
+    get_peak = peak_mb(get, butler, datasetType)
+
+    mb = nbytes(obj) / 2**20
+    # the first put is a warm-up
+    put_ms = statistics.median(put_times[1:]) * 1e3
+    get_ms = statistics.median(get_times) * 1e3
+    return {"format": name, "size": size, "image_mb": mb, "file_mb": file_mb,
+            "put_ms": put_ms, "get_ms": get_ms,
+            "put_mb_s": mb / put_ms * 1e3, "get_mb_s": mb / get_ms * 1e3,
+            "put_peak_mb": put_peak, "get_peak_mb": get_peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048],
+                        help="Image sizes in pixels (square images)")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS),
+                        metavar="FORMAT", help=f"Formats to benchmark, any of {list(FORMATS)}")
+    parser.add_argument("--output", help="Save results to this json file")
+    parser.add_argument("--compare", help="Compare results with the baseline saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative increase of latency and peak memory")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        creator = make_repo(root, args.formats)
+        for size in args.sizes:
+            for name in args.formats:
+                result = bench_format(creator, name, size, args.repeat)
+                results.append(result)
+                print(f"{name:22s} {size:5d}^2  file {result['file_mb']:7.1f} MB   "
+                      f"put {result['put_ms']:8.1f} ms {result['put_mb_s']:7.0f} MB/s "
+                      f"peak {result['put_peak_mb']:7.1f} MB   "
+                      f"get {result['get_ms']:8.1f} ms {result['get_mb_s']:7.0f} MB/s "
+                      f"peak {result['get_peak_mb']:7.1f} MB")
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, KEYS, METRICS, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
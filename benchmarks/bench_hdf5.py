@@ -0,0 +1,127 @@
+"""Full frame and cutout reads of chunked HDF5 files compared with FITS
+
+Writes a synthetic full detector image (image, flags and variance) with
+the readers behind `SPHERExImageFormatter` (FITS, uncompressed and with
+the ``lossless`` write recipe) and `SPHERExHDF5Formatter` (chunked HDF5,
+gzip compressed and uncompressed), and times reads of the full frame
+and of cutouts at random positions, with all planes of the image.
+HDF5 files are read with one and with ``--jobs`` decoding threads.
+The pixels of all planes are summed after every read, so that
+memory-mapped FITS data are read from the file as well.
+Files are in the page cache after the first read, the times are decode
+times rather than disk reads.
+
+    PYTHONPATH=python python benchmarks/bench_hdf5.py --output baseline.json
+    PYTHONPATH=python python benchmarks/bench_hdf5.py --compare baseline.json
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy import units as u
+
+from common import DETECTOR_SHAPE, compare_results, make_synthetic_image, save_results
+from spherex.core import (spherex_hdf5_reader, spherex_hdf5_writer, spherex_image_reader,
+                          spherex_image_writer)
+
+LOSSLESS = {"image": {"compression_type": "GZIP_2", "quantize_level": 0},
+            "variance": {"compression_type": "GZIP_2", "quantize_level": 0},
+            "flags": "GZIP_2"}
+
+# record keys, which identify the configuration, and measured values
+KEYS = ["format", "read"]
+METRICS = ["median_ms"]
+
+
+def formats(jobs, chunks):
+    """Format names, file names, writer and reader functions,
+    formats with the same file name read the same file"""
+    unit = u.electron / u.s
+    yield ("FITS", "image.fits", lambda image, path: spherex_image_writer(image, path),
+           lambda path, section: spherex_image_reader(path, unit=unit, section=section))
+    yield ("FITS lossless", "lossless.fits",
+           lambda image, path: spherex_image_writer(image, path, compression=LOSSLESS),
+           lambda path, section: spherex_image_reader(path, unit=unit, section=section))
+    for compression in ("gzip", None):
+        def write(image, path, compression=compression):
+            spherex_hdf5_writer(image, path, chunks=chunks, compression=compression)
+        for n in sorted({1, jobs}):
+            def read(path, section, n=n):
+                return spherex_hdf5_reader(path, unit=unit, section=section, jobs=n)
+            yield f"HDF5 {compression or 'none'} jobs={n}", f"{compression}.h5", write, read
+
+
+def touch(image):
+    """Access all pixels of the image planes"""
+    for array in (image.data, image.flags, image.uncertainty.array):
+        np.add.reduce(array, axis=None)
+
+
+def cutouts(size, shape, repeat, seed=0):
+    """Random cutout sections of the given size"""
+    rng = np.random.default_rng(seed)
+    for _ in range(repeat):
+        y, x = (int(rng.integers(0, n - size + 1)) for n in shape)
+        yield (slice(y, y + size), slice(x, x + size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--size", type=int, default=DETECTOR_SHAPE[0],
+                        help="Image size in pixels (square image)")
+    parser.add_argument("--cutouts", type=int, nargs="+", default=[64, 256],
+                        help="Cutout sizes in pixels (square cutouts)")
+    parser.add_argument("--chunks", type=int, nargs=2, default=[256, 256], help="HDF5 chunk shape")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of HDF5 decoding threads")
+    parser.add_argument("--output", help="Save results to this json file")
+    parser.add_argument("--compare", help="Compare results with the baseline saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative increase of the times")
+    args = parser.parse_args()
+
+    shape = (args.size, args.size)
+    image = make_synthetic_image(shape)
+    reads = [("full", [None] * args.repeat)]
+    reads += [(f"cutout {size}", list(cutouts(size, shape, args.repeat))) for size in args.cutouts]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, filename, write, read in formats(args.jobs, tuple(args.chunks)):
+            path = os.path.join(tmpdir, filename)
+            if not os.path.exists(path):
+                write(image, path)
+            file_mb = os.path.getsize(path) / 2**20
+            for label, sections in reads:
+                # warm-up: page cache and imports
+                touch(read(path, sections[0]))
+                times = []
+                for section in sections:
+                    start = time.perf_counter()
+                    touch(read(path, section))
+                    times.append(time.perf_counter() - start)
+                result = {"format": name, "read": label, "file_mb": file_mb,
+                          "min_ms": min(times) * 1e3, "median_ms": statistics.median(times) * 1e3}
+                results.append(result)
+                print(f"{name:22s} {label:12s} file {file_mb:7.1f} MB   "
+                      f"min {result['min_ms']:8.2f} ms   median {result['median_ms']:8.2f} ms")
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, KEYS, METRICS, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Scaling of ingest-simulated with the number of files
+
+For every number of files, writes synthetic simulator files (see
+make_simulated.py), creates an empty butler repository and ingests them
+with `spherex.script.ingestSimulated`, the function run by
+``butler ingest-simulated``, called in-process, so that the command line
+plugin does not need to be configured. Reports files per second and
+the time split between the phases of the ingest, as measured by its
+own instrumentation (``ingest-simulated --timings``, see
+`spherex.script.ingestSimulated.ingestPhases`):
+
+- ``setup`` - instrument, detector, dataset type and run registration,
+- ``discover`` - the directory search for the files,
+- ``wait`` - waiting for the parser threads, which parse file names and,
+  with ``--read-headers``, read exposure metadata from the headers,
+- ``parse`` - exposure record and dataset reference construction,
+- ``sync`` - inserting exposure dimension records,
+- ``ingest`` - ``butler.ingest`` of the files, including the transfer
+  into the datastore and the commit of the transaction,
+- ``checkpoint`` - checkpoint file bookkeeping, with ``--checkpoint``,
+- ``other`` - the rest.
+
+    PYTHONPATH=python python benchmarks/bench_ingest.py --files 1000 10000 100000
+
+Use ``--workdir`` to keep the generated files for later runs, they are
+reused if a directory with the same number of files and mode exists.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from lsst.daf.butler import Butler, ButlerURI, Config
+
+from common import compare_results, save_results
+from make_simulated import DETECTORS, MODES, make_simulated_files
+from spherex.cli.cmd.commands import rawexp_re
+from spherex.core import instrumentation_sinks
+from spherex.script import ingestSimulated
+from spherex.script.ingestSimulated import INGEST_PHASES, IngestTimings, ingestPhases
+
+# record keys, which identify the configuration, and measured values
+KEYS = ["files", "mode"]
+PHASES = INGEST_PHASES
+METRICS = ["total_s"] + [f"{phase}_s" for phase in PHASES if phase != "other"]
+
+
+def make_repo(root):
+    """Create empty butler repository with the spherex configuration"""
+    configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
+    Butler.makeRepo(root, config=Config(configURI.join("butler.yaml")),
+                    dimensionConfig=configURI.join("dimensions.yaml"))
+    return root
+
+
+def simulated_files(workdir, n_exposures, mode, jobs):
+    """Directory with the simulated files, written if it does not exist"""
+    directory = os.path.join(workdir, f"data_{mode}_{n_exposures}")
+    done = os.path.join(directory, "done")
+    if not os.path.exists(done):
+        shutil.rmtree(directory, ignore_errors=True)
+        start = time.perf_counter()
+        make_simulated_files(directory, n_exposures, mode=mode, jobs=jobs)
+        print(f"Wrote {n_exposures * len(DETECTORS)} {mode} files in {time.perf_counter() - start:.1f} s")
+        # marks a complete directory
+        open(done, "w").close()
+    return directory
+
+
+def bench_ingest(workdir, n_files, args):
+    n_exposures = -(-n_files // len(DETECTORS))
+    directory = simulated_files(workdir, n_exposures, args.mode, args.jobs)
+    repo = make_repo(os.path.join(workdir, f"repo_{n_files}"))
+    timings = IngestTimings()
+    try:
+        with instrumentation_sinks(timings):
+            start = time.perf_counter()
+            ingestSimulated(repo, [directory], rawexp_re, "bench", transfer=args.transfer,
+                            jobs=args.jobs, read_headers=args.read_headers, chunk_size=args.chunk_size)
+            total = time.perf_counter() - start
+    finally:
+        shutil.rmtree(repo, ignore_errors=True)
+    times = ingestPhases(timings, total)
+    n_files = n_exposures * len(DETECTORS)
+    return {"files": n_files, "mode": args.mode, "total_s": total, "files_per_s": n_files / total,
+            **{f"{phase}_s": times[phase] for phase in PHASES}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000],
+                        help="Numbers of files, rounded up to whole exposures of 6 files")
+    parser.add_argument("--mode", choices=MODES, default="tiny",
+                        help="Simulated files, see make_simulated.py")
+    parser.add_argument("--workdir", help="Directory for the files and repositories, "
+                                          "by default a temporary directory, which is removed")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="ingest-simulated --jobs")
+    parser.add_argument("--chunk-size", type=int, help="ingest-simulated --chunk-size")
+    parser.add_argument("--read-headers", action="store_true", help="ingest-simulated --read-headers")
+    parser.add_argument("--transfer", default="auto", help="ingest-simulated --transfer")
+    parser.add_argument("--output", help="Save results to this json file")
+    parser.add_argument("--compare", help="Compare results with the baseline saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative increase of the times")
+    args = parser.parse_args()
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(workdir, exist_ok=True)
+        for n_files in args.files:
+            result = bench_ingest(workdir, n_files, args)
+            results.append(result)
+            # per-file cost of every phase shows how it scales
+            phases = "  ".join(f"{phase} {result[f'{phase}_s'] / result['files'] * 1e6:7.0f}"
+                               for phase in PHASES)
+            print(f"{result['files']:8d} files  {result['total_s']:9.1f} s  "
+                  f"{result['files_per_s']:7.0f} files/s   {phases}  us/file")
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, KEYS, METRICS, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Per-file latency of spherex_image_reader on a full detector size file
+
+Compares the single-open reader with the previous implementation,
+which read the file with fits_ccddata_reader and then opened it again
+to get the flags extension.
+"""
+
+import argparse
+import os
+import tempfile
+
+from astropy import units as u
+from astropy.io import fits
+from astropy.nddata import fits_ccddata_reader
+
+from common import DETECTOR_SHAPE, make_full_frame, report, time_call
+from spherex.core import SPHERExImage, spherex_image_reader
+from spherex.core.spherex_image import _get_flag_defs
+
+
+def two_open_reader(filename, unit=None):
+    """Reader, which opens the file twice (the previous implementation)"""
+    ccddata = fits_ccddata_reader(filename, unit=unit, hdu_uncertainty=3, hdu_mask='MASK')
+    with fits.open(filename) as hdus:
+        flags = hdus[2].data
+        flag_defs = _get_flag_defs(hdus[2].header)
+        return SPHERExImage(ccddata.data, meta=ccddata.header,
+                            unit=ccddata.unit, mask=ccddata.mask,
+                            uncertainty=ccddata.uncertainty,
+                            wcs=ccddata.wcs, flags=flags,
+                            flag_defs=flag_defs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--size", type=int, default=DETECTOR_SHAPE[0],
+                        help="Image size in pixels (square image)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = make_full_frame(os.path.join(tmpdir, "full.fits"), shape=(args.size, args.size))
+        unit = u.electron / u.s
+        report("two opens (before)", time_call(two_open_reader, path, unit=unit, repeat=args.repeat))
+        report("single open (after)", time_call(spherex_image_reader, path, unit=unit,
+                                                repeat=args.repeat))
+
+
+if __name__ == "__main__":
+    main()
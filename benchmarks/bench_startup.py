@@ -0,0 +1,108 @@
+"""Startup time of the spherex package and the butler command line plugin
+
+Runs every command in a fresh interpreter, the way a short-lived batch
+job does, and reports the minimum and the median wall time over the
+repeats. The import of a module is skipped and reported as unavailable,
+if it fails (for example, when lsst.daf.butler is not installed).
+
+- ``python -c pass`` - interpreter startup, subtracted from the other
+  times as ``import_ms``,
+- ``import spherex...`` - packages and the light modules, which should
+  not import astropy,
+- ``butler --help`` and ``butler ingest-simulated --help`` - command line
+  startup with the spherex plugin (``DAF_BUTLER_PLUGINS`` set to
+  python/spherex/cli/resources.yaml), if ``butler`` is on the path.
+
+    PYTHONPATH=python python benchmarks/bench_startup.py --output baseline.json
+    PYTHONPATH=python python benchmarks/bench_startup.py --compare baseline.json
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from common import compare_results, save_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS = os.path.join(ROOT, "python", "spherex", "cli", "resources.yaml")
+
+MODULES = ["spherex", "spherex.core", "spherex.core.instrumentation", "spherex.formatters",
+           "spherex.core.spherex_image", "spherex.cli.cmd"]
+
+# record keys, which identify the configuration, and measured values
+KEYS = ["command"]
+METRICS = ["min_ms", "median_ms"]
+
+
+def commands():
+    """Names and command lines to time"""
+    python = sys.executable
+    yield "python -c pass", [python, "-c", "pass"]
+    for module in MODULES:
+        yield f"import {module}", [python, "-c", f"import {module}"]
+    butler = shutil.which("butler")
+    if butler is not None:
+        yield "butler --help", [butler, "--help"]
+        yield "butler ingest-simulated --help", [butler, "ingest-simulated", "--help"]
+
+
+def time_command(args, env, repeat):
+    """Wall times in seconds of the command runs, None if it fails"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            return None
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="Save results to this json file")
+    parser.add_argument("--compare", help="Compare results with the baseline saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative increase of the times")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "python"),
+                                                       os.environ.get("PYTHONPATH", "")]))
+    plugins = [path for path in env.get("DAF_BUTLER_PLUGINS", "").split(os.pathsep) if path]
+    if PLUGINS not in plugins:
+        env["DAF_BUTLER_PLUGINS"] = os.pathsep.join(plugins + [PLUGINS])
+
+    results = []
+    baseline = None
+    for name, command in commands():
+        times = time_command(command, env, args.repeat)
+        if times is None:
+            print(f"{name:40s} unavailable")
+            continue
+        min_ms = min(times) * 1e3
+        if baseline is None:
+            baseline = min_ms
+        result = {"command": name, "min_ms": min_ms, "median_ms": statistics.median(times) * 1e3,
+                  "import_ms": min_ms - baseline}
+        results.append(result)
+        print(f"{name:40s} min {result['min_ms']:7.1f} ms  median {result['median_ms']:7.1f} ms  "
+              f"over startup {result['import_ms']:7.1f} ms")
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, KEYS, METRICS, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
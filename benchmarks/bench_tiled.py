@@ -0,0 +1,78 @@
+"""Peak memory and wall time of dark subtraction with tiled execution
+
+Subtracts two full detector size images with `run_tiled` for several tile
+sizes and, for comparison, with the whole frames read into memory.
+Every configuration runs in a separate process, so that its peak resident
+set size is measured independently.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import DETECTOR_SHAPE, make_full_frame
+from spherex.core import spherex_image_reader, spherex_image_writer, subtract_image
+
+
+def subtract_frames(input_path, subtract_path, output_path, tile_rows):
+    """Subtract images, return wall time in seconds"""
+    start = time.perf_counter()
+    if tile_rows is None:
+        image = spherex_image_reader(input_path, unit="adu")
+        subtract_image(image, spherex_image_reader(subtract_path, unit="adu"))
+        spherex_image_writer(image, output_path, overwrite=True)
+    else:
+        from spherex.tasks.tiled import run_tiled
+        run_tiled(subtract_image, [input_path, subtract_path], output_path,
+                  tile_shape=(tile_rows, None), unit="adu", overwrite=True)
+    return time.perf_counter() - start
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=DETECTOR_SHAPE[0],
+                        help="Image size in pixels (square image)")
+    parser.add_argument("--tile-rows", type=int, nargs="+", default=[16, 64, 256, 1024],
+                        help="Tile heights in rows (tiles are full-width)")
+    # internal: run a single configuration and print its results as json
+    parser.add_argument("--worker", nargs=4, metavar=("INPUT", "SUBTRACT", "OUTPUT", "TILE_ROWS"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        input_path, subtract_path, output_path, tile_rows = args.worker
+        tile_rows = None if tile_rows == "full" else int(tile_rows)
+        baseline = peak_rss_mb()
+        wall = subtract_frames(input_path, subtract_path, output_path, tile_rows)
+        print(json.dumps({"wall": wall, "baseline_rss": baseline, "peak_rss": peak_rss_mb()}))
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = make_full_frame(os.path.join(tmpdir, "input.fits"), shape=(args.size, args.size))
+        subtract_path = make_full_frame(os.path.join(tmpdir, "dark.fits"), shape=(args.size, args.size))
+        output_path = os.path.join(tmpdir, "output.fits")
+        print(f"image {args.size}x{args.size}, file size {os.path.getsize(input_path) / 2**20:.1f} MB")
+        for tile_rows in ["full"] + [str(rows) for rows in args.tile_rows]:
+            out = subprocess.run([sys.executable, __file__, "--worker", input_path, subtract_path,
+                                  output_path, tile_rows],
+                                 check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            label = "whole frame" if tile_rows == "full" else f"tiles of {tile_rows} rows"
+            print(f"{label:24s} wall {result['wall']*1e3:9.1f} ms   "
+                  f"peak RSS {result['peak_rss']:8.1f} MB "
+                  f"(after imports {result['baseline_rss']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
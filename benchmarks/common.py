@@ -0,0 +1,178 @@
+"""Helpers shared by the benchmark scripts
+
+The benchmarks are standalone scripts, which are not collected by pytest.
+Run them from the repository root with the package on the python path:
+
+    PYTHONPATH=python python benchmarks/bench_reader.py
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+from astropy.io import fits
+
+TESTDATA = os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data", "small.fits")
+
+# SPHEREx H2RG detector size
+DETECTOR_SHAPE = (2048, 2048)
+
+
+def make_full_frame(out_path, template=TESTDATA, shape=DETECTOR_SHAPE):
+    """Write a copy of a multi-extension FITS file with image extensions
+    scaled up (tiled) to the given shape.
+
+    Parameters
+    ----------
+    out_path : `str`
+        Output file path.
+    template : `str`
+        Multi-extension FITS file to scale up.
+    shape : `tuple` [`int`]
+        Shape of the image extensions in the output file.
+
+    Returns
+    -------
+    out_path : `str`
+        Output file path.
+    """
+    with fits.open(template, do_not_scale_image_data=True) as hdus:
+        out = fits.HDUList()
+        for hdu in hdus:
+            if isinstance(hdu, fits.ImageHDU) and hdu.data is not None:
+                reps = [int(np.ceil(n / m)) for n, m in zip(shape, hdu.data.shape)]
+                data = np.tile(hdu.data, reps)[:shape[0], :shape[1]]
+                out.append(fits.ImageHDU(data, hdu.header))
+            else:
+                out.append(hdu.copy())
+        out.writeto(out_path, overwrite=True)
+    return out_path
+
+
+def time_call(func, *args, repeat=5, **kwargs):
+    """Time repeated calls of a function
+
+    Returns
+    -------
+    times : `list` [`float`]
+        Wall time of every call in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(label, times):
+    """Print timing statistics"""
+    print(f"{label:40s} min {min(times)*1e3:9.2f} ms   "
+          f"median {statistics.median(times)*1e3:9.2f} ms   ({len(times)} runs)")
+
+
+def make_synthetic_image(shape=DETECTOR_SHAPE, seed=0):
+    """Make a SPHEREx image with random pixels, variance and sparse flags
+
+    Parameters
+    ----------
+    shape : `tuple` [`int`]
+        Image shape.
+    seed : `int`
+        Random generator seed, the same seed gives the same image.
+
+    Returns
+    -------
+    image : `~spherex.core.SPHERExImage`
+    """
+    from astropy.nddata import VarianceUncertainty
+    from astropy.wcs import WCS
+    from spherex.core import SPHERExImage
+    from spherex.core.spherex_image import FLAG_DEFS
+
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 10, shape).astype(np.float32)
+    variance = np.full(shape, 100, dtype=np.float32)
+    # about 1% of the pixels have a random flag set
+    flags = np.zeros(shape, dtype=np.uint8)
+    flagged = rng.random(shape) < 0.01
+    flags[flagged] = 1 << rng.integers(0, len(FLAG_DEFS), np.count_nonzero(flagged))
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crpix = [shape[1] / 2, shape[0] / 2]
+    wcs.wcs.crval = [10.0, 20.0]
+    wcs.wcs.cdelt = [-1.7e-3, 1.7e-3]
+    meta = fits.Header({"EXPTIME": 112.0, "DETECTOR": 1, "FILTER": "D1"})
+    return SPHERExImage(data, unit="adu", meta=meta, wcs=wcs, uncertainty=VarianceUncertainty(variance),
+                        flags=flags, flag_defs=dict(FLAG_DEFS))
+
+
+def run_info():
+    """Describe the benchmark run: time, git commit, host and versions"""
+    import astropy
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"time": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "host": platform.node(), "python": platform.python_version(),
+            "numpy": np.__version__, "astropy": astropy.__version__}
+
+
+def save_results(path, results):
+    """Save benchmark results with the run description as json
+
+    Parameters
+    ----------
+    path : `str`
+        Output file path.
+    results : `list` [`dict`]
+        Results: every record has the keys, which identify the
+        configuration, and the measured values.
+    """
+    with open(path, "w") as f:
+        json.dump({"run": run_info(), "results": results}, f, indent=1)
+
+
+def compare_results(baseline_path, results, keys, metrics, tolerance=0.25):
+    """Compare results with the saved baseline
+
+    Parameters
+    ----------
+    baseline_path : `str`
+        Results saved with `save_results`.
+    results : `list` [`dict`]
+        Current results.
+    keys : `list` [`str`]
+        Record keys, which identify the configuration.
+    metrics : `list` [`str`]
+        Measured values, where larger is worse (time, memory).
+    tolerance : `float`
+        Allowed relative increase.
+
+    Returns
+    -------
+    regressions : `list` [`str`]
+        Descriptions of the metrics, which increased by more than
+        the tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = {tuple(record[key] for key in keys): record for record in json.load(f)["results"]}
+    regressions = []
+    for record in results:
+        config = tuple(record[key] for key in keys)
+        reference = baseline.get(config)
+        if reference is None:
+            continue
+        for metric in metrics:
+            if reference.get(metric) and record[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{config} {metric}: {reference[metric]:.3f} -> {record[metric]:.3f} "
+                                   f"(+{record[metric] / reference[metric] - 1:.0%})")
+    return regressions
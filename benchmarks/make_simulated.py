@@ -0,0 +1,171 @@
+"""Write synthetic simulator files for ingest-simulated
+
+Writes EXPOSURES exposures with 6 detectors each as
+``sim_exposure_NNNNNN_array_N.fits`` files, which are found by the default
+regex of ``butler ingest-simulated``:
+
+    PYTHONPATH=python python benchmarks/make_simulated.py /tmp/sim 1000 --mode tiny
+
+Modes:
+
+- ``full`` - synthetic `~spherex.core.SPHERExImage` of the given shape
+  (full detector size by default, 36 MB per file),
+- ``tiny`` - the same with 8 x 8 pixels (20 kB per file), for ingest
+  benchmarks with many files,
+- ``sparse`` - headers of the full size images with the data left as
+  holes in sparse files, which read as zeros and take a few kilobytes
+  of disk space on file systems, which support sparse files.
+
+Every file has exposure time, boresight and roll in its headers (see
+``--read-headers`` of ``ingest-simulated``), which differ between
+exposures. One template file per detector is written, all other files are
+copies of it with the header keywords replaced. Exposures are split into
+subdirectories of ``--exposures-per-dir`` exposures, so that directories
+stay small with millions of files.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+
+from common import DETECTOR_SHAPE, make_synthetic_image
+from spherex.core import spherex_image_writer
+
+DETECTORS = range(1, 7)
+TINY_SHAPE = (8, 8)
+MODES = ("full", "tiny", "sparse")
+
+
+def simulated_file_name(exposure, detector):
+    return f"sim_exposure_{exposure:06d}_array_{detector}.fits"
+
+
+class _Template:
+    """Template file of a detector: its headers and where they are"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        with fits.open(path) as hdus:
+            self.headers = [(hdu.fileinfo()["hdrLoc"], hdu.header.copy()) for hdu in hdus]
+
+    def header_blocks(self, metadata):
+        """Serialized headers with the metadata keywords replaced"""
+        blocks = []
+        for offset, header in self.headers:
+            size = len(header.tostring())
+            header = header.copy()
+            header.update({key: value for key, value in metadata.items() if key in header})
+            block = header.tostring().encode("ascii")
+            # same cards with new values: the data stay where they are
+            assert len(block) == size, "header size changed"
+            blocks.append((offset, block))
+        return blocks
+
+    def write(self, path, metadata, sparse=False):
+        blocks = self.header_blocks(metadata)
+        if sparse:
+            mode = "wb"
+        else:
+            shutil.copyfile(self.path, path)
+            mode = "r+b"
+        with open(path, mode) as f:
+            for offset, block in blocks:
+                f.seek(offset)
+                f.write(block)
+            if sparse:
+                # data are holes, which read as zeros
+                f.truncate(self.size)
+
+
+def exposure_metadata(exposure):
+    """Exposure time, boresight and roll of an exposure"""
+    rng = np.random.default_rng(exposure)
+    return {"EXPTIME": 112.0, "RA_BORE": float(rng.uniform(0, 360)),
+            "DEC_BORE": float(rng.uniform(-90, 90)), "ROLL": float(rng.uniform(0, 360))}
+
+
+def make_simulated_files(directory, exposures, mode="tiny", shape=DETECTOR_SHAPE, first_exposure=0,
+                         exposures_per_dir=1000, jobs=4):
+    """Write synthetic simulator files
+
+    Parameters
+    ----------
+    directory : `str`
+        Output directory, created if it does not exist.
+    exposures : `int`
+        Number of exposures, each with 6 detector files.
+    mode : `str`
+        ``full``, ``tiny`` or ``sparse``, see the module description.
+    shape : `tuple` [`int`]
+        Image shape in ``full`` and ``sparse`` modes.
+    first_exposure : `int`
+        Id of the first exposure.
+    exposures_per_dir : `int`
+        Number of exposures per subdirectory.
+    jobs : `int`
+        Number of threads writing files.
+
+    Returns
+    -------
+    paths : `list` [`str`]
+        Paths of the written files.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+    os.makedirs(directory, exist_ok=True)
+    templates = {}
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        for detector in DETECTORS:
+            image = make_synthetic_image(TINY_SHAPE if mode == "tiny" else shape, seed=detector)
+            image.meta.update(exposure_metadata(first_exposure))
+            image.meta["DETECTOR"] = detector
+            path = os.path.join(tmpdir, f"template_{detector}.fits")
+            spherex_image_writer(image, path)
+            templates[detector] = _Template(path)
+
+        def write_exposure(exposure):
+            subdir = os.path.join(directory, f"{exposure // exposures_per_dir * exposures_per_dir:06d}")
+            os.makedirs(subdir, exist_ok=True)
+            metadata = exposure_metadata(exposure)
+            paths = []
+            for detector, template in templates.items():
+                path = os.path.join(subdir, simulated_file_name(exposure, detector))
+                template.write(path, metadata, sparse=mode == "sparse")
+                paths.append(path)
+            return paths
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            written = executor.map(write_exposure, range(first_exposure, first_exposure + exposures))
+            return [path for paths in written for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Output directory")
+    parser.add_argument("exposures", type=int, help="Number of exposures, 6 files each")
+    parser.add_argument("--mode", choices=MODES, default="tiny")
+    parser.add_argument("--shape", type=int, nargs=2, default=DETECTOR_SHAPE,
+                        help="Image shape in full and sparse modes")
+    parser.add_argument("--first-exposure", type=int, default=0)
+    parser.add_argument("--exposures-per-dir", type=int, default=1000)
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of threads writing files")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = make_simulated_files(args.directory, args.exposures, mode=args.mode, shape=tuple(args.shape),
+                                 first_exposure=args.first_exposure,
+                                 exposures_per_dir=args.exposures_per_dir, jobs=args.jobs)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(paths)} files in {elapsed:.1f} s ({len(paths) / elapsed:.0f} files/s)")
+
+
+if __name__ == "__main__":
+    main()
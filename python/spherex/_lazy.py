@@ -0,0 +1,45 @@
+# Lazy exports of package __init__ modules
+#
+# A package exports the public names of its submodules, but imports a
+# submodule only when one of its names is accessed (PEP 562), so that
+# importing the package, or one of its light submodules, does not import
+# astropy, daf_butler or pipe_base.
+
+import importlib
+import sys
+
+
+def lazy_exports(package, submodules):
+    """Export names of submodules, which are imported on first access
+
+    Parameters
+    ----------
+    package : `str`
+        Package name, ``__name__`` of the package ``__init__``.
+    submodules : `dict` [`str`, `list` [`str`]]
+        Names exported by each submodule, its ``__all__``.
+
+    Returns
+    -------
+    all : `list` [`str`]
+        All exported names, ``__all__`` of the package.
+    getattr : callable
+        Module ``__getattr__``, which imports the submodule of a name
+        and caches the value in the package namespace.
+    dir : callable
+        Module ``__dir__``.
+    """
+    origins = {name: module for module, names in submodules.items() for name in names}
+
+    def __getattr__(name):
+        module = origins.get(name)
+        if module is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(f"{package}.{module}"), name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(origins))
+
+    return list(origins), __getattr__, __dir__
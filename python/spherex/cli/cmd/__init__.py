@@ -1,3 +1,3 @@
-__all__ = ["ingest_simulated"]
+__all__ = ["index_summaries", "ingest_simulated", "run_pipeline"]
 
-from .commands import ingest_simulated
+from .commands import index_summaries, ingest_simulated, run_pipeline
@@ -7,7 +7,6 @@ from lsst.daf.butler.cli.opt import (repo_argument,
                                      transfer_option
                                      )
 from lsst.daf.butler.cli.utils import (cli_handle_exception)
-from ... import script
 
 from lsst.daf.butler.cli.utils import MWArgumentDecorator
 instrument_argument = MWArgumentDecorator("instrument",
@@ -27,6 +26,68 @@ rawexp_re = r"sim_exposure_(\d+)_array_(\d).fits"
 @run_option(required=False)
 @transfer_option()
 @click.option("--ingest-type", default="rawexp", help="Raw exposure images")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), show_default=True,
+              help="Number of worker threads to find files and read their headers.")
+@click.option("--read-headers", is_flag=True,
+              help="Read exposure time, boresight and roll from FITS headers.")
+@click.option("--chunk-size", type=click.IntRange(min=1),
+              help="Number of files to ingest per transaction. All files are ingested "
+                   "in one transaction by default.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False),
+              help="File to record ingested files in. Files listed in it are skipped, "
+                   "which allows to resume an interrupted ingest.")
+@click.option("--timings", is_flag=True,
+              help="Log (at INFO level) the time of each ingest phase and per-file parse "
+                   "latency percentiles.")
+@click.option("--profile", type=click.Path(dir_okay=False),
+              help="Write cProfile statistics of the ingest (calling thread only) to this file.")
 def ingest_simulated(*args, **kwargs):
     """Ingest raw frames into from a directory into the butler registry"""
+    # scripts import astropy and the formatters, only the command run needs them
+    from ... import script
     cli_handle_exception(script.ingestSimulated, *args, **kwargs)
+
+
+@click.command(short_help="Run a pipeline with a pool of processes.")
+@repo_argument(required=True)
+@click.option("-p", "--pipeline", required=True, type=click.Path(exists=True, dir_okay=False),
+              help="Pipeline definition file, for example, pipelines/ExamplePipeline.yaml.")
+@click.option("-i", "--input", "input_collections", required=True, multiple=True,
+              help="Input collections, the option can be repeated.")
+@click.option("-o", "--output", "output_run", required=True, help="Output run collection.")
+@click.option("-d", "--where", default="", help="Data ID query expression.")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), show_default=True,
+              help="Number of worker processes.")
+@click.option("--register-dataset-types", is_flag=True, help="Register output dataset types.")
+@click.option("--staging", type=click.Path(file_okay=False),
+              help="Directory for output files before they are moved into the datastore.")
+@click.option("--prefetch", default=0, type=click.IntRange(min=0), show_default=True,
+              help="Number of quanta, whose inputs each worker reads ahead while running "
+                   "the current one.")
+@click.option("--prefetch-memory", "prefetch_bytes", type=click.IntRange(min=1),
+              callback=lambda ctx, param, value: value * 2**20 if value is not None else None,
+              help="Maximum size in MB of the input files of the current and prefetched quanta "
+                   "of a worker.")
+@click.option("--summary-index", type=click.Path(dir_okay=False),
+              help="Summary index file to add the summaries of the outputs to, by default "
+                   "image_summary.sqlite3 in the repository root, if it exists.")
+def run_pipeline(*args, **kwargs):
+    """Run a pipeline over the data IDs with all pipeline inputs
+    in a pool of worker processes"""
+    from ... import script
+    cli_handle_exception(script.runPipeline, *args, **kwargs)
+
+
+@click.command(short_help="Index image summaries.")
+@repo_argument(required=True)
+@click.argument("dataset_type")
+@click.option("-c", "--collections", multiple=True, help="Collections to search, the option can be repeated.")
+@click.option("-d", "--where", default="", help="Data ID query expression.")
+@click.option("--index", type=click.Path(dir_okay=False),
+              help="Summary index file, by default image_summary.sqlite3 in the repository root.")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), help="Number of threads to read the summaries.")
+def index_summaries(*args, **kwargs):
+    """Add flag counts and pixel statistics, stored in the headers of
+    DATASET_TYPE files, to the summary index"""
+    from ... import script
+    cli_handle_exception(script.indexSummaries, *args, **kwargs)
@@ -1,4 +1,19 @@
 import pkgutil
 __path__ = pkgutil.extend_path(__path__, __name__)
 
-from .spherex_image import *
+from .._lazy import lazy_exports
+
+# submodules are imported, when their names are first accessed,
+# the lists must match their __all__
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+    "flags": ["FlagExpression", "compile_flag_expression", "evaluate_flag_expression"],
+    "instrumentation": ["StageRecord", "stage", "instrumented", "current_stage", "enable_instrumentation",
+                        "disable_instrumentation", "flush_instrumentation", "instrumentation_enabled",
+                        "instrumentation_sinks", "configure_instrumentation", "LogSink", "JsonSink", "PrometheusSink"],
+    "summary": ["image_summary", "summary_to_header", "summary_from_header"],
+    "spherex_image": ["SPHERExImage", "spherex_image_reader", "spherex_image_component_reader",
+                      "spherex_image_writer"],
+    "spherex_hdf5": ["spherex_hdf5_reader", "spherex_hdf5_component_reader", "spherex_hdf5_writer",
+                     "configure_hdf5_decoding"],
+    "arithmetic": ["subtract_image"],
+})
@@ -0,0 +1,160 @@
+# In-place arithmetic on SPHEREx images
+#
+# Unlike `astropy.nddata.NDArithmetic` operations, which allocate new arrays
+# for every component, the functions in this module write into the buffers
+# of an existing image, using numpy ufuncs with ``out`` arguments.
+
+__all__ = ['subtract_image']
+
+import numpy as np
+from astropy.nddata import StdDevUncertainty, VarianceUncertainty
+
+from .spherex_image import SPHERExImage
+
+# ufuncs to combine the uncertainties of the operands of subtraction
+_UNCERTAINTY_UFUNCS = {
+    VarianceUncertainty: np.add,
+    StdDevUncertainty: np.hypot,
+}
+
+
+def subtract_image(image: SPHERExImage, subtrahend: SPHERExImage, out: SPHERExImage = None) -> SPHERExImage:
+    """Subtract image pixels, propagating uncertainty, flags and mask
+
+    Parameters
+    ----------
+    image : `SPHERExImage`
+        Image to subtract from.
+    subtrahend : `SPHERExImage`
+        Image to be subtracted, must have the same shape and unit as ``image``.
+    out : `SPHERExImage`, optional
+        Image to write the result into. Its components, which are present
+        in the operands, must be preallocated with the shape of ``image``.
+        If `None`, the result is written into ``image``.
+
+    Returns
+    -------
+    out : `SPHERExImage`
+        Image after subtraction: ``out`` or ``image`` if ``out`` is `None`.
+
+    Raises
+    ------
+    ValueError
+        Raised if the shapes, units, uncertainty types or flag definitions
+        of the images do not match.
+
+    Notes
+    -----
+    Each component is computed by a single ufunc call writing into the
+    buffer of ``out``: data are subtracted, variances are added (standard
+    deviations are added in quadrature), flag bits are OR-ed, and masks
+    are combined with logical OR. No full-frame temporary arrays are
+    allocated, except when only one of the operands has a component
+    (it is then copied into a new buffer) or when flags are not stored
+    as integers (they are converted to integers to OR the bits).
+
+    Data are subtracted in place only if ``out`` data are floating point:
+    integer data (raw images) would be truncated or wrap around, a new
+    array of the floating point `numpy.result_type` of the operands
+    (at least ``float32``) is then allocated.
+
+    If the flags of ``out`` cannot hold the flags of the operands without
+    loss (their `numpy.result_type` cannot be safely cast to the flags type
+    of ``out``), a new, wider flags array is allocated instead.
+    """
+    if out is None:
+        out = image
+    for other in (subtrahend, out):
+        if other.data.shape != image.data.shape:
+            raise ValueError(f"image shapes do not match: {image.data.shape} and {other.data.shape}")
+    if subtrahend.unit != image.unit:
+        raise ValueError(f"image units do not match: {image.unit} and {subtrahend.unit}")
+    if image.flag_defs and subtrahend.flag_defs and dict(image.flag_defs) != dict(subtrahend.flag_defs):
+        raise ValueError("flag definitions do not match")
+
+    data_out = _data_out(image.data, subtrahend.data, out.data)
+    if data_out is None:
+        out.data = np.subtract(image.data, subtrahend.data,
+                               dtype=_difference_type(image.data, subtrahend.data))
+    else:
+        np.subtract(image.data, subtrahend.data, out=data_out)
+    out.uncertainty = _combine_uncertainty(image.uncertainty, subtrahend.uncertainty, out.uncertainty)
+    flags = _flag_bits(image.flags), _flag_bits(subtrahend.flags)
+    out.flags = _combine(np.bitwise_or, *flags, _flags_out(*flags, out.flags))
+    out.mask = _combine(np.logical_or, image.mask, subtrahend.mask, out.mask)
+    out.unit = image.unit
+    out.flag_defs = image.flag_defs or subtrahend.flag_defs
+    return out
+
+
+def _combine(ufunc, a, b, out):
+    """Apply a binary ufunc to optional operands, writing into ``out``
+    if it is not `None`.
+    """
+    if a is None or b is None:
+        present = b if a is None else a
+        if present is None or present is out:
+            return present
+        if out is None:
+            return np.array(present)
+        out[...] = present
+        return out
+    if out is None:
+        return ufunc(a, b)
+    return ufunc(a, b, out=out)
+
+
+def _difference_type(a, b):
+    """Get the floating point data type of the difference of two arrays,
+    integers are subtracted as floats, so that differences do not wrap around
+    """
+    return np.result_type(a, b, np.float32)
+
+
+def _data_out(a, b, out):
+    """Get the data buffer to subtract into, `None` if ``out`` is not
+    a floating point array, which can hold the difference
+    """
+    if out.dtype.kind == 'f' and np.can_cast(_difference_type(a, b), out.dtype, 'same_kind'):
+        return out
+    return None
+
+
+def _flags_out(a, b, out):
+    """Get the flags buffer to OR the operand flags into, `None` if
+    ``out`` is too narrow for the result and a new array must be allocated.
+    """
+    operands = [flags for flags in (a, b) if flags is not None]
+    if out is None or not operands or np.can_cast(np.result_type(*operands), out.dtype):
+        return out
+    return None
+
+
+def _combine_uncertainty(a, b, out):
+    """Combine uncertainties of subtraction operands
+    """
+    if a is None and b is None:
+        return None
+    cls = type(a if a is not None else b)
+    if a is not None and b is not None and type(b) is not cls:
+        raise ValueError(f"uncertainty types do not match: {cls.__name__} and {type(b).__name__}")
+    ufunc = _UNCERTAINTY_UFUNCS.get(cls)
+    if ufunc is None:
+        raise ValueError(f"unsupported uncertainty type: {cls.__name__}")
+    out_array = out.array if type(out) is cls else None
+    array = _combine(ufunc,
+                     a.array if a is not None else None,
+                     b.array if b is not None else None,
+                     out_array)
+    if out_array is not None:
+        return out
+    return cls(array, unit=(a if a is not None else b).unit)
+
+
+def _flag_bits(flags):
+    """Get flags as an integer array, bitwise operations are not defined
+    for floating point arrays (flags of scaled FITS extensions).
+    """
+    if flags is None or np.issubdtype(flags.dtype, np.integer):
+        return flags
+    return flags.astype(np.int64)
@@ -0,0 +1,118 @@
+# Flag queries compiled into bitmasks
+#
+# A flag expression, given by flag names, is converted once into integer
+# bitmasks using the flag definitions of an image, so that evaluating it
+# over a flags plane costs at most four vectorized passes, which write
+# into one preallocated buffer, regardless of the number of flags.
+
+__all__ = ['FlagExpression', 'compile_flag_expression', 'evaluate_flag_expression']
+
+from collections import namedtuple
+
+import numpy as np
+
+FlagExpression = namedtuple('FlagExpression', ['any_bits', 'all_bits', 'none_bits'])
+"""Flag expression compiled into bitmasks: a pixel is selected, if any of
+``any_bits`` (unless it is zero), all of ``all_bits`` and none of
+``none_bits`` are set. Hashable, can be used as a cache key.
+"""
+
+
+def _flag_bitmask(flag_defs, names):
+    bitmask = 0
+    for name in names or ():
+        try:
+            bit = flag_defs[name.upper()]
+        except KeyError:
+            raise ValueError(f'unknown flag {name}, defined flags are {sorted(flag_defs)}') from None
+        bitmask |= 1 << int(bit)
+    return bitmask
+
+
+def compile_flag_expression(flag_defs, any_of=None, all_of=None, none_of=None) -> FlagExpression:
+    """Compile flag names into bitmasks
+
+    Parameters
+    ----------
+    flag_defs : dict-like object
+        Flag definitions, which map flag name to a bit in the flags array.
+    any_of : iterable [str], optional
+        Flags, at least one of which must be set.
+    all_of : iterable [str], optional
+        Flags, all of which must be set.
+    none_of : iterable [str], optional
+        Flags, none of which may be set.
+
+    Returns
+    -------
+    expression : `FlagExpression`
+
+    Raises
+    ------
+    ValueError
+        Raised if a flag is not defined or no flags are given.
+    """
+    expression = FlagExpression(_flag_bitmask(flag_defs, any_of), _flag_bitmask(flag_defs, all_of),
+                                _flag_bitmask(flag_defs, none_of))
+    if not any(expression):
+        raise ValueError('flag expression must include at least one flag')
+    return expression
+
+
+def _as_dtype(bitmask, dtype):
+    dtype = np.dtype(dtype)
+    if bitmask >> (8 * dtype.itemsize):
+        raise ValueError(f'flag bits {bitmask:#x} do not fit into flags of type {dtype}')
+    # wraps around for the sign bit of signed integers
+    return np.array(bitmask, dtype=np.uint64).astype(dtype)
+
+
+def evaluate_flag_expression(flags, expression: FlagExpression, out=None) -> np.ndarray:
+    """Select pixels, whose flags match the compiled expression
+
+    Parameters
+    ----------
+    flags : `numpy.ndarray`
+        Flags plane. Non-integer flags are converted to integers.
+    expression : `FlagExpression`
+        Compiled expression, see `compile_flag_expression`.
+    out : `numpy.ndarray`, optional
+        Boolean array of the shape of ``flags`` to write the result into.
+
+    Returns
+    -------
+    mask : `numpy.ndarray`
+        Boolean array, `True` for the selected pixels.
+
+    Raises
+    ------
+    ValueError
+        Raised if the expression tests bits, which the flags data type
+        does not have.
+
+    Notes
+    -----
+    ``all_of`` and ``none_of`` conditions are tested together with one
+    AND and one comparison: ``flags & (all | none) == all``. ``any_of``
+    adds one AND and one logical AND, so an expression with all kinds of
+    conditions takes four passes over the flags plane, plus a conversion
+    of non-integer flags. Intermediate values are written into one buffer
+    of the flags data type.
+    """
+    flags = np.asarray(flags)
+    if flags.dtype.kind not in 'iu':
+        flags = flags.astype(np.int64)
+    if out is None:
+        out = np.empty(flags.shape, dtype=bool)
+    buffer = np.empty(flags.shape, dtype=flags.dtype)
+    test_bits = expression.all_bits | expression.none_bits
+    if test_bits:
+        np.bitwise_and(flags, _as_dtype(test_bits, flags.dtype), out=buffer)
+        np.equal(buffer, _as_dtype(expression.all_bits, flags.dtype), out=out)
+    if expression.any_bits:
+        np.bitwise_and(flags, _as_dtype(expression.any_bits, flags.dtype), out=buffer)
+        if test_bits:
+            np.logical_and(out, buffer, out=out)
+        else:
+            np.not_equal(buffer, 0, out=out)
+    return out
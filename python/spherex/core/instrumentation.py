@@ -0,0 +1,526 @@
+# Per-stage timing and I/O instrumentation
+#
+# Readers, writers, formatters and tasks mark their stages with `stage`
+# or `instrumented`. While the instrumentation is disabled (the default),
+# a stage costs one check of a module flag and returns a shared no-op
+# record. When it is enabled, every stage produces a `StageRecord` with
+# its wall time, bytes read and written, number of decoded HDUs and,
+# optionally, peak traced allocation, which is passed to the sinks.
+# Stages nest: the name of a record is the path of the enclosing stages
+# of the same thread, for example, 'SPHERExImageFormatter.read/decode'.
+
+__all__ = ['StageRecord', 'stage', 'instrumented', 'current_stage', 'enable_instrumentation',
+           'disable_instrumentation', 'flush_instrumentation', 'instrumentation_enabled',
+           'instrumentation_sinks', 'configure_instrumentation', 'LogSink', 'JsonSink', 'PrometheusSink']
+
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+log = logging.getLogger(__name__)
+
+# enabled state, checked by every stage
+_enabled = False
+_sinks = ()
+_trace_memory = False
+# tracemalloc was started by enable_instrumentation
+_started_tracemalloc = False
+# stack of the active records of each thread
+_local = threading.local()
+
+
+class StageRecord:
+    """Measurements of one call of an instrumented stage
+
+    Attributes
+    ----------
+    name : str
+        Stage path: names of the enclosing stages and of this stage,
+        separated by ``/``.
+    labels : dict
+        Labels given to `stage`, for example, the file path.
+    start : float
+        Start time, seconds since the epoch.
+    wall : float
+        Wall time in seconds.
+    bytes_read, bytes_written : int
+        File bytes read and written by the stage and its sub-stages.
+    hdus : int
+        Number of HDUs, whose data were decoded or encoded.
+    peak_bytes : int or None
+        Peak memory allocated during the stage above the allocation at
+        its start, as traced by `tracemalloc`, ``None`` unless memory
+        tracing is enabled.
+    error : str or None
+        Name of the exception type, if the stage raised.
+
+    Notes
+    -----
+    The peak traced by `tracemalloc` is process-wide: it includes the
+    allocations of all threads, and every stage resets it when it starts.
+    ``peak_bytes`` is reliable for stages of one thread at a time. Stages
+    running concurrently in other threads add their allocations to it and
+    reset the peak under it, so it may be too high or too low.
+    """
+
+    __slots__ = ('name', 'labels', 'start', 'wall', 'bytes_read', 'bytes_written', 'hdus',
+                 'peak_bytes', 'error', '_parent', '_t0', '_mem0', '_peak')
+
+    def __init__(self, name, labels, parent=None):
+        self.name = name if parent is None else f'{parent.name}/{name}'
+        self.labels = labels
+        self.start = time.time()
+        self.wall = 0.
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.hdus = 0
+        self.peak_bytes = None
+        self.error = None
+        self._parent = parent
+        self._t0 = 0.
+        self._mem0 = 0
+        self._peak = 0
+
+    def add(self, bytes_read=0, bytes_written=0, hdus=0):
+        """Add to the counters of this stage and of the enclosing stages"""
+        record = self
+        while record is not None:
+            record.bytes_read += bytes_read
+            record.bytes_written += bytes_written
+            record.hdus += hdus
+            record = record._parent
+
+    def as_dict(self):
+        """Record as a dictionary, which can be serialized to json"""
+        return {'name': self.name, 'start': self.start, 'wall': self.wall,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'hdus': self.hdus, 'peak_bytes': self.peak_bytes, 'error': self.error,
+                'pid': os.getpid(), 'thread': threading.current_thread().name, **self.labels}
+
+    def __enter__(self):
+        stack = _stack()
+        if _trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # the peak is reset below: keep the peak of the enclosing stage
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._mem0 = self._peak = current
+        stack.append(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall = time.perf_counter() - self._t0
+        stack = _stack()
+        stack.pop()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        if _trace_memory and tracemalloc.is_tracing():
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            self.peak_bytes = self._peak - self._mem0
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, self._peak)
+        for sink in _sinks:
+            try:
+                sink.emit(self)
+            except Exception as e:
+                log.warning('instrumentation sink %r failed: %s', sink, e)
+        return False
+
+
+class _NullRecord:
+    """Record of a disabled stage: a context manager, which does nothing"""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, bytes_read=0, bytes_written=0, hdus=0):
+        pass
+
+
+_NULL_RECORD = _NullRecord()
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def stage(name, **labels):
+    """Instrument a stage
+
+    Parameters
+    ----------
+    name : str
+        Stage name.
+    **labels
+        Values added to the record, for example, ``path``.
+
+    Returns
+    -------
+    record : `StageRecord` or a no-op record
+        Context manager, which measures the stage. The record is false,
+        when the instrumentation is disabled, so that the cost of the
+        values passed to `StageRecord.add` can be avoided with
+        ``if record:``.
+
+    Examples
+    --------
+    >>> with stage('decode') as record:
+    ...     data = hdu.data
+    ...     record.add(bytes_read=data.nbytes, hdus=1)
+    """
+    if not _enabled:
+        return _NULL_RECORD
+    stack = _stack()
+    return StageRecord(name, labels, stack[-1] if stack else None)
+
+
+def current_stage():
+    """Get the innermost active stage of the calling thread
+
+    Returns
+    -------
+    record : `StageRecord` or a no-op record
+        The record or, if no stage is active or the instrumentation is
+        disabled, a no-op record, which is false.
+    """
+    if not _enabled:
+        return _NULL_RECORD
+    stack = _stack()
+    return stack[-1] if stack else _NULL_RECORD
+
+
+def instrumented(name=None):
+    """Decorator, which instruments every call of a function
+
+    Parameters
+    ----------
+    name : str, optional
+        Stage name, by default the qualified name of the function.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrumentation_enabled():
+    """Check if the instrumentation is enabled
+
+    Returns
+    -------
+    enabled : bool
+    """
+    return _enabled
+
+
+def enable_instrumentation(*sinks, trace_memory=False):
+    """Enable the instrumentation in this process
+
+    Parameters
+    ----------
+    *sinks
+        Objects with ``emit(record)`` and ``flush()`` methods, which receive
+        every `StageRecord`, for example, `LogSink`, `JsonSink` and
+        `PrometheusSink`. Sinks must be thread-safe. Replace the sinks
+        of the previous call.
+    trace_memory : bool, optional
+        If ``True``, measure peak allocation of every stage with
+        `tracemalloc`, starting it if needed. Tracing slows down
+        allocation-heavy code considerably. The peak is process-wide, so
+        peaks of stages running concurrently in several threads are not
+        reliable, see `StageRecord`.
+    """
+    global _enabled, _sinks, _trace_memory, _started_tracemalloc
+    flush_instrumentation()
+    _sinks = tuple(sinks)
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _enabled = True
+
+
+def disable_instrumentation():
+    """Disable the instrumentation and flush the sinks"""
+    global _enabled, _sinks, _trace_memory, _started_tracemalloc
+    _enabled = False
+    flush_instrumentation()
+    _sinks = ()
+    _trace_memory = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+@contextlib.contextmanager
+def instrumentation_sinks(*sinks):
+    """Add sinks to the instrumentation while the context is active
+
+    The instrumentation is enabled, if it is not. On exit, the added sinks
+    are flushed and the previous sinks and enabled state are restored.
+
+    Parameters
+    ----------
+    *sinks
+        Sinks to add, see `enable_instrumentation`.
+
+    Examples
+    --------
+    >>> with instrumentation_sinks(LogSink()):
+    ...     spherex_image_reader(path)
+    """
+    global _enabled, _sinks
+    previous = _enabled, _sinks
+    _sinks = (_sinks if _enabled else ()) + tuple(sinks)
+    _enabled = True
+    try:
+        yield
+    finally:
+        _enabled, _sinks = previous
+        for sink in sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                log.warning('instrumentation sink %r failed: %s', sink, e)
+
+
+def flush_instrumentation():
+    """Flush the sinks
+
+    Sinks are flushed, when the instrumentation is disabled and at the
+    interpreter exit. Processes, which exit without running the exit
+    handlers, like the workers of `multiprocessing` pools, should flush
+    the sinks after each unit of work.
+    """
+    for sink in _sinks:
+        try:
+            sink.flush()
+        except Exception as e:
+            log.warning('instrumentation sink %r failed: %s', sink, e)
+
+
+atexit.register(flush_instrumentation)
+
+
+def configure_instrumentation(config):
+    """Configure the instrumentation in this process
+
+    Parameters
+    ----------
+    config : `lsst.daf.butler.Config` or dict
+        Butler configuration. Instrumentation parameters are read from
+        ``spherex.instrumentation`` section: ``enabled``, ``traceMemory``
+        and ``sinks``, a list of sink definitions, each with ``type``
+        (``log``, ``json`` or ``prometheus``) and the parameters of the
+        sink class (``level``, ``path``, ``interval``, ``prefix``).
+        The instrumentation is disabled, if the section is missing or
+        ``enabled`` is false.
+
+    Returns
+    -------
+    enabled : bool
+        ``True`` if the instrumentation is enabled.
+
+    Raises
+    ------
+    ValueError
+        Raised if a sink type is not supported.
+    """
+    section = (config.get('spherex') or {}).get('instrumentation') or {}
+    if not section.get('enabled', False):
+        disable_instrumentation()
+        return False
+    sinks = []
+    for definition in section.get('sinks') or [{'type': 'log'}]:
+        definition = dict(definition)
+        sink_type = definition.pop('type')
+        if sink_type not in _SINK_TYPES:
+            raise ValueError(f'unknown instrumentation sink {sink_type}, '
+                             f'supported sinks are {sorted(_SINK_TYPES)}')
+        sinks.append(_SINK_TYPES[sink_type](**definition))
+    enable_instrumentation(*sinks, trace_memory=section.get('traceMemory', False))
+    log.debug('Enabled instrumentation with sinks %s', sinks)
+    return True
+
+
+def _format_path(path):
+    # separate files per process, for example, of the pipeline workers
+    return path.format(pid=os.getpid())
+
+
+class LogSink:
+    """Log every record
+
+    Parameters
+    ----------
+    level : int or str, optional
+        Logging level.
+    logger : str, optional
+        Logger name.
+    """
+
+    def __init__(self, level=logging.INFO, logger=__name__):
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self._log = logging.getLogger(logger)
+
+    def emit(self, record):
+        if not self._log.isEnabledFor(self.level):
+            return
+        peak = '' if record.peak_bytes is None else f' peak {record.peak_bytes} B'
+        labels = ''.join(f' {key}={value}' for key, value in record.labels.items())
+        self._log.log(self.level, '%s %.3f ms read %d B written %d B hdus %d%s%s%s',
+                      record.name, record.wall * 1e3, record.bytes_read, record.bytes_written,
+                      record.hdus, peak, labels, f' error {record.error}' if record.error else '')
+
+    def flush(self):
+        pass
+
+    def __repr__(self):
+        return f'LogSink(level={logging.getLevelName(self.level)})'
+
+
+class JsonSink:
+    """Append every record as a line of json to a file
+
+    Parameters
+    ----------
+    path : str
+        File path. ``{pid}`` is replaced with the process id.
+    """
+
+    def __init__(self, path):
+        self.path = _format_path(path)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def emit(self, record):
+        line = json.dumps(record.as_dict(), default=str) + '\n'
+        with self._lock:
+            if self._file is None:
+                # line buffered: every record is written, when it is emitted
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(line)
+
+    def flush(self):
+        # the file is opened again by the next record
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __repr__(self):
+        return f'JsonSink({self.path!r})'
+
+
+# metrics of PrometheusSink: name suffix, type and help
+_PROMETHEUS_METRICS = (
+    ('calls_total', 'counter', 'Number of calls of the stage'),
+    ('seconds_total', 'counter', 'Wall time of the stage'),
+    ('errors_total', 'counter', 'Number of calls, which raised'),
+    ('bytes_read_total', 'counter', 'File bytes read by the stage'),
+    ('bytes_written_total', 'counter', 'File bytes written by the stage'),
+    ('hdus_total', 'counter', 'HDUs decoded or encoded by the stage'),
+    ('peak_bytes', 'gauge', 'Maximum peak traced allocation of the stage'),
+)
+
+
+class PrometheusSink:
+    """Aggregate records by stage into a Prometheus textfile
+
+    The file can be exported by the textfile collector of the Prometheus
+    node exporter. It is replaced atomically, when the sink is flushed
+    and at most every ``interval`` seconds, when records are emitted.
+
+    Parameters
+    ----------
+    path : str
+        File path, which should end with ``.prom``. ``{pid}`` is replaced
+        with the process id, so that every process writes its own file.
+    interval : float, optional
+        Minimum time between file updates in seconds.
+    prefix : str, optional
+        Metric name prefix.
+    """
+
+    def __init__(self, path, interval=10., prefix='spherex_stage'):
+        self.path = _format_path(path)
+        self.interval = interval
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._written = time.monotonic()
+
+    def emit(self, record):
+        with self._lock:
+            values = self._stages.get(record.name)
+            if values is None:
+                values = self._stages[record.name] = dict.fromkeys(
+                    (metric for metric, _, _ in _PROMETHEUS_METRICS), 0)
+            values['calls_total'] += 1
+            values['seconds_total'] += record.wall
+            values['errors_total'] += record.error is not None
+            values['bytes_read_total'] += record.bytes_read
+            values['bytes_written_total'] += record.bytes_written
+            values['hdus_total'] += record.hdus
+            if record.peak_bytes is not None:
+                values['peak_bytes'] = max(values['peak_bytes'], record.peak_bytes)
+            if time.monotonic() - self._written >= self.interval:
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            if self._stages:
+                self._write()
+
+    def _write(self):
+        lines = []
+        for metric, metric_type, description in _PROMETHEUS_METRICS:
+            name = f'{self.prefix}_{metric}'
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+            for stage_name, values in sorted(self._stages.items()):
+                lines.append(f'{name}{{stage="{_escape_label(stage_name)}"}} {values[metric]}')
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        # the collector never sees a partially written file
+        os.replace(tmp, self.path)
+        self._written = time.monotonic()
+
+    def __repr__(self):
+        return f'PrometheusSink({self.path!r})'
+
+
+def _escape_label(value):
+    return re.sub(r'(["\\])', r'\\\1', value).replace('\n', r'\n')
+
+
+_SINK_TYPES = {'log': LogSink, 'json': JsonSink, 'prometheus': PrometheusSink}
@@ -0,0 +1,436 @@
+# SPHEREx Image can be stored in an HDF5 file with
+#    image, flags, variance and mask datasets,
+#    each chunked and compressed, with the FITS header of the
+#    corresponding extension (including WCS and flag definitions)
+#    in its 'header' attribute
+# Chunks overlapping a section are read and decoded in parallel
+
+__all__ = ['spherex_hdf5_reader', 'spherex_hdf5_component_reader', 'spherex_hdf5_writer',
+           'configure_hdf5_decoding']
+
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+from astropy.io import fits
+from astropy.nddata import StdDevUncertainty
+from astropy.nddata.ccddata import _generate_wcs_and_update_header, _unc_name_to_cls
+
+from .instrumentation import instrumented, stage
+from .spherex_image import (IMAGE_COMPONENTS, SPHERExImage, _apply_section, _get_flag_defs, _get_unit,
+                            _image_planes, _normalize_section, _planes_summary, _to_variance)
+from .summary import summary_from_header
+
+# default chunk shape: 256 KB of float32 pixels, 64 chunks per detector
+CHUNK_SHAPE = (256, 256)
+
+# compression filters, whose chunks are decoded by the reader in parallel,
+# other filters are decoded by h5py, one chunk at a time
+PARALLEL_COMPRESSION = (None, 'gzip')
+
+
+def _open(filename, mode='r'):
+    with stage('open'):
+        return h5py.File(filename, mode)
+
+
+def _header(obj):
+    """FITS header stored in the attributes of an HDF5 object"""
+    return fits.Header.fromstring(obj.attrs['header'])
+
+
+def _get_dataset(h5file, name):
+    """Get dataset by its name, None if the name is None or missing"""
+    if name is None or name not in h5file:
+        return None
+    return h5file[name]
+
+
+def _decodable(dataset):
+    """Check if the reader can decode the chunks of a dataset itself"""
+    return (dataset.chunks is not None and dataset.compression in PARALLEL_COMPRESSION
+            and not dataset.fletcher32 and dataset.scaleoffset is None)
+
+
+def _decode_chunk(raw, dataset):
+    """Decode a stored chunk into an array of the chunk shape
+
+    Parameters
+    ----------
+    raw : `bytes`
+        Chunk bytes, read with ``read_direct_chunk``.
+    dataset : `h5py.Dataset`
+
+    Returns
+    -------
+    chunk : `numpy.ndarray`
+    """
+    if dataset.compression == 'gzip':
+        # zlib releases the GIL: chunks are decoded in parallel
+        raw = zlib.decompress(raw)
+    dtype = dataset.dtype
+    if dataset.shuffle and dtype.itemsize > 1:
+        # shuffle filter stores the first bytes of all elements,
+        # then the second bytes, etc.
+        raw = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.copy()
+    return np.frombuffer(raw, dtype=dtype).reshape(dataset.chunks)
+
+
+def _chunk_starts(section, chunks):
+    """Offsets of the chunks overlapping a section, in chunk grid order"""
+    ranges = [range(s.start // c * c, s.stop, c) for s, c in zip(section, chunks)]
+    return [(y, x) for y in ranges[0] for x in ranges[1]]
+
+
+def _read_dataset(dataset, section=None, executor=None):
+    """Read a dataset or its section, decoding the chunks in parallel
+
+    Parameters
+    ----------
+    dataset : `h5py.Dataset`
+    section : `tuple` [`slice`], optional
+        Normalized section, see `_normalize_section`. If None, the whole
+        dataset is read.
+    executor : `concurrent.futures.Executor`, optional
+        Executor, which decodes the chunks. If None, the chunks are
+        decoded in the calling thread.
+
+    Returns
+    -------
+    data : `numpy.ndarray`
+    """
+    with stage('decode') as record:
+        if section is None:
+            section = tuple(slice(0, n) for n in dataset.shape)
+        if not _decodable(dataset) or dataset.ndim != 2:
+            data = dataset[section]
+            if record:
+                record.add(bytes_read=data.nbytes, hdus=1)
+            return data
+
+        out = np.empty([s.stop - s.start for s in section], dtype=dataset.dtype)
+        chunks = dataset.chunks
+
+        def read_chunk(start):
+            # overlap of the chunk and the section in file and output coordinates
+            src = tuple(slice(max(s.start, c), min(s.stop, c + n)) for s, c, n in zip(section, start, chunks))
+            dst = tuple(slice(s.start - o.start, s.stop - o.start) for s, o in zip(src, section))
+            filter_mask, raw = dataset.id.read_direct_chunk(start)
+            if filter_mask:
+                # a filter was skipped for this chunk
+                out[dst] = dataset[src]
+            else:
+                chunk = _decode_chunk(raw, dataset)
+                out[dst] = chunk[tuple(slice(s.start - c, s.stop - c) for s, c in zip(src, start))]
+            return len(raw)
+
+        starts = _chunk_starts(section, chunks)
+        if executor is None or len(starts) == 1:
+            nbytes = sum(map(read_chunk, starts))
+        else:
+            nbytes = sum(executor.map(read_chunk, starts))
+        if record:
+            record.add(bytes_read=nbytes, hdus=1)
+    return out
+
+
+# thread pool shared by the readers without ``jobs``, see _executor,
+# and its number of threads, None for one per CPU
+_decode_pool = None
+_decode_threads = None
+_decode_pool_lock = threading.Lock()
+
+
+def _reset_decode_pool():
+    global _decode_pool
+    _decode_pool = None
+
+
+# the pool threads do not exist in a forked child process
+os.register_at_fork(after_in_child=_reset_decode_pool)
+
+
+def _shared_decode_pool():
+    """Get the process-wide pool, None if it has a single thread"""
+    global _decode_pool
+    with _decode_pool_lock:
+        threads = _decode_threads or os.cpu_count() or 1
+        if _decode_pool is None and threads > 1:
+            _decode_pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='hdf5-decode')
+        return _decode_pool
+
+
+def configure_hdf5_decoding(config):
+    """Configure the pool of threads decoding HDF5 chunks in this process
+
+    Parameters
+    ----------
+    config : `lsst.daf.butler.Config` or dict
+        Butler configuration. ``threads`` in ``spherex.hdf5Decoding``
+        section is the number of threads shared by all readers, which are
+        called without ``jobs`` (`~spherex.formatters.SPHERExHDF5Formatter`
+        reads), one per CPU if it is missing or null. With one thread,
+        chunks are decoded by the reading thread.
+
+    Returns
+    -------
+    threads : int
+        Number of decoding threads.
+
+    Raises
+    ------
+    ValueError
+        Raised if the number of threads is not positive.
+    """
+    global _decode_pool, _decode_threads
+    section = (config.get('spherex') or {}).get('hdf5Decoding') or {}
+    threads = section.get('threads')
+    if threads is not None and int(threads) < 1:
+        raise ValueError(f'number of decoding threads must be positive, got {threads}')
+    with _decode_pool_lock:
+        pool, _decode_pool = _decode_pool, None
+        _decode_threads = None if threads is None else int(threads)
+    if pool is not None:
+        # reads in progress finish on the old pool
+        pool.shutdown(wait=False)
+    return _decode_threads or os.cpu_count() or 1
+
+
+@contextmanager
+def _executor(jobs):
+    """Executor decoding the chunks: the shared pool if ``jobs`` is None,
+    a pool of ``jobs`` threads, which is shut down on exit, or None for
+    a single job or thread
+    """
+    if jobs is None:
+        yield _shared_decode_pool()
+    elif jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            yield executor
+    else:
+        yield None
+
+
+def _read_frame(h5file):
+    """Get image header and WCS, see `~spherex.core.spherex_image._read_frame`"""
+    with stage('header'):
+        image = h5file['image']
+        hdr = _header(image)
+        # image dimensions, as in a FITS header, define the WCS pixel shape
+        hdr['NAXIS'] = image.ndim
+        for axis, n in enumerate(reversed(image.shape), start=1):
+            hdr[f'NAXIS{axis}'] = n
+    with stage('wcs'):
+        hdr, wcs = _generate_wcs_and_update_header(hdr)
+    return hdr, wcs
+
+
+@instrumented()
+def spherex_hdf5_reader(filename, unit=None, hdu_uncertainty='variance', hdu_mask='mask',
+                        hdu_flags='flags', key_uncertainty_type='UTYPE', section=None,
+                        jobs=None) -> SPHERExImage:
+    """
+    Generate a SPHERExImage object from an HDF5 file written by
+    `spherex_hdf5_writer`.
+
+    Parameters
+    ----------
+    filename : str or file-like object
+        Name of HDF5 file.
+
+    unit : `~astropy.units.Unit`, optional
+        Units of the image data, which override the unit stored in the file.
+        Default is ``None``.
+
+    hdu_uncertainty, hdu_mask, hdu_flags : str or None, optional
+        Datasets, from which the uncertainty, mask and flags are initialized.
+        If None or the dataset does not exist, the component is ``None``.
+        Default is ``'variance'``, ``'mask'`` and ``'flags'``.
+
+    key_uncertainty_type : str, optional
+        The header key name where the class name of the uncertainty is stored.
+        Default is ``'UTYPE'``.
+
+    section : `tuple` [`slice`], optional
+        Section of the image to read in numpy (row, column) order. Only the
+        chunks overlapping the section are read, and the WCS and the
+        ``LTV1``/``LTV2`` header keywords are shifted accordingly.
+        Default is ``None``, which means the whole image is read.
+
+    jobs : int or None, optional
+        Number of threads decoding the chunks. Default is ``None``, which
+        means a pool shared by all readers in the process, with a thread
+        per CPU, unless configured otherwise, see `configure_hdf5_decoding`.
+
+    Returns
+    -------
+    spherex_image : `~spherex.core.SPHERExImage`
+
+    Notes
+    -----
+    Stored chunks are read by h5py one at a time, but decoded (inflated
+    and unshuffled) in parallel. Chunks compressed with filters other than
+    ``gzip`` are read and decoded by h5py.
+    """
+    with _executor(jobs) as executor, _open(filename) as h5file:
+        hdr, wcs = _read_frame(h5file)
+        use_unit = _get_unit(hdr, unit)
+        with stage('wcs'):
+            section, wcs = _apply_section(section, h5file['image'].shape, hdr, wcs)
+        data = _read_dataset(h5file['image'], section, executor)
+
+        flag_defs = flags = uncertainty = mask = None
+        flags_dataset = _get_dataset(h5file, hdu_flags)
+        if flags_dataset is not None:
+            flag_defs = _get_flag_defs(_header(flags_dataset))
+            flags = _read_dataset(flags_dataset, section, executor)
+        unc_dataset = _get_dataset(h5file, hdu_uncertainty)
+        if unc_dataset is not None:
+            stored_unc_name = _header(unc_dataset).get(key_uncertainty_type, 'None')
+            unc_type = _unc_name_to_cls.get(stored_unc_name, StdDevUncertainty)
+            uncertainty = unc_type(_read_dataset(unc_dataset, section, executor))
+        mask_dataset = _get_dataset(h5file, hdu_mask)
+        if mask_dataset is not None:
+            mask = _read_dataset(mask_dataset, section, executor).astype(bool)
+
+    spherex_image = SPHERExImage(data, meta=hdr, unit=use_unit, wcs=wcs, flag_defs=flag_defs)
+    for name, value in (('flags', flags), ('uncertainty', uncertainty), ('mask', mask)):
+        if value is not None:
+            setattr(spherex_image, name, value)
+    return spherex_image
+
+
+@instrumented()
+def spherex_hdf5_component_reader(filename, component, hdu_uncertainty='variance', hdu_flags='flags',
+                                  key_uncertainty_type='UTYPE', section=None, jobs=None):
+    """
+    Read a single component of a SPHEREx image from an HDF5 file.
+
+    Header components (``metadata``, ``wcs``, ``flag_defs`` and ``summary``)
+    are read from the attributes, array components read only the chunks
+    of one dataset.
+
+    Parameters
+    ----------
+    filename : str or file-like object
+        Name of HDF5 file.
+
+    component : str
+        Component to read, see `spherex_image_component_reader`.
+
+    hdu_uncertainty, hdu_flags, key_uncertainty_type, section, jobs
+        See `spherex_hdf5_reader`.
+
+    Returns
+    -------
+    value : object
+        Component value, ``None`` if the dataset with the component
+        does not exist.
+    """
+    if component not in IMAGE_COMPONENTS:
+        raise ValueError(f'unknown component {component}, supported components are {IMAGE_COMPONENTS}')
+    with _open(filename) as h5file:
+        flags_dataset = _get_dataset(h5file, hdu_flags)
+        if component == 'flag_defs':
+            return None if flags_dataset is None else _get_flag_defs(_header(flags_dataset))
+        if component == 'summary':
+            summary = None if flags_dataset is None else summary_from_header(_header(flags_dataset))
+            return summary if summary is not None else summary_from_header(_header(h5file['image']))
+        if component in ('metadata', 'wcs'):
+            hdr, wcs = _read_frame(h5file)
+            section, wcs = _apply_section(section, h5file['image'].shape, hdr, wcs)
+            return wcs if component == 'wcs' else hdr
+
+        if component == 'flags':
+            dataset = flags_dataset
+        elif component == 'variance':
+            dataset = _get_dataset(h5file, hdu_uncertainty)
+        else:
+            dataset = h5file['image']
+        if dataset is None:
+            return None
+        if section is not None:
+            section = _normalize_section(section, dataset.shape)
+        with _executor(jobs) as executor:
+            data = _read_dataset(dataset, section, executor)
+        if component == 'variance':
+            stored_unc_name = _header(dataset).get(key_uncertainty_type, 'None')
+            return _to_variance(_unc_name_to_cls.get(stored_unc_name, StdDevUncertainty), data)
+        return data
+
+
+@instrumented()
+def spherex_hdf5_writer(spherex_image: SPHERExImage, fileobj, chunks=CHUNK_SHAPE, compression='gzip',
+                        compression_opts=1, shuffle=True, wcs_relax=True, key_uncertainty_type='UTYPE',
+                        overwrite=False, summary=False, compact_flags=True):
+    """Write `~spherex.core.SPHERExImage` to an HDF5 file
+
+    Parameters
+    ----------
+    spherex_image : `~spherex.core.SPHERExImage`
+
+    fileobj : str or file-like object
+        File name or binary file object.
+
+    chunks : `tuple` [`int`], optional
+        Chunk shape of the image, flags, variance and mask datasets,
+        the unit of partial reads and parallel decoding. It is clipped
+        to the image shape. Default is ``(256, 256)``.
+
+    compression : str or None, optional
+        HDF5 compression filter: ``'gzip'`` (decoded in parallel by the
+        reader), ``'lzf'`` or ``None``. Default is ``'gzip'``.
+
+    compression_opts : int or None, optional
+        Compression level of ``gzip``. Default is ``1``.
+
+    shuffle : bool, optional
+        If ``True``, bytes of the elements are shuffled before compression,
+        which improves compression of floating point data.
+        Default is ``True``.
+
+    wcs_relax, key_uncertainty_type, overwrite, summary, compact_flags
+        See `spherex_image_writer`.
+
+    Returns
+    -------
+    summary : dict or None
+        Image summary stored in the file, if ``summary`` is ``True``,
+        otherwise ``None``.
+
+    Notes
+    -----
+    Datasets are named ``image``, ``flags``, ``variance`` and ``mask``.
+    Each has a ``header`` attribute with the FITS header, which the
+    FITS writer would store in the corresponding extension: metadata,
+    unit and WCS for the image, flag definitions for the flags
+    and uncertainty type for the variance. Mask is stored as bytes.
+    """
+    with stage('prepare'):
+        planes = _image_planes(spherex_image, hdu_mask='MASK', hdu_uncertainty='VARIANCE',
+                               hdu_flags='FLAGS', wcs_relax=wcs_relax,
+                               key_uncertainty_type=key_uncertainty_type, summary=summary,
+                               compact_flags=compact_flags)
+
+    with stage('write') as record:
+        with _open(fileobj, 'w' if overwrite else 'w-') as h5file:
+            for extension, header, array in planes:
+                if array.dtype.kind == 'b':
+                    array = array.view(np.uint8)
+                dataset_chunks = None
+                if chunks is not None and array.ndim == len(chunks):
+                    dataset_chunks = tuple(min(c, n) for c, n in zip(chunks, array.shape))
+                dataset = h5file.create_dataset(
+                    extension, data=array, chunks=dataset_chunks, compression=compression,
+                    compression_opts=compression_opts if compression == 'gzip' else None,
+                    shuffle=shuffle and compression is not None)
+                dataset.attrs['header'] = header.tostring()
+        if record:
+            if isinstance(fileobj, (str, os.PathLike)):
+                record.add(bytes_written=os.path.getsize(fileobj))
+            record.add(hdus=len(planes))
+    return _planes_summary(planes) if summary else None
@@ -4,11 +4,40 @@
 #    image extension
 #    flags extension
 #    variance extension
+#    mask extension
+# Image extensions can be tile-compressed, the reader decompresses them transparently
 
-__all__ = ['SPHERExImage', 'spherex_image_reader', 'spherex_image_writer']
+__all__ = ['SPHERExImage', 'spherex_image_reader', 'spherex_image_component_reader',
+           'spherex_image_writer']
 
+import copy
+import os
+import weakref
+
+import numpy as np
+from astropy import log
+from astropy import units as u
 from astropy.io import fits, registry
-from astropy.nddata import CCDData, fits_ccddata_reader, FlagCollection
+from astropy.nddata import (CCDData, FlagCollection, InverseVariance, StdDevUncertainty,
+                            VarianceUncertainty)
+from astropy.nddata.ccddata import _generate_wcs_and_update_header, _known_uncertainties, _unc_name_to_cls
+
+from .flags import compile_flag_expression, evaluate_flag_expression
+from .instrumentation import instrumented, stage
+from .summary import _remove_summary, image_summary, summary_from_header, summary_to_header
+
+# image extensions, which can be tile-compressed, see `spherex_image_writer`
+COMPRESSED_EXTENSIONS = ('image', 'variance', 'mask', 'flags')
+
+# components, which can be read without reading the whole image,
+# see `spherex_image_component_reader`
+IMAGE_COMPONENTS = ('metadata', 'wcs', 'flag_defs', 'image', 'flags', 'variance', 'summary')
+
+# FITS block size in bytes
+BLOCK_SIZE = 2880
+
+# approximate size of the data chunk converted at a time by the writer
+WRITE_CHUNK_BYTES = 1 << 20
 
 FLAG_DEFS = {
     'NONFUNC': 2,
@@ -78,8 +107,12 @@ class SPHERExImage(CCDData):
     def __init__(self, *args, **kwargs):
         if 'flags' in kwargs and isinstance(kwargs['flags'], FlagCollection):
             raise NotImplementedError('Flag collection is not supported')
-        if 'flag_defs' in kwargs:
-            self._flag_defs = kwargs.pop('flag_defs')
+        # loaders of the components, which are read on first access
+        self._deferred = {}
+        self._release = None
+        # boolean masks of flag expressions, see flag_mask
+        self._flag_masks = {}
+        self._flag_defs = kwargs.pop('flag_defs', None)
         super().__init__(*args, **kwargs)
 
     @property
@@ -88,8 +121,164 @@ class SPHERExImage(CCDData):
 
     @flag_defs.setter
     def flag_defs(self, value):
+        self._flag_masks.clear()
         self._flag_defs = value
 
+    @property
+    def uncertainty(self):
+        self._load_deferred('uncertainty')
+        return CCDData.uncertainty.fget(self)
+
+    @uncertainty.setter
+    def uncertainty(self, value):
+        self._deferred.pop('uncertainty', None)
+        CCDData.uncertainty.fset(self, value)
+
+    @property
+    def mask(self):
+        self._load_deferred('mask')
+        return CCDData.mask.fget(self)
+
+    @mask.setter
+    def mask(self, value):
+        self._deferred.pop('mask', None)
+        CCDData.mask.fset(self, value)
+
+    @property
+    def flags(self):
+        self._load_deferred('flags')
+        return CCDData.flags.fget(self)
+
+    @flags.setter
+    def flags(self, value):
+        self._deferred.pop('flags', None)
+        self._flag_masks.clear()
+        CCDData.flags.fset(self, value)
+
+    def flag_mask(self, any_of=None, all_of=None, none_of=None, cache=True):
+        """Select pixels by their flags
+
+        Parameters
+        ----------
+        any_of : iterable [str], optional
+            Flags, at least one of which must be set, for example,
+            ``["SATURATED", "HOT"]``.
+        all_of : iterable [str], optional
+            Flags, all of which must be set.
+        none_of : iterable [str], optional
+            Flags, none of which may be set.
+        cache : bool, optional
+            If ``True``, the mask is kept and returned by the next calls
+            with the same flags, until ``flags`` or ``flag_defs`` are
+            replaced. Cached masks are read-only.
+
+        Returns
+        -------
+        mask : `numpy.ndarray`
+            Boolean array, ``True`` for the selected pixels.
+
+        Raises
+        ------
+        ValueError
+            Raised if the image has no flags, a flag is not defined,
+            its bit does not fit into the flags data type or no flags
+            are given.
+
+        Notes
+        -----
+        Flag names are looked up in ``flag_defs`` or, if the image has no
+        flag definitions, in the default `FLAG_DEFS`. The expression is
+        compiled into bitmasks and evaluated in vectorized passes over the
+        flags plane, see `~spherex.core.evaluate_flag_expression`. Cached
+        masks are not updated, when flags are modified in place.
+        """
+        if self.flags is None:
+            raise ValueError('image has no flags')
+        expression = compile_flag_expression(self.flag_defs or FLAG_DEFS, any_of, all_of, none_of)
+        mask = self._flag_masks.get(expression)
+        if mask is None:
+            mask = evaluate_flag_expression(self.flags, expression)
+            if cache:
+                mask.setflags(write=False)
+                self._flag_masks[expression] = mask
+        return mask
+
+    def flag_pixels(self, any_of=None, all_of=None, none_of=None, cache=True):
+        """Get indices of the pixels selected by their flags
+
+        Parameters
+        ----------
+        any_of, all_of, none_of, cache
+            See `flag_mask`.
+
+        Returns
+        -------
+        indices : `tuple` [`numpy.ndarray`]
+            Indices of the selected pixels in numpy (row, column) order,
+            as returned by `numpy.nonzero`.
+        """
+        return np.nonzero(self.flag_mask(any_of=any_of, all_of=all_of, none_of=none_of, cache=cache))
+
+    def copy(self):
+        """Return a deep copy of the image with writeable arrays.
+
+        Unlike `~astropy.nddata.CCDData.copy`, flags and flag definitions
+        are copied too. Deferred components are loaded first.
+        """
+        self.load()
+        return copy.deepcopy(self)
+
+    def __copy__(self):
+        """Shallow copy: component arrays are shared, metadata and cached
+        flag masks are not. Deferred components are loaded first."""
+        self.load()
+        copied = self.__class__.__new__(self.__class__)
+        copied.__dict__.update(self.__dict__)
+        copied._flag_masks = dict(self._flag_masks)
+        copied._deferred = {}
+        copied.meta = self.meta.copy()
+        return copied
+
+    def load(self):
+        """Load all components, which have not been accessed yet."""
+        for name in list(self._deferred):
+            self._load_deferred(name)
+
+    def _defer(self, loaders, release=None):
+        """Defer loading of components until they are first accessed.
+
+        Parameters
+        ----------
+        loaders : `dict` [`str`, callable]
+            Maps component name (``'uncertainty'``, ``'mask'`` or ``'flags'``)
+            to a function with no arguments, which returns the component value.
+        release : callable, optional
+            Function to call, when all deferred components are loaded.
+            Used to release the file handle the loaders depend on.
+        """
+        self._deferred.update(loaders)
+        self._release = release
+        if not self._deferred:
+            self._release_deferred()
+
+    def _load_deferred(self, name):
+        loader = self._deferred.pop(name, None)
+        if loader is None:
+            return
+        getattr(CCDData, name).fset(self, loader())
+        if not self._deferred:
+            self._release_deferred()
+
+    def _release_deferred(self):
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+    def __getstate__(self):
+        # loaders reference open files, which can not be pickled
+        self.load()
+        return self.__dict__
+
 
 def _get_flag_defs(header: fits.Header):
     """Get flag definition dictionary from the the header
@@ -141,9 +330,144 @@ def _add_flag_defs(spherex_image: SPHERExImage, header: fits.Header) -> None:
         header[f'{prefix}{key.upper()}'] = val
 
 
+def _get_hdu(hdus: fits.HDUList, key):
+    """Get HDU by its index or name
+
+    Parameters
+    ----------
+    hdus : `~astropy.io.fits.HDUList`
+    key : str or int or None
+        Extension name or index.
+
+    Returns
+    -------
+    hdu : `~astropy.io.fits.hdu.base.ExtensionHDU` or None
+        None is returned, when key is None or the extension does not exist.
+    """
+    if key is None:
+        return None
+    try:
+        return hdus[key]
+    except (KeyError, IndexError):
+        return None
+
+
+def _get_unit(header: fits.Header, unit=None):
+    """Get image data unit
+
+    Parameters
+    ----------
+    header : dict-like object
+        Image header, where the unit is stored in ``BUNIT`` keyword.
+    unit : `~astropy.units.Unit` or str, optional
+        Unit, which overrides the unit from the header.
+
+    Returns
+    -------
+    unit : `~astropy.units.Unit` or str or None
+    """
+    fits_unit_string = header.get('BUNIT')
+    if not fits_unit_string:
+        return unit
+    # handle FITS files using ADU instead of the standard 'adu'
+    if fits_unit_string.strip().lower() == 'adu':
+        fits_unit_string = fits_unit_string.lower()
+    if unit is not None:
+        if str(unit) != str(fits_unit_string):
+            log.info(f'using the unit {unit} passed to the FITS reader instead '
+                     f'of the unit {fits_unit_string} in the FITS file.')
+        return unit
+    try:
+        return u.Unit(fits_unit_string)
+    except ValueError:
+        raise ValueError(f'The Header value for the key BUNIT ({fits_unit_string}) '
+                         'cannot be interpreted as valid unit.')
+
+
+def _normalize_section(section, shape):
+    """Convert a section into slices with explicit non-negative bounds
+
+    Parameters
+    ----------
+    section : `tuple` [`slice`]
+        Section of an image in numpy (row, column) order.
+    shape : `tuple` [`int`]
+        Image shape.
+
+    Returns
+    -------
+    section : `tuple` [`slice`]
+    """
+    if len(section) != len(shape):
+        raise ValueError(f'section {section} does not match image dimensions {shape}')
+    normalized = []
+    for s, n in zip(section, shape):
+        if not isinstance(s, slice):
+            raise ValueError(f'section must be a tuple of slices, got {section}')
+        start, stop, step = s.indices(n)
+        if step != 1:
+            raise ValueError(f'section step must be 1, got {section}')
+        if stop <= start:
+            raise ValueError(f'section {section} is empty for image of shape {shape}')
+        normalized.append(slice(start, stop))
+    return tuple(normalized)
+
+
+def _read_section(hdu, section=None):
+    """Read image data or its section
+
+    Parameters
+    ----------
+    hdu : `~astropy.io.fits.ImageHDU` or `~astropy.io.fits.CompImageHDU`
+    section : `tuple` [`slice`], optional
+        Section of the image to read. If None, the whole image is read.
+
+    Returns
+    -------
+    data : `numpy.ndarray`
+
+    Notes
+    -----
+    Uncompressed data are usually memory-mapped: accessing them only maps
+    the file, the pages are read when the data are first used. Bytes read
+    are counted from the file layout of the extension and the shape of
+    the data, see `_data_bytes`, without touching the data, so enabling
+    the instrumentation does not read the pages of mapped or lazily
+    loaded data. Their read time is then not a part of the ``decode``
+    stage.
+    """
+    with stage('decode') as record:
+        if section is None:
+            data = hdu.data
+        else:
+            # section access reads only the requested part of the file
+            # (for compressed images, only the tiles overlapping the section,
+            # provided astropy supports it)
+            reader = getattr(hdu, 'section', None)
+            if reader is None:
+                reader = hdu.data
+            data = reader[section]
+        if record:
+            record.add(bytes_read=_data_bytes(hdu, data), hdus=1)
+    return data
+
+
+def _data_bytes(hdu, data):
+    """File bytes of the decoded data: the data span of the extension
+    or, for a section, its share of the span. Only the file info and
+    the shapes are used, the data are not accessed."""
+    info = hdu.fileinfo()
+    size = np.prod(hdu.shape, dtype=np.int64) if hdu.shape else 0
+    if not info or data is None or size == 0:
+        return 0
+    return int(info['datSpan'] * np.size(data) // size)
+
+
+@instrumented()
 def spherex_image_reader(filename, hdu=0, unit=None, hdu_uncertainty=3,
                          hdu_mask='MASK', hdu_flags=2,
-                         key_uncertainty_type='UTYPE', **kwd) -> SPHERExImage:
+                         key_uncertainty_type='UTYPE', lazy=False, section=None,
+                         **kwd) -> SPHERExImage:
     """
     Generate a SPHERExImage object from a FITS file.
     When flags and variance are present, they are expected to be in
@@ -186,6 +510,23 @@ def spherex_image_reader(filename, hdu=0, unit=None, hdu_uncertainty=3,
         in the hdu of the uncertainty (if any).
         Default is ``'UTYPE'``.
 
+    lazy : bool, optional
+        If ``True``, uncertainty, mask and flags are not read until they are
+        first accessed. The file stays open until all of them are loaded
+        or the returned object is garbage collected. Image arrays are
+        memory-mapped (unless ``memmap=False`` is passed), so the pixels are
+        read from the file only when they are used. Scaled image data
+        (for example, unsigned integers with ``BZERO``) can not be
+        memory-mapped and are read in full on first access.
+        Default is ``False``.
+
+    section : `tuple` [`slice`], optional
+        Section of the image to read in numpy (row, column) order,
+        for example ``(slice(100, 200), slice(0, 50))``. When given, only
+        this part of every image extension is read from the file, and the WCS
+        and the ``LTV1``/``LTV2`` header keywords are shifted accordingly.
+        Default is ``None``, which means the whole image is read.
+
     kwd :
         Any additional keyword parameters are passed through to the FITS reader
         in :mod:`astropy.io.fits`; see Notes for additional discussion.
@@ -199,32 +540,567 @@ def spherex_image_reader(filename, hdu=0, unit=None, hdu_uncertainty=3,
     FITS files that contained scaled data (e.g. unsigned integer images) will
     be scaled and the keywords used to manage scaled data in
     :mod:`astropy.io.fits` are disabled.
+
+    The file is opened only once: data, uncertainty, mask, flags and WCS
+    are all built from the same `~astropy.io.fits.HDUList`.
+    """
+
+    unsupport_open_keywords = {
+        'do_not_scale_image_data': 'Image data must be scaled.',
+        'scale_back': 'Scale information is not preserved.'
+    }
+    for key, msg in unsupport_open_keywords.items():
+        if key in kwd:
+            raise TypeError(f'unsupported keyword: {key}. {msg}')
+
+    # all components are extracted from a single HDUList,
+    # so that the file is opened and its headers are parsed only once
+    with stage('open'):
+        hdus = fits.open(filename, **kwd)
+    try:
+        spherex_image, loaders = _read_hdus(hdus, hdu=hdu, unit=unit, hdu_uncertainty=hdu_uncertainty,
+                                            hdu_mask=hdu_mask, hdu_flags=hdu_flags,
+                                            key_uncertainty_type=key_uncertainty_type, section=section)
+        if not lazy:
+            for name, load in loaders.items():
+                setattr(spherex_image, name, load())
+            hdus.close()
+            return spherex_image
+
+        # keep the file open while there are components to load
+        spherex_image._defer(loaders, weakref.finalize(spherex_image, hdus.close))
+        return spherex_image
+    except Exception:
+        hdus.close()
+        raise
+
+
+@instrumented()
+def spherex_image_component_reader(filename, component, hdu=0, hdu_uncertainty=3, hdu_flags=2,
+                                   key_uncertainty_type='UTYPE', section=None, **kwd):
+    """
+    Read a single component of a SPHEREx image from a FITS file.
+
+    Only the headers of the extensions up to the one, which holds the
+    component, are read, and the data of that extension only.
+    Header components (``metadata``, ``wcs`` and ``flag_defs``) do not
+    read any pixels.
+
+    Parameters
+    ----------
+    filename : str
+        Name of fits file.
+
+    component : str
+        Component to read:
+
+        ``'metadata'``
+            Image header without WCS keywords, `~astropy.io.fits.Header`.
+        ``'wcs'``
+            World coordinate system, `~astropy.wcs.WCS` or ``None``.
+        ``'flag_defs'``
+            Flag definitions, `dict` or ``None``.
+        ``'image'``
+            Image data, `numpy.ndarray`.
+        ``'flags'``
+            Flags, `numpy.ndarray` or ``None``.
+        ``'variance'``
+            Variance, `numpy.ndarray` or ``None``. Uncertainties stored
+            as standard deviations or inverse variances are converted.
+        ``'summary'``
+            Image summary stored by the writer, `dict` or ``None``,
+            see `spherex_image_writer`.
+
+    hdu, hdu_uncertainty, hdu_flags, key_uncertainty_type, section
+        See `spherex_image_reader`.
+
+    kwd :
+        Any additional keyword parameters are passed through to the FITS reader
+        in :mod:`astropy.io.fits`.
+
+    Returns
+    -------
+    value : object
+        Component value, ``None`` if the extension with the component
+        does not exist.
     """
+    if component not in IMAGE_COMPONENTS:
+        raise ValueError(f'unknown component {component}, supported components are {IMAGE_COMPONENTS}')
+    # arrays are copied out of the file, so that it can be closed
+    kwd.setdefault('memmap', False)
+    # headers are parsed on demand, up to the requested extension
+    with stage('open'):
+        hdus = fits.open(filename, lazy_load_hdus=True, **kwd)
+    with hdus:
+        if component == 'flag_defs':
+            flags_hdu = _get_hdu(hdus, hdu_flags)
+            return None if flags_hdu is None else _get_flag_defs(flags_hdu.header)
+        if component == 'summary':
+            flags_hdu = _get_hdu(hdus, hdu_flags)
+            summary = None if flags_hdu is None else summary_from_header(flags_hdu.header)
+            if summary is None:
+                hdu, hdr = _find_data_hdu(hdus, hdu)
+                summary = summary_from_header(hdr)
+            return summary
+        if component == 'flags':
+            flags_hdu = _get_hdu(hdus, hdu_flags)
+            return None if flags_hdu is None else _read_section(flags_hdu, section)
+        if component == 'variance':
+            unc_hdu = _get_hdu(hdus, hdu_uncertainty)
+            if unc_hdu is None:
+                return None
+            stored_unc_name = unc_hdu.header.get(key_uncertainty_type, 'None')
+            unc_type = _unc_name_to_cls.get(stored_unc_name, StdDevUncertainty)
+            return _to_variance(unc_type, _read_section(unc_hdu, section))
+        if component == 'image':
+            hdu, _ = _find_data_hdu(hdus, hdu)
+            if section is not None:
+                section = _normalize_section(section, hdus[hdu].shape)
+            return _read_section(hdus[hdu], section)
+
+        hdu, hdr, wcs = _read_frame(hdus, hdu)
+        section, wcs = _apply_section(section, hdus[hdu].shape, hdr, wcs)
+        return wcs if component == 'wcs' else hdr
 
-    ccddata = fits_ccddata_reader(filename, hdu=hdu, unit=unit,
-                                  hdu_uncertainty=hdu_uncertainty,
-                                  hdu_mask=hdu_mask,
-                                  key_uncertainty_type=key_uncertainty_type, **kwd)
 
-    flags = None
-    flag_defs = None
-    with fits.open(filename, **kwd) as hdus:
-        if hdu_flags is not None and hdu_flags in hdus:
-            flags_hdu = hdus[hdu_flags]
-            flags = flags_hdu.data
-            hdr = hdus[hdu_flags].header
-            flag_defs = _get_flag_defs(hdr)
+def _find_data_hdu(hdus: fits.HDUList, hdu=0):
+    """Find the image extension with data
+
+    Parameters
+    ----------
+    hdus : `~astropy.io.fits.HDUList`
+    hdu : str or int, optional
+        Image extension. If zero and the primary HDU has no data, the first
+        image extension with data is used.
+
+    Returns
+    -------
+    hdu : str or int
+        Image extension.
+    header : `~astropy.io.fits.Header`
+        Image extension header. When the image is found in an extension,
+        the primary header values, which are not in the extension header,
+        are added to it.
+    """
+    hdr = hdus[hdu].header
+    # search for the first extension with data,
+    # if the primary HDU is header-only
+    if hdu == 0 and hdus.fileinfo(hdu)['datSpan'] == 0:
+        for idx in range(1, len(hdus)):
+            if (isinstance(hdus[idx], (fits.ImageHDU, fits.CompImageHDU))
+                    and hdus.fileinfo(idx)['datSpan'] > 0):
+                comb_hdr = hdus[idx].header.copy()
+                # add primary header values, which are not in the extension header
+                comb_hdr.extend(hdr, unique=True)
+                log.info(f'first HDU with data is extension {idx}.')
+                return idx, comb_hdr
+    return hdu, hdr
 
-        spherex_image = SPHERExImage(ccddata.data, meta=ccddata.header,
-                                     unit=ccddata.unit, mask=ccddata.mask,
-                                     uncertainty=ccddata.uncertainty,
-                                     wcs=ccddata.wcs, flags=flags,
-                                     flag_defs=flag_defs)
-    return spherex_image
 
+def _read_frame(hdus: fits.HDUList, hdu=0):
+    """Get image extension, header and WCS of the full image
 
+    Parameters
+    ----------
+    hdus : `~astropy.io.fits.HDUList`
+    hdu : str or int, optional
+        See `spherex_image_reader`.
+
+    Returns
+    -------
+    hdu : str or int
+        Image extension, see `_find_data_hdu`.
+    header : `~astropy.io.fits.Header`
+        Image header without WCS keywords.
+    wcs : `~astropy.wcs.WCS` or None
+    """
+    with stage('header'):
+        hdu, hdr = _find_data_hdu(hdus, hdu)
+    with stage('wcs'):
+        hdr, wcs = _generate_wcs_and_update_header(hdr)
+    return hdu, hdr, wcs
+
+
+def _read_hdus(hdus: fits.HDUList, hdu=0, unit=None, hdu_uncertainty=3,
+               hdu_mask='MASK', hdu_flags=2, key_uncertainty_type='UTYPE', section=None,
+               frame=None):
+    """Build `~spherex.core.SPHERExImage` from an open `~astropy.io.fits.HDUList`
+
+    Parameters
+    ----------
+    hdus : `~astropy.io.fits.HDUList`
+    hdu, unit, hdu_uncertainty, hdu_mask, hdu_flags, key_uncertainty_type, section
+        See `spherex_image_reader`.
+    frame : `tuple`, optional
+        Result of `_read_frame` for ``hdus``, which replaces ``hdu``.
+        Avoids parsing the header and the WCS again, when several
+        sections of the same image are read.
+
+    Returns
+    -------
+    spherex_image : `~spherex.core.SPHERExImage`
+        Image with data, header, unit, WCS and flag definitions.
+    loaders : `dict` [`str`, callable]
+        Functions with no arguments, which read uncertainty, mask and flags,
+        keyed by component name. They read from ``hdus``, which must stay
+        open until they are called.
+    """
+    # component loaders, in lazy mode called on first access
+    loaders = {}
+
+    with stage('header'):
+        unc_hdu = _get_hdu(hdus, hdu_uncertainty)
+        if unc_hdu is not None:
+            stored_unc_name = unc_hdu.header.get(key_uncertainty_type, 'None')
+            # for compatibility with files created before the uncertainty
+            # type was stored in the header, the default is standard deviation
+            unc_type = _unc_name_to_cls.get(stored_unc_name, StdDevUncertainty)
+            loaders['uncertainty'] = lambda: unc_type(_read_section(unc_hdu, section))
+
+        mask_hdu = _get_hdu(hdus, hdu_mask)
+        if mask_hdu is not None:
+            # mask is saved as uint, but we want it to be boolean
+            loaders['mask'] = lambda: _read_section(mask_hdu, section).astype(bool)
+
+        flag_defs = None
+        flags_hdu = _get_hdu(hdus, hdu_flags)
+        if flags_hdu is not None:
+            flag_defs = _get_flag_defs(flags_hdu.header)
+            loaders['flags'] = lambda: _read_section(flags_hdu, section)
+
+    if frame is None:
+        hdu, hdr, wcs = _read_frame(hdus, hdu)
+    else:
+        hdu, hdr, wcs = frame
+        hdr = hdr.copy()
+    use_unit = _get_unit(hdr, unit)
+
+    with stage('wcs'):
+        section, wcs = _apply_section(section, hdus[hdu].shape, hdr, wcs)
+    # memory-mapped data array is not read until its pages are accessed
+    data = _read_section(hdus[hdu], section)
+
+    spherex_image = SPHERExImage(data, meta=hdr, unit=use_unit, wcs=wcs, flag_defs=flag_defs)
+    return spherex_image, loaders
+
+
+def _apply_section(section, shape, hdr, wcs):
+    """Shift image header and WCS to the origin of a section
+
+    Parameters
+    ----------
+    section : `tuple` [`slice`] or None
+        Section of the image in numpy (row, column) order.
+    shape : `tuple` [`int`]
+        Image shape.
+    hdr : `~astropy.io.fits.Header`
+        Image header, ``LTV1`` and ``LTV2`` keywords are updated in place.
+    wcs : `~astropy.wcs.WCS` or None
+
+    Returns
+    -------
+    section : `tuple` [`slice`] or None
+        Normalized section, see `_normalize_section`.
+    wcs : `~astropy.wcs.WCS` or None
+        WCS of the section.
+    """
+    if section is None:
+        return None, wcs
+    section = _normalize_section(section, shape)
+    if wcs is not None:
+        wcs = wcs.slice(section)
+    # IRAF convention: physical = logical - LTV
+    hdr['LTV1'] = hdr.get('LTV1', 0) - section[1].start
+    hdr['LTV2'] = hdr.get('LTV2', 0) - section[0].start
+    return section, wcs
+
+
+def _to_variance(unc_type, array):
+    """Convert uncertainty array to variance
+
+    Parameters
+    ----------
+    unc_type : type
+        `~astropy.nddata.NDUncertainty` subclass of the stored uncertainty.
+    array : `numpy.ndarray`
+        Uncertainty array, converted in place, if it is writeable.
+
+    Returns
+    -------
+    variance : `numpy.ndarray`
+    """
+    if unc_type is VarianceUncertainty:
+        return array
+    out = array if array.flags.writeable else None
+    if unc_type is StdDevUncertainty:
+        return np.square(array, out=out)
+    if unc_type is InverseVariance:
+        return np.reciprocal(array, out=out)
+    raise ValueError(f'can not convert {unc_type.__name__} to variance')
+
+
+def _image_header(header, array, name=None):
+    """Make image extension header for the data array
+
+    Parameters
+    ----------
+    header : `~astropy.io.fits.Header` or None
+        Header cards to include in the extension header.
+    array : `numpy.ndarray`
+        Data array, which defines data type and dimensions.
+    name : str, optional
+        Extension name.
+
+    Returns
+    -------
+    header : `~astropy.io.fits.Header`
+        Extension header with mandatory keywords set from the array.
+    """
+    dtype = _fits_dtype(array.dtype)
+    # zero-strided stand-in array: the header is built without touching the data
+    placeholder = np.broadcast_to(np.zeros((), dtype=dtype), array.shape)
+    header = fits.ImageHDU(data=placeholder, header=header, name=name).header
+    # data are written as is, stale scaling keywords would corrupt them
+    header.remove('BSCALE', ignore_missing=True)
+    header.remove('BZERO', ignore_missing=True)
+    if dtype.kind == 'u' and dtype.itemsize > 1:
+        # FITS convention for unsigned integers
+        header['BSCALE'] = 1
+        header['BZERO'] = 1 << (8 * dtype.itemsize - 1)
+    elif dtype.kind == 'i' and dtype.itemsize == 1:
+        # BITPIX=8 is unsigned, signed bytes are stored with an offset
+        header['BSCALE'] = 1
+        header['BZERO'] = -128
+    return header
+
+
+def _fits_dtype(dtype):
+    """Get data type used to store an array in FITS
+
+    Parameters
+    ----------
+    dtype : `numpy.dtype`
+
+    Returns
+    -------
+    dtype : `numpy.dtype`
+        Native byte order data type, boolean is stored as unsigned byte.
+    """
+    if dtype.kind == 'b':
+        return np.dtype(np.uint8)
+    return dtype.newbyteorder('=')
+
+
+def _write_data(fileobj, array, chunk_bytes=WRITE_CHUNK_BYTES):
+    """Write image data to the file, followed by FITS block padding
+
+    The data are written in chunks of rows: at most one chunk is converted
+    to FITS representation (big endian) at a time.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        Binary file opened for writing.
+    array : `numpy.ndarray`
+        Data array to write.
+    chunk_bytes : int, optional
+        Approximate size of the converted chunk.
+    """
+    dtype = _fits_dtype(array.dtype)
+    rows = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(1, -1)
+    rows_per_chunk = max(1, chunk_bytes // max(1, rows.shape[1] * dtype.itemsize))
+    for start in range(0, rows.shape[0], rows_per_chunk):
+        fileobj.write(_fits_encode(rows[start:start + rows_per_chunk]))
+    nbytes = array.size * dtype.itemsize
+    fileobj.write(b'\0' * (-nbytes % BLOCK_SIZE))
+
+
+def _fits_encode(array):
+    """Convert array to its FITS representation
+
+    Parameters
+    ----------
+    array : `numpy.ndarray`
+
+    Returns
+    -------
+    buffer : `memoryview`
+        Bytes of the big endian array. Unsigned integers are stored as
+        signed with ``BZERO`` offset, signed bytes as unsigned with
+        ``BZERO = -128``, boolean as unsigned bytes.
+        Big endian contiguous arrays are not copied.
+    """
+    dtype = _fits_dtype(array.dtype)
+    if dtype.kind == 'u' and dtype.itemsize > 1:
+        signed_dtype = np.dtype(f'>i{dtype.itemsize}')
+        offset = 1 << (8 * dtype.itemsize - 1)
+        array = (array ^ dtype.type(offset)).view(signed_dtype.newbyteorder('=')).astype(signed_dtype)
+    elif dtype.kind == 'i' and dtype.itemsize == 1:
+        array = np.ascontiguousarray(array).view(np.uint8) ^ np.uint8(0x80)
+    else:
+        fits_dtype = dtype.newbyteorder('>')
+        if array.dtype != fits_dtype or not array.flags.c_contiguous:
+            array = array.astype(fits_dtype)
+    return memoryview(array).cast('B')
+
+
+def _image_planes(spherex_image: SPHERExImage, hdu_mask='MASK', hdu_uncertainty='VARIANCE',
+                  hdu_flags='FLAGS', wcs_relax=True, key_uncertainty_type='UTYPE', summary=False,
+                  compact_flags=True):
+    """Get image extensions of `~spherex.core.SPHERExImage` in file order
+
+    Parameters
+    ----------
+    spherex_image : `~spherex.core.SPHERExImage`
+    hdu_mask, hdu_uncertainty, hdu_flags, wcs_relax, key_uncertainty_type
+        See `spherex_image_writer`.
+    summary, compact_flags
+        See `spherex_image_writer`.
+
+    Returns
+    -------
+    planes : `list` [`tuple`]
+        ``(extension, header, array)`` for image, flags, variance and mask,
+        where extension is one of `COMPRESSED_EXTENSIONS`. Arrays are
+        references to the image buffers, not copies, except for the flags
+        converted to a smaller data type, see `_compact_flags`.
+    """
+    if isinstance(spherex_image.header, fits.Header):
+        header = spherex_image.header.copy()
+    else:
+        header = fits.Header(list(spherex_image.header.items()))
+    if spherex_image.unit is not u.dimensionless_unscaled:
+        header['bunit'] = spherex_image.unit.to_string()
+    if spherex_image.wcs:
+        header.extend(spherex_image.wcs.to_header(relax=wcs_relax), useblanks=False, update=True)
+    # mandatory keywords are set from the data
+    for key in ('SIMPLE', 'EXTEND', 'XTENSION', 'PCOUNT', 'GCOUNT'):
+        header.remove(key, ignore_missing=True)
+    # summary of the image, this header was read with, is stale
+    _remove_summary(header)
+    planes = [('image', header, np.asanyarray(spherex_image.data))]
+
+    if hdu_flags and spherex_image.flags is not None:
+        hdr_flags = fits.Header()
+        _add_flag_defs(spherex_image, hdr_flags)
+        flags = np.asanyarray(spherex_image.flags)
+        if compact_flags:
+            flags = _compact_flags(flags, spherex_image.flag_defs)
+        planes.append(('flags', _name_header(hdr_flags, hdu_flags), flags))
+
+    uncertainty = spherex_image.uncertainty
+    if hdu_uncertainty and uncertainty is not None:
+        if uncertainty.__class__ not in _known_uncertainties:
+            raise ValueError(f'only uncertainties of type {_known_uncertainties} can be saved.')
+        hdr_uncertainty = fits.Header()
+        hdr_uncertainty[key_uncertainty_type] = uncertainty.__class__.__name__
+        planes.append(('variance', _name_header(hdr_uncertainty, hdu_uncertainty),
+                       np.asanyarray(uncertainty.array)))
+
+    if hdu_mask and spherex_image.mask is not None:
+        planes.append(('mask', _name_header(fits.Header(), hdu_mask), np.asanyarray(spherex_image.mask)))
+
+    if summary:
+        # in the flags header, if flags are written
+        summary_header = planes[1][1] if len(planes) > 1 and planes[1][0] == 'flags' else header
+        summary_to_header(image_summary(planes[0][2], spherex_image.flags,
+                                        spherex_image.flag_defs or FLAG_DEFS), summary_header)
+
+    return planes
+
+
+def _planes_summary(planes):
+    """Get image summary from the headers of `_image_planes`, as the
+    readers get it from the file: from the flags header, if any, otherwise
+    from the image header"""
+    headers = {extension: header for extension, header, _ in planes}
+    summary = summary_from_header(headers['flags']) if 'flags' in headers else None
+    return summary if summary is not None else summary_from_header(headers['image'])
+
+
+def _flags_dtype(flags, flag_defs=None):
+    """Get the smallest unsigned integer type, which holds the flag bits
+
+    Parameters
+    ----------
+    flags : `numpy.ndarray`
+        Integer flags.
+    flag_defs : dict-like object or None, optional
+        Flag definitions, which map flag name to a bit in the flags array.
+
+    Returns
+    -------
+    dtype : `numpy.dtype` or None
+        Unsigned integer type with enough bits for the highest defined
+        flag bit and for all bits set in ``flags``. None, if some flags
+        are negative: the sign bit is then in use, and the data type
+        can not be changed.
+    """
+    # one pass over the flags: union of all set bits
+    used = int(np.bitwise_or.reduce(flags, axis=None)) if flags.size else 0
+    if used < 0:
+        return None
+    nbits = max([used.bit_length()] + [int(bit) + 1 for bit in (flag_defs or {}).values()])
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if nbits <= 8 * np.dtype(dtype).itemsize:
+            return np.dtype(dtype)
+    return None
+
+
+def _compact_flags(flags, flag_defs=None):
+    """Convert integer flags to the smallest unsigned type, which holds them
+
+    Parameters
+    ----------
+    flags : `numpy.ndarray`
+    flag_defs : dict-like object or None, optional
+        Flag definitions, the type holds the highest defined bit,
+        even if it is not set.
+
+    Returns
+    -------
+    flags : `numpy.ndarray`
+        Converted flags or the input flags, if they are not integer or
+        a smaller type does not hold them.
+    """
+    if flags.dtype.kind not in 'iu':
+        return flags
+    dtype = _flags_dtype(flags, flag_defs)
+    if dtype is None or dtype.itemsize >= flags.dtype.itemsize:
+        return flags
+    return flags.astype(dtype)
+
+
+def _name_header(header, name):
+    header['EXTNAME'] = name
+    return header
+
+
+def _compress_hdu(header, array, compression):
+    """Make tile-compressed image HDU
+
+    Parameters
+    ----------
+    header : `~astropy.io.fits.Header`
+    array : `numpy.ndarray`
+    compression : str or dict-like object
+        Compression type (for example, ``'RICE_1'``) or keyword arguments
+        of `~astropy.io.fits.CompImageHDU`, such as ``compression_type``,
+        ``quantize_level`` or ``quantize_method``.
+
+    Returns
+    -------
+    hdu : `~astropy.io.fits.CompImageHDU`
+    """
+    if isinstance(compression, str):
+        compression = {'compression_type': compression}
+    return fits.CompImageHDU(data=array, header=header, name=header.get('EXTNAME'), **compression)
+
+
+@instrumented()
 def spherex_image_writer(spherex_image: SPHERExImage, fileobj, hdu_mask='MASK', hdu_uncertainty='VARIANCE',
-                         hdu_flags='FLAGS', wcs_relax=True, key_uncertainty_type='UTYPE', **kwd):
+                         hdu_flags='FLAGS', wcs_relax=True, key_uncertainty_type='UTYPE',
+                         compression=None, overwrite=False, summary=False, compact_flags=True, **kwd):
     """Write `~spherex.core.SPHERExImage` to a file
 
     Parameters
@@ -251,32 +1127,101 @@ def spherex_image_writer(spherex_image: SPHERExImage, fileobj, hdu_mask='MASK',
         that is used to store the uncertainty type in the uncertainty hdu.
         Default is ``'UTYPE'``.
 
+    compression : dict-like object or None, optional
+        Tile compression of the image extensions. Maps extension (``'image'``,
+        ``'variance'``, ``'mask'`` or ``'flags'``) to a compression type,
+        like ``'RICE_1'``, ``'GZIP_2'`` or ``'PLIO_1'``, or to a dictionary
+        of `~astropy.io.fits.CompImageHDU` keyword arguments, for example
+        ``{'compression_type': 'RICE_1', 'quantize_level': 16}``.
+        Extensions, which are not listed, are not compressed.
+        Default is ``None`` (no compression).
+
+    overwrite : bool, optional
+        If ``True``, overwrite the output file if it exists.
+        Default is ``False``.
+
+    summary : bool, optional
+        If ``True``, compute image summary (pixel statistics and the number
+        of pixels with each flag set, see `~spherex.core.image_summary`)
+        and store it in the flags extension header or, if there are no
+        flags, in the image extension header.
+        Default is ``False``.
+
+    compact_flags : bool, optional
+        If ``True``, integer flags are stored with the smallest unsigned
+        integer type, which holds the highest flag bit defined in
+        ``flag_defs`` and all bits set in the flags, for example,
+        ``uint8`` for up to 8 flags. The reader returns flags with the
+        stored type. Default is ``True``.
+
     kwd : dict
+        Additional keyword arguments of `~astropy.io.fits.HDUList.writeto`.
 
     Returns
     -------
+    summary : dict or None
+        Image summary stored in the file, if ``summary`` is ``True``,
+        otherwise ``None``.
 
+    Notes
+    -----
+    The extensions are written in the following order: image, flags,
+    variance, mask. Uncompressed images are streamed to the file directly
+    from the image buffers, a chunk of rows at a time, so that the memory
+    used by the writer does not depend on the image size. Compression or
+    additional ``writeto`` keyword arguments require building
+    an in-memory `~astropy.io.fits.HDUList`.
     """
 
-    # to_hdu does not support flags at the moment
-    # to_hdu puts image data into PrimaryHDU
-    hdulist = spherex_image.to_hdu(hdu_mask=hdu_mask, hdu_uncertainty=hdu_uncertainty,
-                                   wcs_relax=wcs_relax, key_uncertainty_type=key_uncertainty_type)
+    with stage('prepare'):
+        planes = _image_planes(spherex_image, hdu_mask=hdu_mask, hdu_uncertainty=hdu_uncertainty,
+                               hdu_flags=hdu_flags, wcs_relax=wcs_relax,
+                               key_uncertainty_type=key_uncertainty_type, summary=summary,
+                               compact_flags=compact_flags)
 
-    # add primary hdu - critical to support compressed images later
-    # minimum header with EXTEND will be provided if header is None
-    primary_hdu = fits.PrimaryHDU(data=None, header=None)
-    hdulist.insert(0, primary_hdu)
+    if compression:
+        unknown = set(compression) - set(COMPRESSED_EXTENSIONS)
+        if unknown:
+            raise ValueError(f'compression is not supported for {unknown}, '
+                             f'supported extensions are {COMPRESSED_EXTENSIONS}')
 
-    # add flags hdu - 2nd extension after the image data
-    if hdu_flags and spherex_image.flags is not None:
-        hdr_flags = fits.Header()
-        _add_flag_defs(spherex_image, hdr_flags)
+    with stage('write') as record:
+        start = _position(fileobj) if record else 0
+        if compression or kwd:
+            # header-only primary hdu is critical to support compressed images
+            hdulist = fits.HDUList([fits.PrimaryHDU()])
+            for extension, header, array in planes:
+                array = array.astype(_fits_dtype(array.dtype), copy=False)
+                if compression and compression.get(extension):
+                    hdulist.append(_compress_hdu(header, array, compression[extension]))
+                else:
+                    hdulist.append(fits.ImageHDU(array, header))
+            hdulist.writeto(fileobj, overwrite=overwrite, **kwd)
+        elif isinstance(fileobj, (str, os.PathLike)):
+            with open(fileobj, 'wb' if overwrite else 'xb') as f:
+                _write_planes(f, planes)
+        else:
+            _write_planes(fileobj, planes)
+        if record:
+            end = os.path.getsize(fileobj) if isinstance(fileobj, (str, os.PathLike)) else _position(fileobj)
+            record.add(bytes_written=end - start, hdus=len(planes))
+    return _planes_summary(planes) if summary else None
+
+
+def _position(fileobj):
+    """Position in a file object, zero for a file name or a stream"""
+    try:
+        return fileobj.tell()
+    except (AttributeError, OSError):
+        return 0
 
-        hdu = fits.ImageHDU(spherex_image.flags.data, hdr_flags, name=hdu_flags)
-        hdulist.insert(2, hdu)
 
-    hdulist.writeto(fileobj, **kwd)
+def _write_planes(fileobj, planes):
+    # minimum header with EXTEND
+    fileobj.write(fits.PrimaryHDU().header.tostring().encode('ascii'))
+    for extension, header, array in planes:
+        fileobj.write(_image_header(header, array).tostring().encode('ascii'))
+        _write_data(fileobj, array)
 
 
 # Register read/write methods for SPHERExImage
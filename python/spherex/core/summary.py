@@ -0,0 +1,166 @@
+# Per-image summary of flag counts and pixel statistics
+#
+# The summary is computed by the writer and stored in header keywords,
+# so that data quality can be checked, indexed and queried by reading
+# a few kilobytes of headers instead of the pixels.
+
+__all__ = ['image_summary', 'summary_to_header', 'summary_from_header']
+
+import numpy as np
+
+# number of pixels per chunk, when counting flag bits: a chunk stays
+# in the processor cache while all bits are counted
+SUMMARY_CHUNK_PIXELS = 1 << 16
+
+# maximum number of pixels in the subsample, median and sigma are computed
+# from: they are exact for smaller images and approximate for larger ones
+SUMMARY_SAMPLE_PIXELS = 1 << 18
+
+# header keywords of the summary statistics
+SUMMARY_KEYWORDS = {
+    'size': ('SUMSIZE', 'number of science pixels'),
+    'npix': ('SUMNPIX', 'number of finite science pixels'),
+    'min': ('SUMMIN', 'minimum of finite science pixels'),
+    'max': ('SUMMAX', 'maximum of finite science pixels'),
+    'median': ('SUMMED', 'median of finite science pixels'),
+    'sigma': ('SUMSIG', 'robust sigma of science pixels, IQR/1.349'),
+}
+
+# prefix of the flag count keywords, followed by the flag name
+FLAG_COUNT_PREFIX = 'NP_'
+
+
+def _count_flag_bits(flags, flag_defs):
+    """Count pixels with each flag set in a single pass over the flags"""
+    counts = dict.fromkeys(flag_defs, 0)
+    if flags.dtype.kind not in 'iu':
+        flags = flags.astype(np.int64)
+    flat = flags.reshape(-1)
+    bits = {name: np.array(1 << int(bit), dtype=np.uint64).astype(flat.dtype)
+            for name, bit in flag_defs.items()}
+    buffer = np.empty(min(flat.size, SUMMARY_CHUNK_PIXELS), dtype=flat.dtype)
+    for start in range(0, flat.size, SUMMARY_CHUNK_PIXELS):
+        chunk = flat[start:start + SUMMARY_CHUNK_PIXELS]
+        out = buffer[:chunk.size]
+        for name, bit in bits.items():
+            counts[name] += int(np.count_nonzero(np.bitwise_and(chunk, bit, out=out)))
+    return counts
+
+
+def _pixel_statistics(data):
+    """Compute number of finite pixels, their minimum, maximum and a regular
+    subsample of them, chunk by chunk: no full-frame temporary arrays are
+    allocated
+    """
+    rows = data.reshape(data.shape[0], -1) if data.ndim > 1 else data.reshape(1, -1)
+    step = max(1, data.size // SUMMARY_SAMPLE_PIXELS)
+    chunk_rows = max(1, SUMMARY_CHUNK_PIXELS // max(1, rows.shape[1]))
+    npix, minimum, maximum, sample = 0, None, None, []
+    for start in range(0, rows.shape[0], chunk_rows):
+        chunk = rows[start:start + chunk_rows].reshape(-1)
+        finite = np.isfinite(chunk)
+        count = int(np.count_nonzero(finite))
+        if count == 0:
+            continue
+        if count < chunk.size:
+            chunk = chunk[finite]
+        npix += count
+        low, high = chunk.min(), chunk.max()
+        minimum = low if minimum is None else min(minimum, low)
+        maximum = high if maximum is None else max(maximum, high)
+        sample.append(chunk[::step].copy())
+    return npix, minimum, maximum, sample
+
+
+def image_summary(data, flags=None, flag_defs=None):
+    """Compute image summary: pixel statistics and flag counts
+
+    Parameters
+    ----------
+    data : `numpy.ndarray`
+        Science pixels.
+    flags : `numpy.ndarray` or None, optional
+        Flags of the pixels.
+    flag_defs : dict-like object or None, optional
+        Flag definitions, which map flag name to a bit in the flags array.
+
+    Returns
+    -------
+    summary : dict
+        ``size`` (number of pixels), ``npix`` (number of finite pixels),
+        ``min``, ``max``, ``median`` and ``sigma`` (robust standard deviation
+        from the interquartile range) of the finite pixels, and
+        ``flag_counts``, the number of pixels with each flag set, keyed
+        by flag name.
+        Statistics are ``None``, if there are no finite pixels.
+
+    Notes
+    -----
+    Pixels are processed in chunks of ``SUMMARY_CHUNK_PIXELS``. ``median``
+    and ``sigma`` are computed from a regular subsample of at most about
+    ``SUMMARY_SAMPLE_PIXELS`` finite pixels, so they are approximate for
+    larger images; the other statistics and the flag counts are exact.
+    """
+    data = np.asanyarray(data)
+    summary = {'size': int(data.size), 'npix': 0, 'min': None, 'max': None, 'median': None, 'sigma': None}
+    if data.size > 0:
+        npix, minimum, maximum, sample = _pixel_statistics(data)
+        summary['npix'] = npix
+        if npix > 0:
+            # one partition for the three quantiles
+            q25, median, q75 = np.percentile(np.concatenate(sample), (25, 50, 75))
+            summary.update({'min': float(minimum), 'max': float(maximum),
+                            'median': float(median), 'sigma': float((q75 - q25) / 1.349)})
+    flag_counts = {}
+    if flags is not None and flag_defs:
+        flag_counts = _count_flag_bits(np.asanyarray(flags), flag_defs)
+    summary['flag_counts'] = flag_counts
+    return summary
+
+
+def summary_to_header(summary, header):
+    """Add image summary to the header
+
+    Parameters
+    ----------
+    summary : dict
+        Image summary, see `image_summary`.
+    header : `~astropy.io.fits.Header`
+        Header to update in place.
+    """
+    for key, (keyword, comment) in SUMMARY_KEYWORDS.items():
+        if summary.get(key) is not None:
+            header[keyword] = (summary[key], comment)
+    for name, count in summary.get('flag_counts', {}).items():
+        prefix = FLAG_COUNT_PREFIX if len(name) < 6 else f'HIERARCH {FLAG_COUNT_PREFIX}'
+        header[f'{prefix}{name.upper()}'] = (count, 'number of pixels with the flag set')
+
+
+def _remove_summary(header):
+    """Remove summary keywords from the header in place"""
+    for keyword, _ in SUMMARY_KEYWORDS.values():
+        header.remove(keyword, ignore_missing=True, remove_all=True)
+    for key in [key for key in header if key.startswith(FLAG_COUNT_PREFIX)]:
+        header.remove(key, ignore_missing=True, remove_all=True)
+
+
+def summary_from_header(header):
+    """Get image summary from the header
+
+    Parameters
+    ----------
+    header : `~astropy.io.fits.Header`
+
+    Returns
+    -------
+    summary : dict or None
+        Image summary, see `image_summary`, or ``None`` if the header
+        has no summary.
+    """
+    npix_keyword = SUMMARY_KEYWORDS['npix'][0]
+    if npix_keyword not in header:
+        return None
+    summary = {key: header.get(keyword) for key, (keyword, _) in SUMMARY_KEYWORDS.items()}
+    summary['flag_counts'] = {key[len(FLAG_COUNT_PREFIX):]: int(value) for key, value in header.items()
+                              if key.startswith(FLAG_COUNT_PREFIX)}
+    return summary
@@ -1,6 +1,17 @@
 import pkgutil
 __path__ = pkgutil.extend_path(__path__, __name__)
 
-from .astropy_image import *
-from .ccddata_image import *
-from .spherex_image import *
\ No newline at end of file
+from .._lazy import lazy_exports
+
+# submodules are imported, when their names are first accessed,
+# the lists must match their __all__
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+    "astropy_image": ["AstropyImageFormatter"],
+    "cache": ["ImageCache", "configureReadCache", "getReadCache"],
+    "ccddata_image": ["CCDDataFormatter"],
+    "delegate": ["SPHERExImageDelegate"],
+    "handles": ["HandlePool", "PooledHDUList", "configureHandlePool", "getHandlePool"],
+    "spherex_image": ["SPHERExImageFormatter"],
+    "spherex_hdf5": ["SPHERExHDF5Formatter"],
+    "stored": ["storedDatasetReader"],
+})
@@ -1,5 +1,7 @@
 __all__ = ["AstropyImageFormatter"]
 
+import os
+
 from astropy.io import fits
 from typing import (
     Any,
@@ -9,6 +11,12 @@ from typing import (
 
 from lsst.daf.butler.formatters.file import FileFormatter
 
+from ..core.instrumentation import current_stage, instrumented
+from .handles import getHandlePool
+
+# values of the mode parameter
+_MODES = ("eager", "memmap")
+
 
 class AstropyImageFormatter(FileFormatter):
     """Interface for reading and writing astropy
@@ -17,9 +25,25 @@ class AstropyImageFormatter(FileFormatter):
 
     extension = ".fits"
 
-    unsupportedParameters = None
-    """This formatter does not support any parameters (`frozenset`)"""
+    unsupportedParameters = frozenset()
+    """This formatter supports all storage class parameters (`frozenset`)
+
+    Supported parameters:
+
+    ``mode`` : `str`
+        How the file is read, by default ``mode`` of the process-local
+        pool of open files (``eager``, unless configured otherwise by
+        `~spherex.formatters.configureHandlePool`):
+
+        ``eager``
+            Read the data of all extensions and close the file.
+        ``memmap``
+            Memory-map the file and keep it open in the process-local pool
+            of open files, which closes the least recently used files and
+            reopens them on access, see `~spherex.formatters.HandlePool`.
+    """
 
+    @instrumented("AstropyImageFormatter.read")
     def _readFile(self, path: str, pytype: Optional[Type[Any]] = None) -> Any:
         """Read a file from the path in FITS format.
 
@@ -35,15 +59,32 @@ class AstropyImageFormatter(FileFormatter):
         data : `object`
             Either data as Python object read from JSON file, or None
             if the file could not be opened.
+
+        Raises
+        ------
+        ValueError
+            Raised if ``mode`` parameter is not supported.
         """
         # todo check pytype?
+        mode = (self.fileDescriptor.parameters or {}).get("mode") or getHandlePool().mode
+        if mode not in _MODES:
+            raise ValueError(f"Unsupported mode {mode!r}, expected one of {_MODES}")
         try:
-            data = fits.open(path)
+            if mode == "memmap":
+                data = getHandlePool().open(path)
+            else:
+                data = _readEager(path)
         except FileNotFoundError:
             data = None
 
+        record = current_stage()
+        if record and data is not None:
+            record.add(hdus=len(data))
+            if mode == "eager":
+                record.add(bytes_read=sum(data.fileinfo(i)["datSpan"] for i in range(len(data))))
         return data
 
+    @instrumented("AstropyImageFormatter.write")
     def _writeFile(self, inMemoryDataset: Any) -> None:
         """Write in memory dataset to file on disk.
 
@@ -59,4 +100,17 @@ class AstropyImageFormatter(FileFormatter):
         """
         if not isinstance(inMemoryDataset, fits.HDUList):
             raise NotImplementedError("Unable to write this representation of FITS into a file.")
-        inMemoryDataset.writeto(self.fileDescriptor.location.path)
+        path = self.fileDescriptor.location.path
+        inMemoryDataset.writeto(path)
+        record = current_stage()
+        if record:
+            record.add(bytes_written=os.path.getsize(path), hdus=len(inMemoryDataset))
+
+
+def _readEager(path):
+    """Read all headers and data of a FITS file and close it"""
+    with fits.open(path, memmap=False, lazy_load_hdus=False) as hdus:
+        for hdu in hdus:
+            # data are read, when they are first accessed
+            hdu.data
+    return hdus
@@ -0,0 +1,213 @@
+__all__ = ["ImageCache", "configureReadCache", "getReadCache"]
+
+import copy
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+)
+
+log = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Process-local LRU cache of decoded images, bounded by their size
+    in bytes.
+
+    Parameters
+    ----------
+    maxBytes : `int`
+        Maximum total size of the cached images. Zero disables the cache.
+    include : iterable [`str`]
+        Regular expressions. Only the files, whose paths match one of them,
+        are cached.
+
+    Notes
+    -----
+    The arrays of the cached images are shared by all readers, they are
+    made read-only: an in-place operation on the arrays of an image
+    returned from the cache raises `ValueError`. Readers get shallow
+    copies of the cached images (see ``SPHERExImage.__copy__``), so that
+    their metadata and component attributes can be changed. The cache is
+    thread-safe.
+    """
+
+    def __init__(self, maxBytes: int = 0, include: Iterable[str] = ()):
+        self.maxBytes = int(maxBytes)
+        self._include = [re.compile(pattern) for pattern in include]
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the cached images in bytes (`int`)."""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def accepts(self, path: str) -> bool:
+        """Check if the file should be cached
+
+        Parameters
+        ----------
+        path : `str`
+            File path.
+
+        Returns
+        -------
+        accepts : `bool`
+            `True` if the cache is enabled and the path matches one of
+            the ``include`` patterns.
+        """
+        return self.maxBytes > 0 and any(pattern.search(path) for pattern in self._include)
+
+    @staticmethod
+    def makeKey(path: str) -> Hashable:
+        """Make cache key for a file
+
+        The key includes file modification time and size, so that a file,
+        which is replaced, is read again.
+
+        Parameters
+        ----------
+        path : `str`
+            File path.
+
+        Returns
+        -------
+        key : `tuple`
+        """
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get cached image
+
+        Parameters
+        ----------
+        key : `tuple`
+            Cache key, see `makeKey`.
+
+        Returns
+        -------
+        image : `~spherex.core.SPHERExImage` or `None`
+            Shallow copy of the cached image with read-only arrays
+            or `None` if it is not in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.copy(entry[0])
+
+    def put(self, key: Hashable, image: Any) -> Any:
+        """Add image to the cache, evicting the least recently used images
+        to stay within the size limit.
+
+        Parameters
+        ----------
+        key : `tuple`
+            Cache key, see `makeKey`.
+        image : `~spherex.core.SPHERExImage`
+            Image to cache. Its arrays are made read-only, the cache keeps
+            the image, it should not be used by the caller afterwards.
+
+        Returns
+        -------
+        image : `~spherex.core.SPHERExImage`
+            Shallow copy of the cached image for the caller or the image
+            itself, if it is too large to be cached.
+        """
+        arrays = _imageArrays(image)
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.maxBytes:
+            log.debug("Not caching %s: %d bytes exceed the cache size", key[0], nbytes)
+            return image
+        for array in arrays:
+            array.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (image, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.maxBytes:
+                evictedKey, (_, evictedBytes) = self._entries.popitem(last=False)
+                self._nbytes -= evictedBytes
+                self.evictions += 1
+                log.debug("Evicted %s from read cache", evictedKey[0])
+        return copy.copy(image)
+
+    def clear(self) -> None:
+        """Remove all images from the cache and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self) -> str:
+        return (f"ImageCache(maxBytes={self.maxBytes}, nbytes={self._nbytes}, images={len(self)}, "
+                f"hits={self.hits}, misses={self.misses}, evictions={self.evictions})")
+
+
+def _imageArrays(image):
+    """Get the arrays of all image components"""
+    arrays = [image.data]
+    if image.uncertainty is not None:
+        arrays.append(image.uncertainty.array)
+    for component in (image.mask, getattr(image, "flags", None)):
+        if component is not None:
+            arrays.append(component)
+    return arrays
+
+
+# disabled until configured
+_readCache = ImageCache()
+
+
+def getReadCache() -> ImageCache:
+    """Get the read cache of `SPHERExImageFormatter`
+
+    Returns
+    -------
+    cache : `ImageCache`
+    """
+    return _readCache
+
+
+def configureReadCache(config: Mapping[str, Any]) -> ImageCache:
+    """Configure the read cache of `SPHERExImageFormatter` in this process
+
+    Parameters
+    ----------
+    config : `lsst.daf.butler.Config` or `dict`
+        Butler configuration. Cache parameters are read from
+        ``spherex.readCache`` section: ``maxBytes`` is the cache size limit
+        in bytes and ``include`` is the list of regular expressions, which
+        select the cached files by their paths. The cache is disabled,
+        if the section is missing or ``maxBytes`` is zero.
+
+    Returns
+    -------
+    cache : `ImageCache`
+        The new read cache.
+    """
+    global _readCache
+    section = (config.get("spherex") or {}).get("readCache") or {}
+    _readCache = ImageCache(maxBytes=section.get("maxBytes", 0), include=section.get("include", ()))
+    log.debug("Configured %r", _readCache)
+    return _readCache
@@ -1,5 +1,7 @@
 __all__ = ["CCDDataFormatter"]
 
+import os
+
 from astropy import units as u
 from astropy.nddata import CCDData, fits_ccddata_reader, fits_ccddata_writer
 
@@ -11,6 +13,10 @@ from typing import (
 
 from lsst.daf.butler.formatters.file import FileFormatter
 
+from ..core import spherex_image_reader
+from ..core.instrumentation import current_stage, instrumented
+from .parameters import get_section
+
 
 class CCDDataFormatter(FileFormatter):
     """Interface for reading and writing astropy
@@ -19,9 +25,19 @@ class CCDDataFormatter(FileFormatter):
 
     extension = ".fits"
 
-    unsupportedParameters = None
-    """This formatter does not support any parameters (`frozenset`)"""
+    unsupportedParameters = frozenset()
+    """This formatter supports all storage class parameters (`frozenset`)
 
+    Supported parameters:
+
+    ``bbox`` : `tuple` [`int`]
+        ``(xmin, ymin, xmax, ymax)`` zero-based pixel bounding box of the
+        image region to read, maximum values are exclusive.
+    ``slices`` : `tuple` [`slice`]
+        Image region to read as slices in numpy (row, column) order.
+    """
+
+    @instrumented("CCDDataFormatter.read")
     def _readFile(self, path: str, pytype: Optional[Type[Any]] = None) -> Any:
         """Read a file from the path in multi-extension FITS format into CCDData.
 
@@ -39,13 +55,29 @@ class CCDDataFormatter(FileFormatter):
             if the file could not be opened.
         """
         # todo check pytype?
+        section = get_section(self.fileDescriptor.parameters or {})
         try:
-            data = fits_ccddata_reader(path, unit=(u.electron/u.s))
+            if section is None:
+                data = fits_ccddata_reader(path, unit=(u.electron/u.s))
+                record = current_stage()
+                if record:
+                    # the reader decodes all extensions of the whole file
+                    record.add(bytes_read=os.path.getsize(path), hdus=_countPlanes(data))
+            else:
+                # fits_ccddata_reader can only read whole images,
+                # extensions follow fits_ccddata_writer conventions
+                image = spherex_image_reader(path, unit=(u.electron/u.s), section=section,
+                                             hdu_uncertainty="UNCERT", hdu_mask="MASK",
+                                             hdu_flags=None)
+                data = CCDData(image.data, meta=image.meta, unit=image.unit,
+                               mask=image.mask, uncertainty=image.uncertainty,
+                               wcs=image.wcs)
         except FileNotFoundError:
             data = None
 
         return data
 
+    @instrumented("CCDDataFormatter.write")
     def _writeFile(self, inMemoryDataset: Any) -> None:
         """Write in memory dataset to file on disk.
 
@@ -61,4 +93,13 @@ class CCDDataFormatter(FileFormatter):
         """
         if not isinstance(inMemoryDataset, CCDData):
             raise NotImplementedError("Unable to write this representation of FITS into a file.")
-        fits_ccddata_writer(inMemoryDataset, self.fileDescriptor.location.path)
+        path = self.fileDescriptor.location.path
+        fits_ccddata_writer(inMemoryDataset, path)
+        record = current_stage()
+        if record:
+            record.add(bytes_written=os.path.getsize(path), hdus=_countPlanes(inMemoryDataset))
+
+
+def _countPlanes(ccd):
+    """Number of image extensions of CCDData in a FITS file"""
+    return 1 + (ccd.uncertainty is not None) + (ccd.mask is not None)
@@ -0,0 +1,63 @@
+__all__ = ["SPHERExImageDelegate"]
+
+from typing import Any
+
+import numpy as np
+from lsst.daf.butler import StorageClassDelegate
+
+from ..core import image_summary
+from ..core.spherex_image import FLAG_DEFS, IMAGE_COMPONENTS, _to_variance
+
+# component names mapped to SPHERExImage attributes
+_ATTRIBUTES = {
+    "metadata": "meta",
+    "wcs": "wcs",
+    "flag_defs": "flag_defs",
+    "image": "data",
+    "flags": "flags",
+}
+
+
+class SPHERExImageDelegate(StorageClassDelegate):
+    """Get read-only components of an in-memory
+    `~spherex.core.SPHERExImage`
+
+    Components are ``metadata``, ``wcs``, ``flag_defs``, ``image``,
+    ``flags``, ``variance`` and ``summary``. Files written by
+    `~spherex.formatters.SPHERExImageFormatter` serve them without reading
+    the whole image, see `~spherex.core.spherex_image_component_reader`.
+    """
+
+    def getComponent(self, composite: Any, componentName: str) -> Any:
+        """Get a component from the image
+
+        Parameters
+        ----------
+        composite : `~spherex.core.SPHERExImage`
+            Image to get the component from.
+        componentName : `str`
+            Component name.
+
+        Returns
+        -------
+        component : `object`
+            Component value, ``variance`` is the uncertainty converted
+            to variance, ``summary`` is computed from the image,
+            see `~spherex.core.image_summary`.
+
+        Raises
+        ------
+        AttributeError
+            Raised if the component is not supported.
+        """
+        if componentName not in IMAGE_COMPONENTS:
+            raise AttributeError(f"Unsupported component {componentName} of {type(composite).__name__}")
+        if componentName == "summary":
+            return image_summary(composite.data, composite.flags, composite.flag_defs or FLAG_DEFS)
+        if componentName != "variance":
+            return getattr(composite, _ATTRIBUTES[componentName])
+        uncertainty = composite.uncertainty
+        if uncertainty is None:
+            return None
+        # a copy, the image uncertainty is not converted in place
+        return _to_variance(type(uncertainty), np.array(uncertainty.array))
@@ -0,0 +1,219 @@
+__all__ = ["HandlePool", "PooledHDUList", "configureHandlePool", "getHandlePool"]
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Mapping,
+    Optional,
+)
+
+from astropy.io import fits
+
+log = logging.getLogger(__name__)
+
+
+class PooledHDUList(fits.HDUList):
+    """Memory-mapped FITS file in a `HandlePool`, reopened on access
+    after it was closed by the pool.
+
+    Parameters
+    ----------
+    path : `str`
+        File path.
+    pool : `HandlePool`
+        Pool the file belongs to.
+
+    Notes
+    -----
+    Every access to an extension marks the file as used. When the pool
+    closes the file, mapped data of its extensions are released, the next
+    access reopens the file and maps them again. Arrays taken from the
+    extensions before stay valid. Extensions are replaced on reopening,
+    so the list is for reading: changes to headers or data of an
+    extension may be lost, and extension objects kept by the caller are
+    not reopened. `close` removes the file from the pool. A list should
+    be used by one thread at a time.
+    """
+
+    def __init__(self, path: str, pool: "HandlePool"):
+        super().__init__()
+        self._path = path
+        self._pool = pool
+        self._opened = None
+
+    def _reopen(self) -> None:
+        """Open the file and replace extensions, whose data are released."""
+        opened = fits.open(self._path, memmap=True, lazy_load_hdus=False)
+        if not list.__len__(self):
+            list.extend(self, opened)
+        else:
+            for index, hdu in enumerate(opened):
+                if not list.__getitem__(self, index)._data_loaded:
+                    list.__setitem__(self, index, hdu)
+        self._opened = opened
+
+    def _release(self) -> None:
+        """Close the file, mapped data of the extensions are deleted."""
+        opened, self._opened = self._opened, None
+        if opened is not None:
+            opened.close()
+
+    def __getitem__(self, key):
+        self._pool._touch(self)
+        return super().__getitem__(key)
+
+    def filename(self) -> Optional[str]:
+        return self._path
+
+    def close(self, output_verify="exception", verbose=False, closed=True) -> None:
+        """Close the file and remove it from the pool.
+
+        The file is reopened, if the list is used again.
+        """
+        self._pool._remove(self)
+        self._release()
+
+
+class HandlePool:
+    """Process-local pool of memory-mapped FITS files, bounded by
+    the number of files held open.
+
+    Parameters
+    ----------
+    maxOpen : `int`
+        Maximum number of files held open. When a file is opened or
+        reopened in a full pool, the least recently used files are closed.
+    mode : `str`
+        Read mode of `AstropyImageFormatter` for reads without the ``mode``
+        parameter: ``eager`` or ``memmap``, which opens files in the pool.
+
+    Notes
+    -----
+    The pool bounds only the files it holds, each costs up to two file
+    descriptors: the file and its memory map. A memory map stays open,
+    with its own descriptor, while an array of its data is referenced, so
+    each file with live data arrays costs one more descriptor, closed or
+    not. Use the ``eager`` mode of `AstropyImageFormatter` if the number
+    of descriptors must be strictly bounded. The pool is thread-safe.
+    """
+
+    def __init__(self, maxOpen: int = 64, mode: str = "eager"):
+        if maxOpen < 1:
+            raise ValueError(f"maxOpen must be positive, got {maxOpen}")
+        if mode not in ("eager", "memmap"):
+            raise ValueError(f"Unsupported mode {mode!r}, expected 'eager' or 'memmap'")
+        self.maxOpen = int(maxOpen)
+        self.mode = mode
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def open(self, path: str) -> PooledHDUList:
+        """Open memory-mapped FITS file and add it to the pool
+
+        Parameters
+        ----------
+        path : `str`
+            File path.
+
+        Returns
+        -------
+        hdus : `PooledHDUList`
+            Open file. All headers are read, data are mapped, when they
+            are first accessed.
+
+        Raises
+        ------
+        FileNotFoundError
+            Raised if the file does not exist.
+        """
+        hdus = PooledHDUList(path, self)
+        self._touch(hdus)
+        return hdus
+
+    def _touch(self, hdus: PooledHDUList) -> None:
+        """Mark a file as the most recently used one, reopen it if it
+        was closed and close the least recently used files over the limit.
+        """
+        key = id(hdus)
+        with self._lock:
+            if key in self._handles:
+                self._handles.move_to_end(key)
+                return
+        hdus._reopen()
+        evicted = []
+        with self._lock:
+            self._handles[key] = hdus
+            self.opened += 1
+            while len(self._handles) > self.maxOpen:
+                evicted.append(self._handles.popitem(last=False)[1])
+                self.evictions += 1
+        for handle in evicted:
+            log.debug("Closing %s", handle.filename())
+            handle._release()
+
+    def _remove(self, hdus: PooledHDUList) -> None:
+        """Remove a file closed by its user from the pool."""
+        with self._lock:
+            self._handles.pop(id(hdus), None)
+
+    def closeAll(self) -> None:
+        """Close all files in the pool and reset the counters."""
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self.opened = self.evictions = 0
+        for handle in handles:
+            handle._release()
+
+    def __repr__(self) -> str:
+        return (f"HandlePool(maxOpen={self.maxOpen}, mode={self.mode!r}, open={len(self)}, "
+                f"opened={self.opened}, "
+                f"evictions={self.evictions})")
+
+
+_handlePool = HandlePool()
+
+
+def getHandlePool() -> HandlePool:
+    """Get the pool of files opened by `AstropyImageFormatter`
+    in ``memmap`` mode
+
+    Returns
+    -------
+    pool : `HandlePool`
+    """
+    return _handlePool
+
+
+def configureHandlePool(config: Mapping[str, Any]) -> HandlePool:
+    """Configure the pool of open files of `AstropyImageFormatter`
+    in this process
+
+    Files in the current pool are closed.
+
+    Parameters
+    ----------
+    config : `lsst.daf.butler.Config` or `dict`
+        Butler configuration. ``maxOpen`` in ``spherex.handlePool`` section
+        is the maximum number of files held open, 64 if the section is
+        missing, ``mode`` is the default read mode of
+        `AstropyImageFormatter`, ``eager`` if it is missing.
+
+    Returns
+    -------
+    pool : `HandlePool`
+        The new pool.
+    """
+    global _handlePool
+    section = (config.get("spherex") or {}).get("handlePool") or {}
+    _handlePool.closeAll()
+    _handlePool = HandlePool(maxOpen=section.get("maxOpen", 64), mode=section.get("mode", "eager"))
+    log.debug("Configured %r", _handlePool)
+    return _handlePool
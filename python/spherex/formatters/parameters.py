@@ -0,0 +1,46 @@
+"""Read parameters shared by the image formatters"""
+
+__all__ = ["get_section"]
+
+from typing import (
+    Any,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+
+def get_section(parameters: Mapping[str, Any]) -> Optional[Tuple[slice, ...]]:
+    """Get the image section to read from the read parameters.
+
+    Parameters
+    ----------
+    parameters : `dict`
+        Read parameters. The section can be given either as
+
+        ``bbox`` : `tuple` [`int`]
+            ``(xmin, ymin, xmax, ymax)`` zero-based pixel bounding box,
+            maximum values are exclusive.
+        ``slices`` : `tuple` [`slice`]
+            Slices in numpy (row, column) order.
+
+    Returns
+    -------
+    section : `tuple` [`slice`] or None
+        Slices in numpy order or None, if no section is requested.
+
+    Raises
+    ------
+    ValueError
+        Raised if both ``bbox`` and ``slices`` are given.
+    """
+    bbox = parameters.get("bbox")
+    slices = parameters.get("slices")
+    if bbox is not None and slices is not None:
+        raise ValueError("Only one of 'bbox' and 'slices' parameters can be used.")
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        return (slice(ymin, ymax), slice(xmin, xmax))
+    if slices is not None:
+        return tuple(slices)
+    return None
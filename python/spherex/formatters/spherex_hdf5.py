@@ -0,0 +1,164 @@
+__all__ = ["SPHERExHDF5Formatter"]
+
+from typing import (
+    Any,
+    Dict,
+    Mapping,
+    Optional,
+    Type,
+)
+
+from astropy import units as u
+from lsst.daf.butler.formatters.file import FileFormatter
+
+from ..core import SPHERExImage
+from ..core.instrumentation import instrumented, stage
+from ..core.spherex_hdf5 import (CHUNK_SHAPE, spherex_hdf5_component_reader, spherex_hdf5_reader,
+                                 spherex_hdf5_writer)
+from ..core.spherex_image import IMAGE_COMPONENTS
+from .parameters import get_section
+from .spherex_image import _HDU_ARGS
+
+
+class SPHERExHDF5Formatter(FileFormatter):
+    """Interface for reading and writing `~spherex.core.SPHERExImage`
+    to and from chunked, compressed HDF5 files.
+
+    Image, flags, variance and mask are stored as chunked datasets,
+    metadata, WCS and flag definitions as FITS headers in their attributes,
+    see `~spherex.core.spherex_hdf5_writer`. Sections are read chunk by
+    chunk, only the chunks overlapping the section are read and decoded,
+    in parallel.
+    """
+
+    extension = ".h5"
+
+    unsupportedParameters = frozenset()
+    """This formatter supports all storage class parameters (`frozenset`)
+
+    Supported parameters:
+
+    ``bbox`` : `tuple` [`int`]
+        ``(xmin, ymin, xmax, ymax)`` zero-based pixel bounding box of the
+        image region to read, maximum values are exclusive.
+    ``slices`` : `tuple` [`slice`]
+        Image region to read as slices in numpy (row, column) order.
+    ``hdus`` : iterable [`str`]
+        Optional datasets to read: any of ``"variance"``, ``"mask"``
+        and ``"flags"``. By default, all present datasets are read.
+    ``lazy`` : `bool`
+        Ignored: the components are read with the image.
+
+    Read-only components are read as by `SPHERExImageFormatter`: header
+    components from the attributes, array components from one dataset.
+    """
+
+    supportedWriteParameters = frozenset({"chunks", "compression", "level", "summary"})
+    """Formatter parameters (`frozenset`): ``chunks`` is the chunk shape
+    (``[256, 256]`` by default), ``compression`` is ``gzip`` (default),
+    ``lzf`` or ``none``, ``level`` is the ``gzip`` level (1 by default),
+    if ``summary`` is `True` (default), image summary is stored in the flags
+    header, see `~spherex.core.spherex_hdf5_writer`. Chunks are decoded on
+    read by the threads of a pool shared by all readers in the process,
+    configured by `~spherex.core.configure_hdf5_decoding`."""
+
+    writtenSummary: Optional[Dict[str, Any]] = None
+    """Image summary stored in the file by the last `write`, see
+    `SPHERExImageFormatter.writtenSummary` (`dict` or `None`)"""
+
+    def read(self, component: Optional[str] = None) -> Any:
+        """Read the image or one of its components.
+
+        Parameters
+        ----------
+        component : `str`, optional
+            Component to read. If `None`, the whole image is read.
+
+        Returns
+        -------
+        data : `object`
+            Image or component value. Missing optional components
+            (``flags``, ``flag_defs``, ``variance`` or ``wcs``) are `None`,
+            as is the value of any component, if the file does not exist.
+        """
+        if component not in IMAGE_COMPONENTS:
+            return super().read(component=component)
+        try:
+            with stage("SPHERExHDF5Formatter.readComponent", component=component):
+                return spherex_hdf5_component_reader(
+                    self.fileDescriptor.location.path, component,
+                    section=get_section(self.fileDescriptor.parameters or {}))
+        except FileNotFoundError:
+            return None
+
+    @instrumented("SPHERExHDF5Formatter.read")
+    def _readFile(self, path: str, pytype: Optional[Type[Any]] = None) -> Any:
+        """Read a file from the path in HDF5 format.
+
+        Parameters
+        ----------
+        path : `str`
+            Path to use to open HDF5 file.
+        pytype : `class`, optional
+            Not used by this implementation.
+
+        Returns
+        -------
+        data : `~spherex.core.SPHERExImage`
+            Image or `None` if the file does not exist.
+        """
+        return self._readImage(path, self.fileDescriptor.parameters or {})
+
+    def _readImage(self, path: str, parameters: Mapping[str, Any]) -> Optional[SPHERExImage]:
+        """Read image, applying read parameters
+
+        Parameters
+        ----------
+        path : `str`
+            File path.
+        parameters : `dict`
+            Read parameters.
+
+        Returns
+        -------
+        data : `~spherex.core.SPHERExImage` or `None`
+            Image or `None` if the file does not exist.
+        """
+        kwargs = {}
+        hdus = parameters.get("hdus")
+        if hdus is not None:
+            unknown = set(hdus) - set(_HDU_ARGS)
+            if unknown:
+                raise ValueError(f"Unsupported values of 'hdus' parameter: {unknown}")
+            kwargs = {arg: None for name, arg in _HDU_ARGS.items() if name not in hdus}
+        try:
+            data = spherex_hdf5_reader(path, unit=(u.electron / u.s), section=get_section(parameters),
+                                       **kwargs)
+        except FileNotFoundError:
+            data = None
+
+        return data
+
+    @instrumented("SPHERExHDF5Formatter.write")
+    def _writeFile(self, inMemoryDataset: Any) -> None:
+        """Write in memory dataset to file on disk.
+
+        Parameters
+        ----------
+        inMemoryDataset : `object`
+            Object to serialize.
+
+        Raises
+        ------
+        Exception
+            The file could not be written.
+        """
+        if not isinstance(inMemoryDataset, SPHERExImage):
+            raise NotImplementedError("Unable to write this representation of an image into a file.")
+        compression = self.writeParameters.get("compression", "gzip")
+        self.writtenSummary = spherex_hdf5_writer(
+            inMemoryDataset, self.fileDescriptor.location.path,
+            chunks=tuple(self.writeParameters.get("chunks", CHUNK_SHAPE)),
+            compression=None if compression in (None, "none") else compression,
+            compression_opts=self.writeParameters.get("level", 1),
+            summary=self.writeParameters.get("summary", True))
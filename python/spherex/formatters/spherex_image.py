@@ -2,6 +2,8 @@ __all__ = ["SPHERExImageFormatter"]
 
 from typing import (
     Any,
+    Dict,
+    Mapping,
     Optional,
     Type,
 )
@@ -9,7 +11,19 @@ from typing import (
 from astropy import units as u
 from lsst.daf.butler.formatters.file import FileFormatter
 
-from ..core import SPHERExImage, spherex_image_reader, spherex_image_writer
+from ..core import SPHERExImage, spherex_image_component_reader, spherex_image_reader, spherex_image_writer
+from ..core.instrumentation import instrumented, stage
+from ..core.spherex_image import COMPRESSED_EXTENSIONS, IMAGE_COMPONENTS
+from .cache import getReadCache
+from .parameters import get_section
+
+# read parameter values for optional image extensions
+# mapped to the reader arguments, which define these extensions
+_HDU_ARGS = {
+    "variance": "hdu_uncertainty",
+    "mask": "hdu_mask",
+    "flags": "hdu_flags",
+}
 
 
 class SPHERExImageFormatter(FileFormatter):
@@ -19,9 +33,77 @@ class SPHERExImageFormatter(FileFormatter):
 
     extension = ".fits"
 
-    unsupportedParameters = None
-    """This formatter does not support any parameters (`frozenset`)"""
+    unsupportedParameters = frozenset()
+    """This formatter supports all storage class parameters (`frozenset`)
+
+    Supported parameters:
+
+    ``lazy`` : `bool`
+        Defer reading of variance, mask and flags until they are first
+        accessed, see `~spherex.core.spherex_image_reader`.
+    ``bbox`` : `tuple` [`int`]
+        ``(xmin, ymin, xmax, ymax)`` zero-based pixel bounding box of the
+        image region to read, maximum values are exclusive.
+    ``slices`` : `tuple` [`slice`]
+        Image region to read as slices in numpy (row, column) order.
+    ``hdus`` : iterable [`str`]
+        Optional extensions to read: any of ``"variance"``, ``"mask"``
+        and ``"flags"``. By default, all present extensions are read.
+
+    Read-only components (``metadata``, ``wcs``, ``flag_defs``, ``image``,
+    ``flags``, ``variance`` and ``summary``) are read without decoding the rest of the
+    image: header components read only the extension headers, array
+    components only one extension. ``bbox`` and ``slices`` apply to them.
+    """
+
+    supportedWriteParameters = frozenset({"recipe", "summary"})
+    """Write parameters: ``recipe`` is the name of the write recipe
+    to use, if ``summary`` is `True` (default), image summary is computed
+    and stored in the file header, see `~spherex.core.spherex_image_writer`
+    (`frozenset`)"""
+
+    writtenSummary: Optional[Dict[str, Any]] = None
+    """Image summary stored in the file by the last `write`, or `None`,
+    if the summary is not written. Writers, which move the file into the
+    datastore themselves, add it to `~spherex.instrument.SummaryIndex`
+    without reading the file back (`dict` or `None`)"""
 
+    def read(self, component: Optional[str] = None) -> Any:
+        """Read the image or one of its components.
+
+        Parameters
+        ----------
+        component : `str`, optional
+            Component to read. If `None`, the whole image is read.
+
+        Returns
+        -------
+        data : `object`
+            Image or component value. Missing optional components
+            (``flags``, ``flag_defs``, ``variance`` or ``wcs``) are `None`,
+            as is the value of any component, if the file does not exist.
+
+        Notes
+        -----
+        A component of an image, which is in the read cache, is taken
+        from the cached image.
+        """
+        if component not in IMAGE_COMPONENTS:
+            return super().read(component=component)
+        path = self.fileDescriptor.location.path
+        cache = getReadCache()
+        try:
+            if cache.accepts(path):
+                data = cache.get(cache.makeKey(path))
+                if data is not None:
+                    return self.fileDescriptor.storageClass.delegate().getComponent(data, component)
+            with stage("SPHERExImageFormatter.readComponent", component=component):
+                return spherex_image_component_reader(
+                    path, component, section=get_section(self.fileDescriptor.parameters or {}))
+        except FileNotFoundError:
+            return None
+
+    @instrumented("SPHERExImageFormatter.read")
     def _readFile(self, path: str, pytype: Optional[Type[Any]] = None) -> Any:
         """Read a file from the path in FITS format.
 
@@ -37,15 +119,133 @@ class SPHERExImageFormatter(FileFormatter):
         data : `object`
             Either data as Python object read from JSON file, or None
             if the file could not be opened.
+
+        Notes
+        -----
+        Images read without parameters are served from the process-local
+        read cache, if it is configured for this file, see
+        `~spherex.formatters.configureReadCache`.
         """
         # todo check pytype?
+        parameters = self.fileDescriptor.parameters or {}
+        cache = getReadCache()
+        if parameters or not cache.accepts(path):
+            return self._readImage(path, parameters)
+        try:
+            key = cache.makeKey(path)
+        except FileNotFoundError:
+            return None
+        data = cache.get(key)
+        if data is None:
+            data = self._readImage(path, parameters)
+            if data is not None:
+                data = cache.put(key, data)
+        return data
+
+    def _readImage(self, path: str, parameters: Mapping[str, Any]) -> Optional[SPHERExImage]:
+        """Read image, applying read parameters
+
+        Parameters
+        ----------
+        path : `str`
+            File path.
+        parameters : `dict`
+            Read parameters.
+
+        Returns
+        -------
+        data : `~spherex.core.SPHERExImage` or `None`
+            Image or `None` if the file does not exist.
+        """
+        kwargs = {}
+        hdus = parameters.get("hdus")
+        if hdus is not None:
+            unknown = set(hdus) - set(_HDU_ARGS)
+            if unknown:
+                raise ValueError(f"Unsupported values of 'hdus' parameter: {unknown}")
+            kwargs = {arg: None for name, arg in _HDU_ARGS.items() if name not in hdus}
         try:
-            data = spherex_image_reader(path, unit=(u.electron / u.s))
+            data = spherex_image_reader(path, unit=(u.electron / u.s),
+                                        lazy=parameters.get("lazy", False),
+                                        section=get_section(parameters), **kwargs)
         except FileNotFoundError:
             data = None
 
         return data
 
+    @classmethod
+    def validateWriteRecipes(cls, recipes: Optional[Mapping[str, Any]]) -> Optional[Mapping[str, Any]]:
+        """Validate supplied recipes for this formatter.
+
+        Every recipe maps image extension (``image``, ``variance``, ``mask``
+        or ``flags``) to its tile compression: either a compression type,
+        such as ``RICE_1``, ``GZIP_2`` or ``PLIO_1``, or a mapping with
+        `~astropy.io.fits.CompImageHDU` keyword arguments, for example::
+
+            rice:
+              image:
+                compression_type: RICE_1
+                quantize_level: 16
+              flags: PLIO_1
+
+        Extensions, which are not listed in a recipe, are not compressed.
+
+        Parameters
+        ----------
+        recipes : `dict`
+            Recipes to validate. Can be empty dict or `None`.
+
+        Returns
+        -------
+        validated : `dict`
+            Validated recipes.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if validation fails.
+        """
+        if not recipes:
+            return recipes
+        validated = {}
+        for name, recipe in recipes.items():
+            recipe = dict(recipe or {})
+            unknown = set(recipe) - set(COMPRESSED_EXTENSIONS)
+            if unknown:
+                raise RuntimeError(f"Unrecognized extensions {unknown} in write recipe {name}, "
+                                   f"supported extensions are {COMPRESSED_EXTENSIONS}")
+            for extension, compression in recipe.items():
+                if isinstance(compression, str) or compression is None:
+                    continue
+                if "compression_type" not in compression:
+                    raise RuntimeError(f"Missing compression_type for {extension} in write recipe {name}")
+                recipe[extension] = dict(compression)
+            validated[name] = recipe
+        return validated
+
+    def _getCompression(self) -> Optional[Mapping[str, Any]]:
+        """Get compression settings from the write recipe
+
+        Returns
+        -------
+        compression : `dict` or `None`
+            Compression for every image extension, see
+            `~spherex.core.spherex_image_writer`.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the requested recipe is not defined.
+        """
+        recipeName = self.writeParameters.get("recipe", "default")
+        if recipeName not in self.writeRecipes:
+            if recipeName == "default":
+                # no recipes are defined: write uncompressed
+                return None
+            raise RuntimeError(f"Unrecognized write recipe {recipeName}")
+        return self.writeRecipes[recipeName]
+
+    @instrumented("SPHERExImageFormatter.write")
     def _writeFile(self, inMemoryDataset: Any) -> None:
         """Write in memory dataset to file on disk.
 
@@ -61,4 +261,6 @@ class SPHERExImageFormatter(FileFormatter):
         """
         if not isinstance(inMemoryDataset, SPHERExImage):
             raise NotImplementedError("Unable to write this representation of FITS into a file.")
-        spherex_image_writer(inMemoryDataset, self.fileDescriptor.location.path)
+        self.writtenSummary = spherex_image_writer(inMemoryDataset, self.fileDescriptor.location.path,
+                                                   compression=self._getCompression(),
+                                                   summary=self.writeParameters.get("summary", True))
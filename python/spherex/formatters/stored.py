@@ -0,0 +1,48 @@
+"""Reading datasets with the formatters they were stored with"""
+
+__all__ = ["storedDatasetReader"]
+
+from typing import (
+    Any,
+    Callable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+
+def storedDatasetReader(butler, ref, parameters: Optional[Mapping[str, Any]] = None
+                        ) -> Tuple[Callable[[], Any], List[str]]:
+    """Get function reading a dataset with the formatter it was stored with
+
+    Registry and datastore lookups are done by the calling thread, so that
+    the returned function only reads the files and can be called by another
+    thread.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler with a file datastore.
+    ref : `lsst.daf.butler.DatasetRef`
+        Resolved dataset reference.
+    parameters : `dict`, optional
+        Read parameters of the dataset storage class.
+
+    Returns
+    -------
+    read : callable
+        Function with no arguments, which returns the dataset as
+        ``butler.getDirect(ref, parameters=parameters)`` does. A single local
+        file is read by the stored formatter directly, datasets stored in
+        several files (disassembled composites) and remote files are read
+        with ``butler.getDirect``.
+    paths : `list` [`str`]
+        Paths of the local files of the dataset.
+    """
+    getInfo = butler.datastore._prepare_for_get(ref, parameters=parameters)
+    paths = [info.location.path for info in getInfo if info.location.uri.isLocal]
+    if len(getInfo) == 1 and getInfo[0].location.uri.isLocal and not getInfo[0].assemblerParams:
+        formatter, component = getInfo[0].formatter, getInfo[0].component
+        return (lambda: formatter.read(component=component)), paths
+    return (lambda: butler.getDirect(ref, parameters=parameters)), paths
@@ -1 +1,3 @@
 from .simulator_instrument import *
+from .exposure import *
+from .summary_index import *
@@ -0,0 +1,169 @@
+__all__ = ["getExposureImages", "getExposureCube"]
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from ..core import SPHERExImage
+from ..formatters.stored import storedDatasetReader
+
+
+def _findExposureDatasets(butler, datasetType, exposure, instrument, detectors, collections, parameters):
+    """Find datasets of all detectors of an exposure
+
+    Returns
+    -------
+    readers : `dict` [`int`, `tuple`]
+        Dataset name and function reading the dataset with the read
+        parameters by detector id, sorted by detector id.
+    """
+    registry = butler.registry
+    if collections is None:
+        collections = butler.collections
+    if detectors is None:
+        detectors = sorted(dataId["detector"] for dataId in
+                           registry.queryDataIds(["detector"], dataId={"instrument": instrument}))
+    readers = {}
+    for detector in detectors:
+        ref = registry.findDataset(datasetType, instrument=instrument, exposure=exposure,
+                                   detector=detector, collections=collections)
+        if ref is None:
+            continue
+        readers[detector] = (f"{datasetType} {ref.dataId}", storedDatasetReader(butler, ref, parameters)[0])
+    if not readers:
+        raise LookupError(f"No {datasetType} datasets found for exposure {exposure} in {collections}")
+    return readers
+
+
+def getExposureImages(butler, datasetType: str, exposure: int, *, instrument: str = "simulator",
+                      detectors: Optional[List[int]] = None, collections: Any = None,
+                      parameters: Optional[Mapping[str, Any]] = None,
+                      jobs: Optional[int] = None) -> Dict[int, SPHERExImage]:
+    """Read images of all detectors of an exposure concurrently
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to find the datasets with.
+    datasetType : `str`
+        Dataset type with ``SPHERExImage`` storage class. Local files are
+        read by the formatter they were stored with, for example,
+        `~spherex.formatters.SPHERExImageFormatter` or
+        `~spherex.formatters.SPHERExHDF5Formatter`.
+    exposure : `int`
+        Exposure id.
+    instrument : `str`, optional
+        Instrument name.
+    detectors : `list` [`int`], optional
+        Detector ids. By default, all detectors of the instrument.
+    collections : optional
+        Collections to search, by default the butler collections.
+    parameters : `dict`, optional
+        Read parameters, see `~spherex.formatters.SPHERExImageFormatter`,
+        for example, ``{"lazy": True}`` returns images with memory-mapped
+        data arrays from FITS files.
+    jobs : `int`, optional
+        Number of reader threads, by default one per detector.
+
+    Returns
+    -------
+    images : `dict` [`int`, `~spherex.core.SPHERExImage`]
+        Images by detector id, sorted by detector id. Detectors without
+        the dataset are skipped.
+
+    Raises
+    ------
+    LookupError
+        Raised if no datasets are found.
+
+    Notes
+    -----
+    Registry lookups are done by the calling thread: the files are found
+    first, then they are read and decoded by a pool of threads, since
+    file reads and most of the FITS decoding release the GIL.
+    """
+    readers = _findExposureDatasets(butler, datasetType, exposure, instrument, detectors, collections,
+                                    parameters)
+    with ThreadPoolExecutor(max_workers=jobs or len(readers)) as executor:
+        images = executor.map(lambda reader: reader[1](), readers.values())
+        return dict(zip(readers, images))
+
+
+def getExposureCube(butler, datasetType: str, exposure: int, *, instrument: str = "simulator",
+                    detectors: Optional[List[int]] = None, collections: Any = None,
+                    dtype: Any = None, jobs: Optional[int] = None) -> Tuple[np.ndarray, List[int]]:
+    """Read image data of all detectors of an exposure concurrently
+    into a preallocated 3-D array
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to find the datasets with.
+    datasetType : `str`
+        Dataset type with ``SPHERExImage`` storage class. Local files are
+        read by the formatter they were stored with, for example,
+        `~spherex.formatters.SPHERExImageFormatter` or
+        `~spherex.formatters.SPHERExHDF5Formatter`.
+    exposure : `int`
+        Exposure id.
+    instrument : `str`, optional
+        Instrument name.
+    detectors : `list` [`int`], optional
+        Detector ids. By default, all detectors of the instrument.
+    collections : optional
+        Collections to search, by default the butler collections.
+    dtype : `numpy.dtype`, optional
+        Data type of the cube, by default the data type of the first image
+        in native byte order.
+    jobs : `int`, optional
+        Number of reader threads, by default one per detector.
+
+    Returns
+    -------
+    cube : `numpy.ndarray`
+        Image data stacked along the first axis, in detector id order.
+    detectors : `list` [`int`]
+        Detector ids of the cube planes.
+
+    Raises
+    ------
+    LookupError
+        Raised if no datasets are found.
+    ValueError
+        Raised if the images have different shapes.
+
+    Notes
+    -----
+    Images are read lazily: the data array of every FITS image is
+    memory-mapped (unless the data are scaled) and copied straight into its
+    cube plane, variance, mask and flags are not read. FITS data are
+    big-endian, they are converted to the byte order of the cube by the copy.
+    """
+    readers = _findExposureDatasets(butler, datasetType, exposure, instrument, detectors, collections,
+                                    {"lazy": True, "hdus": []})
+    names, reads = zip(*readers.values())
+
+    first = reads[0]()
+    cube = np.empty((len(reads),) + first.data.shape, dtype=dtype or first.data.dtype.newbyteorder("="))
+
+    def fill(index, image=None):
+        if image is None:
+            image = reads[index]()
+        if image.data.shape != cube.shape[1:]:
+            raise ValueError(f"{names[index]} shape {image.data.shape} does not match {cube.shape[1:]}")
+        cube[index] = image.data
+
+    with ThreadPoolExecutor(max_workers=jobs or len(reads)) as executor:
+        futures = [executor.submit(fill, 0, first)]
+        futures += [executor.submit(fill, index) for index in range(1, len(reads))]
+        for future in futures:
+            future.result()
+    return cube, list(readers)
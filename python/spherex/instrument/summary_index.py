@@ -0,0 +1,218 @@
+__all__ = ["SUMMARY_INDEX_FILE", "SummaryIndex"]
+
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+)
+
+from ..formatters.stored import storedDatasetReader
+
+log = logging.getLogger(__name__)
+
+# default index file name in the repository root
+SUMMARY_INDEX_FILE = "image_summary.sqlite3"
+
+# data ID keys, which are stored in their own columns
+_DATA_ID_COLUMNS = ("instrument", "exposure", "detector")
+
+# summary statistics, see spherex.core.image_summary
+_STATISTICS = ("size", "npix", "min", "max", "median", "sigma")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_summary (
+    dataset_id TEXT PRIMARY KEY,
+    dataset_type TEXT NOT NULL,
+    run TEXT NOT NULL,
+    instrument TEXT,
+    exposure INTEGER,
+    detector INTEGER,
+    size INTEGER,
+    npix INTEGER,
+    min REAL,
+    max REAL,
+    median REAL,
+    sigma REAL
+);
+CREATE INDEX IF NOT EXISTS image_summary_data_id
+    ON image_summary (dataset_type, instrument, exposure, detector);
+CREATE TABLE IF NOT EXISTS flag_count (
+    dataset_id TEXT NOT NULL REFERENCES image_summary (dataset_id) ON DELETE CASCADE,
+    flag TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    fraction REAL NOT NULL,
+    PRIMARY KEY (dataset_id, flag)
+);
+CREATE INDEX IF NOT EXISTS flag_count_fraction ON flag_count (flag, fraction);
+"""
+
+
+class SummaryIndex:
+    """Sidecar SQLite table of image summaries, which selects datasets
+    by data quality without reading their files
+
+    Parameters
+    ----------
+    path : `str`
+        SQLite database file, created if it does not exist.
+
+    Notes
+    -----
+    Summaries (pixel statistics and flag counts) are written into the
+    file headers by `~spherex.formatters.SPHERExImageFormatter` and
+    `~spherex.formatters.SPHERExHDF5Formatter`, see
+    `~spherex.core.spherex_image_writer`. They are stored in two tables:
+    ``image_summary`` with one row per dataset and ``flag_count`` with
+    one row per dataset and flag, indexed by flag and the fraction of
+    flagged pixels. The tables can be queried with SQL directly.
+
+    `~spherex.script.runPipeline` adds the summaries of the outputs, as
+    returned by the writers, when it ingests them. Datasets written
+    otherwise, for example, by ``butler.put``, are added by `update`,
+    which reads the summaries from the files (a few kilobytes per file).
+    The index is not a part of the registry: it is not updated, when
+    datasets are removed or their runs are pruned, and rows of such
+    datasets are stale until they are deleted from the tables.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM image_summary").fetchone()[0]
+
+    def add(self, ref, run: str, summary: Mapping[str, Any]) -> None:
+        """Add or replace the summary of a dataset
+
+        Parameters
+        ----------
+        ref : `lsst.daf.butler.DatasetRef`
+            Resolved dataset reference.
+        run : `str`
+            Run collection of the dataset.
+        summary : `dict`
+            Image summary, see `~spherex.core.image_summary`.
+        """
+        with self._connection:
+            self._add(ref, run, summary)
+
+    def _add(self, ref, run, summary):
+        datasetId = str(ref.id)
+        dataId = ref.dataId.byName()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO image_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (datasetId, ref.datasetType.name, run, *(dataId.get(key) for key in _DATA_ID_COLUMNS),
+             *(summary.get(key) for key in _STATISTICS)))
+        self._connection.execute("DELETE FROM flag_count WHERE dataset_id = ?", (datasetId,))
+        size = summary.get("size") or summary.get("npix") or 1
+        self._connection.executemany(
+            "INSERT INTO flag_count VALUES (?, ?, ?, ?)",
+            [(datasetId, flag.upper(), count, count / size)
+             for flag, count in summary["flag_counts"].items()])
+
+    def update(self, butler, datasetType: str, collections: Any = None, where: str = "",
+               jobs: Optional[int] = None) -> int:
+        """Index the summaries of the datasets, which are not indexed yet
+
+        Parameters
+        ----------
+        butler : `lsst.daf.butler.Butler`
+            Butler to find the datasets with.
+        datasetType : `str`
+            Dataset type with ``SPHERExImage`` storage class. The summaries
+            are read by the formatter of each dataset, so FITS and HDF5
+            datasets can be mixed.
+        collections : optional
+            Collections to search, by default the butler collections.
+        where : `str`, optional
+            Data ID query expression.
+        jobs : `int`, optional
+            Number of threads, which read the summaries.
+
+        Returns
+        -------
+        count : `int`
+            Number of indexed datasets. Datasets, whose files have no
+            summary, are skipped.
+        """
+        if collections is None:
+            collections = butler.collections
+        indexed = {row[0] for row in self._connection.execute("SELECT dataset_id FROM image_summary")}
+        refs = [ref for ref in butler.registry.queryDatasets(datasetType, collections=collections,
+                                                             where=where)
+                if str(ref.id) not in indexed]
+        # registry and datastore lookups are done by the calling thread,
+        # worker threads only read the summaries
+        readers = [storedDatasetReader(butler, ref.makeComponentRef("summary")) for ref in refs]
+        count = 0
+        with ThreadPoolExecutor(max_workers=jobs) as executor, self._connection:
+            summaries = executor.map(lambda reader: reader[0](), readers)
+            for ref, (_, paths), summary in zip(refs, readers, summaries):
+                if summary is None:
+                    log.warning("No summary in %s", ", ".join(paths))
+                    continue
+                self._add(ref, ref.run, summary)
+                count += 1
+        log.info("Indexed %d of %d %s datasets", count, len(refs), datasetType)
+        return count
+
+    def query(self, datasetType: str, maxFlagFraction: Optional[Mapping[str, float]] = None,
+              **dataId: Any) -> List[Dict[str, Any]]:
+        """Select datasets by the fraction of flagged pixels
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type name.
+        maxFlagFraction : `dict` [`str`, `float`], optional
+            Maximum (exclusive) fraction of the pixels with a flag set by
+            flag name, for example, ``{"SATURATED": 0.01}``. Datasets,
+            whose summary has no count of the flag, are not selected.
+        **dataId
+            Values of ``instrument``, ``exposure`` and ``detector`` to select.
+
+        Returns
+        -------
+        summaries : `list` [`dict`]
+            Rows of ``image_summary`` table of the selected datasets.
+
+        Raises
+        ------
+        ValueError
+            Raised if a data ID key is not supported.
+        """
+        unknown = set(dataId) - set(_DATA_ID_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unsupported data ID keys {unknown}, supported keys are {_DATA_ID_COLUMNS}")
+        conditions = ["dataset_type = ?"]
+        values = [datasetType]
+        for key, value in dataId.items():
+            conditions.append(f"{key} = ?")
+            values.append(value)
+        for flag, fraction in (maxFlagFraction or {}).items():
+            conditions.append("dataset_id IN (SELECT dataset_id FROM flag_count "
+                              "WHERE flag = ? AND fraction < ?)")
+            values += [flag.upper(), fraction]
+        cursor = self._connection.execute(
+            f"SELECT * FROM image_summary WHERE {' AND '.join(conditions)} "
+            "ORDER BY instrument, exposure, detector", values)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
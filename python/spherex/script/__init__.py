@@ -1 +1,3 @@
-from .ingestSimulated import ingestSimulated
\ No newline at end of file
+from .indexSummaries import indexSummaries
+from .ingestSimulated import ingestSimulated
+from .runPipeline import runPipeline
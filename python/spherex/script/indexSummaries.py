@@ -0,0 +1,39 @@
+import os
+import logging
+
+from lsst.daf.butler import Butler
+
+from ..instrument.summary_index import SUMMARY_INDEX_FILE, SummaryIndex
+
+
+def indexSummaries(repo, dataset_type, collections=(), where="", index=None, jobs=None):
+    """Add image summaries of the datasets to the summary index
+
+    Parameters
+    ----------
+    repo : `str`
+        URI to the location of the butler repository.
+    dataset_type : `str`
+        Dataset type with ``SPHERExImage`` storage class.
+    collections : `list` [`str`]
+        Collections to search for the datasets.
+    where : `str`, optional
+        Data ID query expression.
+    index : `str`, optional
+        Summary index file. By default, ``image_summary.sqlite3``
+        in the repository root.
+    jobs : `int`, optional
+        Number of threads, which read the summaries.
+
+    Returns
+    -------
+    count : `int`
+        Number of indexed datasets.
+    """
+    butler = Butler(repo, collections=list(collections) or None)
+    if index is None:
+        index = os.path.join(repo, SUMMARY_INDEX_FILE)
+    with SummaryIndex(index) as summaryIndex:
+        count = summaryIndex.update(butler, dataset_type, where=where, jobs=jobs)
+        logging.info(f"{len(summaryIndex)} datasets in summary index {index}")
+    return count
@@ -1,8 +1,16 @@
+import os
 import re
+import time
+import contextlib
+import cProfile
 import datetime
 import logging
+import threading
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from lsst.daf.butler.core.utils import findFileResources
+import numpy as np
+from astropy.io import fits
 
 from lsst.daf.butler import (
     Butler,
@@ -14,10 +22,178 @@ from lsst.daf.butler import (
     Timespan
 )
 
-from ..formatters.astropy_image import AstropyImageFormatter
+from ..core.instrumentation import (
+    instrumentation_enabled,
+    instrumentation_sinks,
+    stage
+)
+from ..formatters.spherex_image import SPHERExImageFormatter
+
+# example: sim_exposure_000000_array_1.fits or
+#   sim_exposure_000000_array_2_dark_current.fits
+SIMULATED_FILE_PATTERN = re.compile(r"sim_exposure_(\d+)_array_(\d)[_,.]")
+
+# exposure record fields and FITS header keywords they are read from
+EXPOSURE_HEADER_KEYWORDS = {
+    "exposure_time": "EXPTIME",
+    "ra_boresight": "RA_BORE",
+    "dec_boresight": "DEC_BORE",
+    "roll": "ROLL",
+}
+
+# number of files per worker thread, which are parsed ahead of the ingest
+PARSE_AHEAD_PER_JOB = 4
+
+# maximum number of exposure ids per registry query, each is a bind value
+EXPOSURE_QUERY_BATCH = 500
+
+SimulatedFile = namedtuple("SimulatedFile", ["path", "exposure_id", "detector_id", "metadata"])
+"""Simulated file with exposure and detector ids and exposure metadata"""
+
+
+def parseSimulatedFile(path, read_header=False):
+    """Get exposure and detector ids and, optionally, exposure metadata
+    of a simulated file.
+
+    Parameters
+    ----------
+    path : `str`
+        File path.
+    read_header : `bool`
+        If `True`, read exposure metadata from the primary header and,
+        if the primary header does not have them, from the first extension
+        header. See `EXPOSURE_HEADER_KEYWORDS`.
+
+    Returns
+    -------
+    simulated_file : `SimulatedFile`
+
+    Raises
+    ------
+    ValueError
+        Raised if exposure and detector ids can not be parsed from the path.
+    """
+    m = SIMULATED_FILE_PATTERN.search(path)
+    if m is None:
+        raise ValueError(f"{path} does not match simulator file pattern")
+    g = m.groups()
+    if len(g) != 2:
+        raise ValueError(f"Unable to get exposure and detector from file name: {path}")
+    [exposure_id, detector_id] = list(map(int, g))
+
+    metadata = {}
+    if read_header:
+        # only the headers are read, lazy loading stops at the first extension
+        with fits.open(path, lazy_load_hdus=True) as hdus:
+            for hdu in hdus[:2]:
+                for field, keyword in EXPOSURE_HEADER_KEYWORDS.items():
+                    if field not in metadata and keyword in hdu.header:
+                        metadata[field] = float(hdu.header[keyword])
+                if len(metadata) == len(EXPOSURE_HEADER_KEYWORDS):
+                    break
+    return SimulatedFile(path, exposure_id, detector_id, metadata)
+
+
+def findSimulatedFiles(locations, regex, jobs=1):
+    """Find files to ingest
+
+    Parameters
+    ----------
+    locations : `list` [`str`]
+        Files to ingest and directories to search for files that match
+        ``regex`` to ingest.
+    regex : `str`
+        Regex string used to find files in directories listed in locations.
+    jobs : `int`
+        Number of locations to search concurrently.
+
+    Yields
+    ------
+    path : `str`
+        File path. Files are yielded while the directories are searched,
+        so that they can be parsed before the search ends. With ``jobs``
+        greater than one, the files of up to ``jobs`` locations are held
+        in memory.
+    """
+    fileRegex = None if regex is None else re.compile(regex)
+    if jobs <= 1 or len(locations) <= 1:
+        for location in locations:
+            yield from _walkLocation(location, fileRegex)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        found = _boundedMap(executor, lambda location: list(_walkLocation(location, fileRegex)),
+                            locations, jobs)
+        for files in found:
+            yield from files
 
 
-def ingestSimulated(repo, locations, regex, output_run, transfer="auto", ingest_type="rawexp"):
+def _walkLocation(location, fileRegex):
+    """Yield a file or the files in a directory tree, whose names match
+    the regex"""
+    if not os.path.isdir(location):
+        yield location
+        return
+    for root, dirs, files in os.walk(location):
+        dirs.sort()
+        for name in sorted(files):
+            if fileRegex is None or fileRegex.search(name):
+                yield os.path.join(root, name)
+
+
+def _boundedMap(executor, fn, iterable, limit):
+    """Like ``executor.map``, but consumes the iterable lazily: at most
+    ``limit`` calls are submitted ahead of the caller
+
+    Results are yielded in the order of the iterable.
+    """
+    futures = deque()
+    for item in iterable:
+        if len(futures) >= limit:
+            yield futures.popleft().result()
+        futures.append(executor.submit(fn, item))
+    while futures:
+        yield futures.popleft().result()
+
+
+def parseSimulatedFiles(files, read_header=False, jobs=1):
+    """Parse simulated files using a pool of worker threads
+
+    Parameters
+    ----------
+    files : iterable [`str`]
+        File paths, consumed lazily: at most ``PARSE_AHEAD_PER_JOB * jobs``
+        files are parsed ahead of the caller.
+    read_header : `bool`
+        If `True`, read exposure metadata from FITS headers.
+    jobs : `int`
+        Number of worker threads.
+
+    Yields
+    ------
+    path : `str`
+        File path.
+    result : `SimulatedFile` or `Exception`
+        Parsed file or the exception raised while parsing it,
+        in the order of the input files.
+    """
+    def parse(path):
+        try:
+            with stage("parseFile"):
+                return path, parseSimulatedFile(path, read_header)
+        except Exception as e:
+            return path, e
+
+    if jobs <= 1:
+        yield from map(parse, files)
+        return
+    # header reads are I/O bound and release the GIL
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from _boundedMap(executor, parse, files, PARSE_AHEAD_PER_JOB * jobs)
+
+
+def ingestSimulated(repo, locations, regex, output_run, transfer="auto", ingest_type="rawexp",
+                    jobs=1, read_headers=False, chunk_size=None, checkpoint=None, timings=False,
+                    profile=None):
     """Ingests raw frames into the butler registry
 
     Parameters
@@ -35,6 +211,27 @@ def ingestSimulated(repo, locations, regex, output_run, transfer="auto", ingest_
         The external data transfer type, by default "auto".
     ingest_type : `str`
         ingest product data type.
+    jobs : `int`
+        Number of worker threads to find and parse the files.
+    read_headers : `bool`
+        If `True`, read exposure metadata (exposure time, boresight and roll)
+        from FITS headers.
+    chunk_size : `int`, optional
+        Number of files to ingest per transaction. If `None`, all files are
+        ingested in one transaction.
+    checkpoint : `str`, optional
+        Path to the checkpoint file. Files listed in the checkpoint file are
+        skipped, the paths of the files in each committed chunk are appended
+        to it. Files, whose datasets are already in the run, are skipped
+        as well.
+    timings : `bool`
+        If `True`, log the time of each ingest phase and percentiles of
+        the per-file parse, insert and transfer latency, see
+        `logIngestTimings`. Instrumentation
+        sinks, which are already configured, keep receiving the records.
+    profile : `str`, optional
+        Path of the file to write `cProfile` statistics of the ingest to.
+        Only the calling thread is profiled, not the worker threads.
 
     Raises
     ------
@@ -44,90 +241,477 @@ def ingestSimulated(repo, locations, regex, output_run, transfer="auto", ingest_
     Notes
     -----
     This method inserts all datasets for an exposure within a transaction,
-    guaranteeing that partial exposures are never ingested.  The exposure
-    dimension record is inserted with `Registry.syncDimensionData` first
-    (in its own transaction), which inserts only if a record with the same
-    primary key does not already exist.  This allows different files within
-    the same exposure to be incremented in different runs.
+    guaranteeing that partial exposures are never ingested.  Unique exposure
+    dimension records are collected from all files and inserted first
+    (in their own transaction, see `syncExposureRecords`), skipping the
+    records with the same primary key, which already exist.  This allows
+    different files within the same exposure to be incremented in different
+    runs.
+
+    Files are found and parsed by a pool of ``jobs`` worker threads,
+    the registry is updated by the calling thread only. Files are streamed
+    from the directory search through the parser to the registry, at most
+    ``PARSE_AHEAD_PER_JOB * jobs`` files are parsed ahead of the ingest, so
+    that memory use is bounded by the chunk size, not the number of files.
+
+    With ``chunk_size`` set, files are streamed to the registry in chunks,
+    each chunk committed in its own transaction, so that a failure only
+    rolls back the current chunk.  Together with ``checkpoint`` this allows
+    an interrupted ingest to be resumed: a re-run skips the files of the
+    committed chunks without querying the registry for them.  The paths
+    are recorded after the transaction is committed, so a chunk committed
+    just before an interruption may be missing from the checkpoint: with
+    ``checkpoint`` set, datasets of each chunk, which already exist in the
+    run, are skipped and recorded.  Note that the files of one exposure may
+    end up in different chunks.
     """
+    sink = IngestTimings() if timings else None
+    profiler = cProfile.Profile() if profile is not None else None
+    start = time.perf_counter()
+    # the sink is added to the configured ones, which are restored after the ingest
+    with instrumentation_sinks(sink) if sink is not None else contextlib.nullcontext():
+        try:
+            if profiler is not None:
+                profiler.enable()
+            n_files = _ingestSimulated(repo, locations, regex, output_run, transfer=transfer,
+                                       ingest_type=ingest_type, jobs=jobs, read_headers=read_headers,
+                                       chunk_size=chunk_size, checkpoint=checkpoint)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile)
+                logging.info(f"Wrote profile to {profile}, view it with python -m pstats {profile}")
+    if sink is not None:
+        logIngestTimings(sink, time.perf_counter() - start, n_files)
 
-    butler = Butler(repo, writeable=True)
 
-    # make sure instrument and detector dimensions are populated
-    with butler.registry.transaction():
-        instrument_record = {
-            "name": "simulator",
-            "exposure_max": 600000,
-            "detector_max": 6,
-            "class_name": "spherex.instrument.SimulatorInstrument"
-        }
-        butler.registry.syncDimensionData("instrument", instrument_record)
-        for idx in range(1, 7):
-            detector_record = {
-                "instrument": "simulator",
-                "id": idx,
-                "full_name": f"array{idx}"
-            }
-            butler.registry.syncDimensionData("detector", detector_record)
+def _ingestSimulated(repo, locations, regex, output_run, transfer="auto", ingest_type="rawexp",
+                     jobs=1, read_headers=False, chunk_size=None, checkpoint=None):
+    """Ingest raw frames, see `ingestSimulated`
 
-    dimension_universe = butler.registry.dimensions
-    datasetType = DatasetType(ingest_type,
-                              dimension_universe.extract(("instrument", "detector", "exposure")),
-                              "SPHERExImage",
-                              universe=dimension_universe)
-    # idempotent dataset type registration
-    butler.registry.registerDatasetType(datasetType)
+    Returns
+    -------
+    n_files : `int`
+        Number of files to ingest, including the ones, which failed.
+    """
+    with stage("setup"):
+        butler = Butler(repo, writeable=True)
+        if instrumentation_enabled():
+            _instrumentButlerIngest(butler)
 
-    # idempotent collection registration
-    run = f"{ingest_type}r" if (output_run is None) else output_run
-    butler.registry.registerCollection(run, type=CollectionType.RUN)
+        # make sure instrument and detector dimensions are populated
+        with butler.registry.transaction():
+            instrument_record = {
+                "name": "simulator",
+                "exposure_max": 600000,
+                "detector_max": 6,
+                "class_name": "spherex.instrument.SimulatorInstrument"
+            }
+            butler.registry.syncDimensionData("instrument", instrument_record)
+            for idx in range(1, 7):
+                detector_record = {
+                    "instrument": "simulator",
+                    "id": idx,
+                    "full_name": f"array{idx}"
+                }
+                butler.registry.syncDimensionData("detector", detector_record)
 
-    n_failed = 0
-    files = findFileResources(locations, regex)
+        dimension_universe = butler.registry.dimensions
+        datasetType = DatasetType(ingest_type,
+                                  dimension_universe.extract(("instrument", "detector", "exposure")),
+                                  "SPHERExImage",
+                                  universe=dimension_universe)
+        # idempotent dataset type registration
+        butler.registry.registerDatasetType(datasetType)
 
-    # example: sim_exposure_000000_array_1.fits or
-    #   sim_exposure_000000_array_2_dark_current.fits
-    pattern = re.compile(r"sim_exposure_(\d+)_array_(\d)[_,.]")
+        # idempotent collection registration
+        run = f"{ingest_type}r" if (output_run is None) else output_run
+        butler.registry.registerCollection(run, type=CollectionType.RUN)
+
+    # files are streamed from the search, they are counted on the way;
+    # the search runs, when the parser asks for the next file, see ingestPhases
+    found = files = _CountedFiles(_staged("discover", findSimulatedFiles(locations, regex, jobs=jobs)))
+    if checkpoint is not None:
+        done = readCheckpoint(checkpoint)
+        files = _CountedFiles(file for file in found if os.path.abspath(file) not in done)
 
     # do we want to group observations?
     grp = datetime.date.today().strftime("%Y%m%d")
 
+    n_failed = 0
+    n_ingested = 0
+    start = time.perf_counter()
     datasets = []
-    for file in files:
-        # parse exposure and detector ids from file name
-        m = pattern.search(file)
-        if m is None:
+    # unique exposure records of the current chunk by exposure id
+    exposure_records = {}
+    # the calling thread waits for the search and the parser threads
+    parsedFiles = _staged("wait", parseSimulatedFiles(files, read_header=read_headers, jobs=jobs))
+    for file, parsed in parsedFiles:
+        if isinstance(parsed, Exception):
             n_failed += 1
-            logging.error(f"{file} does not match simulator file pattern")
+            logging.error(f"Unable to parse {file}: {parsed}")
             continue
-        else:
-            g = m.groups()
-            if len(g) != 2:
-                n_failed += 1
-                logging.error(f"Unable to get exposure and detector from file name: {file}")
-                continue
-            else:
-                [exposure_id, detector_id] = list(map(int, g))
 
-        try:
-            exposure_record = {"instrument": "simulator",
-                               "id": exposure_id,
-                               "name": f"{exposure_id:06d}",
-                               "group_name": f"{grp}",
-                               "timespan": Timespan(begin=None, end=None)}
-            # idempotent insertion of individual dimension rows
-            butler.registry.syncDimensionData("exposure", exposure_record)
-        except Exception as e:
-            n_failed += 1
-            logging.error(f"Unable to insert exposure record for file {file}: {e}")
-            continue
+        with stage("parse"):
+            if parsed.exposure_id not in exposure_records:
+                exposure_records[parsed.exposure_id] = {"instrument": "simulator",
+                                                        "id": parsed.exposure_id,
+                                                        "name": f"{parsed.exposure_id:06d}",
+                                                        "group_name": f"{grp}",
+                                                        "timespan": Timespan(begin=None, end=None),
+                                                        **parsed.metadata}
+
+            dataId = DataCoordinate.standardize(instrument="simulator",
+                                                detector=parsed.detector_id,
+                                                exposure=parsed.exposure_id,
+                                                universe=butler.registry.dimensions)
+            ref = DatasetRef(datasetType, dataId=dataId)
+            datasets.append(FileDataset(refs=ref, path=file, formatter=SPHERExImageFormatter))
+
+        if chunk_size is not None and len(datasets) >= chunk_size:
+            n_ingested += _ingestChunk(butler, datasets, exposure_records.values(),
+                                       transfer, run, checkpoint)
+            _logThroughput(n_ingested, start)
+            datasets = []
+            exposure_records = {}
+
+    if datasets:
+        n_ingested += _ingestChunk(butler, datasets, exposure_records.values(),
+                                   transfer, run, checkpoint)
+    _logThroughput(n_ingested, start)
+
+    if found.count > files.count:
+        logging.info(f"Skipped {found.count - files.count} files listed in {checkpoint}")
+    if n_failed > 0:
+        logging.warning(f"{n_failed} files could not be ingested")
+    return files.count
+
+
+def _staged(name, iterable):
+    """Iterate, measuring the wait for every item as a stage"""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+_END = object()
+
+
+class _CountedFiles:
+    """Iterator over files, which counts them"""
+
+    def __init__(self, files):
+        self._files = iter(files)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        file = next(self._files)
+        self.count += 1
+        return file
+
+
+def _ingestChunk(butler, datasets, exposure_records, transfer, run, checkpoint):
+    """Ingest a chunk of files in one transaction and record them in the
+    checkpoint file after the transaction is committed.
+
+    With a checkpoint file, datasets already in the run (of a chunk
+    committed, but not recorded before an interruption) are skipped.
+    """
+    with stage("sync"):
+        n_inserted = syncExposureRecords(butler, exposure_records)
+    logging.debug(f"Inserted {n_inserted} exposure records")
+
+    new_datasets = datasets
+    if checkpoint is not None:
+        with stage("checkpoint"):
+            existing = findExistingDataIds(butler, datasets[0].refs[0].datasetType, run,
+                                           {dataset.refs[0].dataId["exposure"] for dataset in datasets})
+        new_datasets = [dataset for dataset in datasets
+                        if _dataIdKey(dataset.refs[0].dataId) not in existing]
+        if len(new_datasets) < len(datasets):
+            logging.info(f"Skipping {len(datasets) - len(new_datasets)} files already ingested into {run}")
 
-        dataId = DataCoordinate.standardize(instrument="simulator",
-                                            detector=detector_id,
-                                            exposure=exposure_id,
-                                            universe=butler.registry.dimensions)
-        ref = DatasetRef(datasetType, dataId=dataId)
-        datasets.append(FileDataset(refs=ref, path=file, formatter=AstropyImageFormatter))
+    if new_datasets:
+        with stage("ingest"), butler.transaction():
+            butler.ingest(*new_datasets, transfer=transfer, run=run)
 
-    with butler.transaction():
-        butler.ingest(*datasets, transfer=transfer, run=run)
+    if checkpoint is not None:
+        with stage("checkpoint"):
+            appendCheckpoint(checkpoint, [dataset.path for dataset in datasets])
+    return len(new_datasets)
+
+
+def _dataIdKey(dataId):
+    return dataId["exposure"], dataId["detector"]
+
+
+def _exposureQueries(exposures):
+    """Get ``where`` expressions and bind values, which select exposures
+    of "simulator" instrument in batches of ``EXPOSURE_QUERY_BATCH``
+    """
+    exposures = sorted(exposures)
+    for start in range(0, len(exposures), EXPOSURE_QUERY_BATCH):
+        batch = exposures[start:start + EXPOSURE_QUERY_BATCH]
+        names = [f"exposure{index}" for index in range(len(batch))]
+        bind = dict(zip(names, batch), instrumentName="simulator")
+        yield f"instrument = instrumentName AND exposure IN ({', '.join(names)})", bind
+
+
+def findExistingDataIds(butler, datasetType, run, exposures):
+    """Find the datasets of the exposures, which are already in the run
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler.
+    datasetType : `lsst.daf.butler.DatasetType`
+        Dataset type.
+    run : `str`
+        Run collection.
+    exposures : iterable [`int`]
+        Exposure ids of "simulator" instrument.
+
+    Returns
+    -------
+    dataIds : `set` [`tuple`]
+        ``(exposure, detector)`` of the existing datasets.
+    """
+    existing = set()
+    for where, bind in _exposureQueries(exposures):
+        refs = butler.registry.queryDatasets(datasetType, collections=[run], where=where, bind=bind)
+        existing.update(_dataIdKey(ref.dataId) for ref in refs)
+    return existing
+
+
+def _instrumentButlerIngest(butler):
+    """Time registry inserts and datastore transfers of `Butler.ingest`
+    as ``insert`` and ``transfer`` stages
+
+    The number of files is added to the stage labels as ``files``.
+    The methods are replaced on the registry and the datastore of this
+    butler only.
+    """
+    insertDatasets, ingest = butler.registry.insertDatasets, butler.datastore.ingest
+
+    def insert(*args, **kwargs):
+        with stage("insert") as record:
+            refs = insertDatasets(*args, **kwargs)
+            if record:
+                record.labels["files"] = len(refs)
+        return refs
+
+    def transfer(*datasets, **kwargs):
+        with stage("transfer", files=len(datasets)):
+            return ingest(*datasets, **kwargs)
+
+    butler.registry.insertDatasets = insert
+    butler.datastore.ingest = transfer
+
+
+class IngestTimings:
+    """Instrumentation sink, which collects wall times of the ingest stages
+
+    See `~spherex.core.enable_instrumentation`.
+
+    Attributes
+    ----------
+    walls : `dict` [`str`, `list` [`float`]]
+        Wall times of the calls of each stage.
+    perFile : `dict` [`str`, `list` [`float`]]
+        Per-file latencies of the stages, which process several files,
+        labelled with the number of ``files``: the wall time of a call
+        divided by the number of its files, once per file.
+    """
+
+    def __init__(self):
+        self.walls = defaultdict(list)
+        self.perFile = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        files = record.labels.get("files")
+        with self._lock:
+            self.walls[record.name].append(record.wall)
+            if files:
+                self.perFile[record.name].extend([record.wall / files] * files)
+
+    def flush(self):
+        pass
+
+    def total(self, name):
+        """Total wall time of a stage in seconds"""
+        return sum(self.walls.get(name, ()))
+
+
+# phases of the ingest, see ingestPhases
+INGEST_PHASES = ("setup", "discover", "wait", "parse", "sync", "ingest", "checkpoint", "other")
+INGEST_SUBPHASES = ("insert", "transfer", "commit")
+
+
+def ingestPhases(timings, elapsed):
+    """Split the ingest time between its phases
+
+    Parameters
+    ----------
+    timings : `IngestTimings`
+        Stage times collected during the ingest.
+    elapsed : `float`
+        Wall time of the ingest in seconds.
+
+    Returns
+    -------
+    phases : `dict` [`str`, `float`]
+        Time in seconds of each of `INGEST_PHASES` and `INGEST_SUBPHASES`
+        of ``ingest``.
+
+    Notes
+    -----
+    Phases are measured on the calling thread: ``setup`` (instrument,
+    detector, dataset type and run registration), ``discover`` (directory
+    search, or waiting for the search threads), ``wait`` (waiting for the
+    parser threads: parsing file names and headers of the files, which are
+    not parsed yet, excluding ``discover``), ``parse`` (building exposure
+    records and dataset references), ``sync`` (exposure records),
+    ``ingest``, split into ``insert`` (registry inserts), ``transfer``
+    (datastore ingest: file transfer and datastore records) and
+    ``commit``, ``checkpoint`` (query for the datasets already in the run
+    and the checkpoint file writes) and ``other``, the rest.
+    """
+    phases = {name: timings.total(name) for name in INGEST_PHASES[:-1]}
+    # files are searched for, when the parser asks for them
+    phases["discover"] += timings.total("wait/discover")
+    phases["wait"] = max(phases["wait"] - timings.total("wait/discover"), 0.)
+    phases["other"] = max(elapsed - sum(phases.values()), 0.)
+    phases["insert"] = timings.total("ingest/insert")
+    phases["transfer"] = timings.total("ingest/transfer")
+    phases["commit"] = max(phases["ingest"] - phases["insert"] - phases["transfer"], 0.)
+    return phases
+
+
+def logIngestTimings(timings, elapsed, n_files):
+    """Log the time of each ingest phase and per-file latencies
+
+    Parameters
+    ----------
+    timings : `IngestTimings`
+        Stage times collected during the ingest.
+    elapsed : `float`
+        Wall time of the ingest in seconds.
+    n_files : `int`
+        Number of files.
+
+    Notes
+    -----
+    Phases are described in `ingestPhases`. Per-file parse latency is
+    measured on the worker threads, insert and transfer latency is the
+    time of a registry insert or a datastore transfer divided by the
+    number of its files.
+    """
+    phases = ingestPhases(timings, elapsed)
+    rate = n_files / elapsed if elapsed > 0 else 0.
+
+    lines = [f"Ingest of {n_files} files took {elapsed:.3f} s ({rate:.1f} files/s):"]
+    for name in INGEST_PHASES:
+        lines.append(f"  {name:12s} {phases[name]:10.3f} s {_percent(phases[name], elapsed):6.1f}%")
+        if name == "ingest":
+            lines += [f"    {sub:10s} {phases[sub]:10.3f} s {_percent(phases[sub], elapsed):6.1f}%"
+                      for sub in INGEST_SUBPHASES]
+    for name, latencies in (("parse", timings.walls.get("parseFile")),
+                            ("insert", timings.perFile.get("ingest/insert")),
+                            ("transfer", timings.perFile.get("ingest/transfer"))):
+        if latencies:
+            p50, p90, p99 = np.percentile(latencies, (50, 90, 99)) * 1e3
+            lines.append(f"  per-file {name} latency: p50 {p50:.3f} ms, p90 {p90:.3f} ms, "
+                         f"p99 {p99:.3f} ms, max {max(latencies) * 1e3:.3f} ms")
+    logging.info("\n".join(lines))
+
+
+def _percent(value, total):
+    return 100. * value / total if total > 0 else 0.
+
+
+def _logThroughput(n_ingested, start):
+    elapsed = time.perf_counter() - start
+    rate = n_ingested / elapsed if elapsed > 0 else 0.
+    logging.info(f"Ingested {n_ingested} files in {elapsed:.1f} s ({rate:.1f} files/s)")
+
+
+def readCheckpoint(checkpoint):
+    """Read paths of the ingested files from the checkpoint file
+
+    Parameters
+    ----------
+    checkpoint : `str`
+        Path to the checkpoint file, which lists one absolute file path
+        per line. The file does not need to exist.
+
+    Returns
+    -------
+    paths : `set` [`str`]
+        Absolute paths of the ingested files.
+    """
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def appendCheckpoint(checkpoint, paths):
+    """Append paths of the ingested files to the checkpoint file
+
+    Parameters
+    ----------
+    checkpoint : `str`
+        Path to the checkpoint file.
+    paths : iterable [`str`]
+        Paths of the files in a committed chunk.
+    """
+    with open(checkpoint, "a") as f:
+        f.writelines(f"{os.path.abspath(path)}\n" for path in paths)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def syncExposureRecords(butler, records):
+    """Insert exposure dimension records, which are not yet in the registry
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler.
+    records : iterable [`dict`]
+        Exposure records of "simulator" instrument.
+
+    Returns
+    -------
+    n_inserted : `int`
+        Number of inserted records.
+
+    Notes
+    -----
+    Existing exposure ids among the ids of the records are fetched with one
+    query per ``EXPOSURE_QUERY_BATCH`` records and the new records are
+    inserted with one `Registry.insertDimensionData` call in a single
+    transaction, instead of a `Registry.syncDimensionData` call per record.
+    Unlike ``syncDimensionData``, existing records are skipped without
+    checking that their values match the new ones.
+    """
+    records = list(records)
+    if not records:
+        return 0
+    with butler.registry.transaction():
+        existing = set()
+        for where, bind in _exposureQueries(record["id"] for record in records):
+            existing.update(dataId["exposure"] for dataId in
+                            butler.registry.queryDataIds(["exposure"], where=where, bind=bind))
+        new_records = [record for record in records if record["id"] not in existing]
+        if new_records:
+            butler.registry.insertDimensionData("exposure", *new_records)
+    return len(new_records)
@@ -0,0 +1,390 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import statistics
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lsst.daf.butler import (
+    Butler,
+    CollectionType,
+    DataCoordinate,
+    DatasetRef,
+    DatasetType,
+    FileDataset,
+    FileDescriptor,
+    Location
+)
+
+from ..core.instrumentation import configure_instrumentation, flush_instrumentation
+from ..formatters.cache import configureReadCache
+from ..formatters.handles import configureHandlePool
+from ..formatters.stored import storedDatasetReader
+from ..instrument.summary_index import SUMMARY_INDEX_FILE, SummaryIndex
+
+QuantumTiming = namedtuple("QuantumTiming", ["label", "dataId", "read", "run", "write", "ingest"])
+"""Per-quantum timing in seconds: reading inputs, running the task,
+writing outputs (in a worker process) and ingesting them (in the main process)
+"""
+
+# worker process state, see _initWorker
+_worker = {}
+
+
+def runPipeline(repo, pipeline, input_collections, output_run, where="", jobs=1,
+                register_dataset_types=False, staging=None, prefetch=0, prefetch_bytes=None,
+                summary_index=None):
+    """Run a pipeline over the data IDs selected by a query
+    using a pool of worker processes
+
+    Parameters
+    ----------
+    repo : `str`
+        URI to the location of the butler repository.
+    pipeline : `str`
+        Pipeline definition file, for example, ``pipelines/ExamplePipeline.yaml``.
+    input_collections : `list` [`str`]
+        Collections to search for the input datasets.
+    output_run : `str`
+        Run collection for the output datasets.
+    where : `str`, optional
+        Data ID query expression, for example, ``"exposure IN (1, 2)"``.
+        By default, all data IDs with the input datasets are processed.
+    jobs : `int`
+        Number of worker processes.
+    register_dataset_types : `bool`
+        If `True`, register output dataset types, which do not exist.
+    staging : `str`, optional
+        Directory for the output files written by the workers, before they
+        are moved into the datastore. By default, a temporary directory.
+    prefetch : `int`
+        Number of quanta, whose inputs each worker reads ahead on background
+        threads, while the current quantum is running. Zero disables
+        prefetching.
+    prefetch_bytes : `int`, optional
+        Maximum total size in bytes of the input files of the current and
+        prefetched quanta of a worker. By default, only the number of
+        prefetched quanta is limited.
+    summary_index : `str`, optional
+        Summary index file, to which image summaries stored in the output
+        files are added, when the outputs are ingested, see
+        `~spherex.instrument.SummaryIndex`. By default,
+        ``image_summary.sqlite3`` in the repository root, if it exists.
+
+    Returns
+    -------
+    timings : `list` [`QuantumTiming`]
+        Timing of the successfully executed quanta.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if some of the quanta failed.
+
+    Notes
+    -----
+    Tasks are executed in the pipeline order. The quanta of a task are
+    independent: one quantum for every data ID of the task dimensions,
+    for which all inputs exist. They are executed by worker processes,
+    each with its own read-only butler, created once per process. Workers
+    write the outputs into the staging directory with the formatters
+    configured for the output dataset types. All registry writes are done
+    by the calling process, which ingests the outputs of each quantum as
+    it completes. Staged outputs of the quanta, which fail or whose ingest
+    fails, are removed, the staging directory is removed at the end.
+    Summaries, which the formatters compute while writing the outputs,
+    are returned by the workers with the file names, so that the summary
+    index is filled without reading the files back.
+
+    With prefetching, quanta are sent to workers in batches. A worker
+    finds the input datasets of the batch quanta in its main thread and
+    reads the inputs of the next quanta on background threads, while the
+    task runs. The read time of a quantum is then the time the worker
+    waited for its inputs.
+    """
+    # imported here: butler commands must not depend on pipe_base
+    from lsst.pipe.base import Pipeline
+
+    butler = Butler(repo, writeable=True)
+    # outputs of the previous tasks are inputs of the next ones
+    collections = [output_run] + list(input_collections)
+    butler.registry.registerCollection(output_run, type=CollectionType.RUN)
+
+    taskDefs = list(Pipeline.fromFile(pipeline).toExpandedPipeline())
+    staging = tempfile.mkdtemp(dir=staging, prefix="staging_")
+    if summary_index is None and os.path.exists(os.path.join(repo, SUMMARY_INDEX_FILE)):
+        summary_index = os.path.join(repo, SUMMARY_INDEX_FILE)
+    index = SummaryIndex(summary_index) if summary_index is not None else None
+
+    timings = []
+    n_failed = 0
+    start = time.perf_counter()
+    # outputs of failed quanta are removed by the workers and _ingestOutputs,
+    # the directory and the files of crashed workers are removed here
+    try:
+        # spawned workers do not inherit the database connections of this process
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_initWorker,
+                                 initargs=(repo, pipeline, collections, staging)) as executor:
+            for taskDef in taskDefs:
+                connections = taskDef.connections
+                outputTypes = _outputDatasetTypes(butler, connections, register_dataset_types)
+                quanta = _makeQuanta(butler, connections, collections, where)
+                logging.info(f"Executing {len(quanta)} quanta of {taskDef.label}")
+
+                # a batch must be long enough for the read-ahead to pay off
+                batchSize = 1 if prefetch == 0 else 4 * (prefetch + 1)
+                batches = [quanta[i:i + batchSize] for i in range(0, len(quanta), batchSize)]
+                futures = {executor.submit(_runBatch, taskDef.label, batch, prefetch, prefetch_bytes): batch
+                           for batch in batches}
+                # the main process is the only registry writer
+                for future in as_completed(futures):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        n_failed += len(futures[future])
+                        logging.error(f"Quanta {taskDef.label} {futures[future]} failed: {e}")
+                        continue
+                    for dataId, outputs, workerTiming in results:
+                        try:
+                            if isinstance(outputs, Exception):
+                                raise outputs
+                            ingestStart = time.perf_counter()
+                            _ingestOutputs(butler, outputTypes, dataId, outputs, output_run, index)
+                            timing = QuantumTiming(taskDef.label, dataId, *workerTiming,
+                                                   time.perf_counter() - ingestStart)
+                        except Exception as e:
+                            n_failed += 1
+                            logging.error(f"Quantum {taskDef.label} {dataId} failed: {e}")
+                            continue
+                        timings.append(timing)
+                        logging.info(f"Quantum {timing.label} {dataId}: read {timing.read:.3f} s, "
+                                     f"run {timing.run:.3f} s, write {timing.write:.3f} s, "
+                                     f"ingest {timing.ingest:.3f} s")
+    finally:
+        _removeStaging(staging)
+        if index is not None:
+            index.close()
+
+    _logSummary(timings, time.perf_counter() - start, jobs)
+    if n_failed > 0:
+        raise RuntimeError(f"{n_failed} quanta failed")
+    return timings
+
+
+def _outputDatasetTypes(butler, connections, register):
+    """Get output dataset types by connection name, registering them
+    if requested.
+    """
+    outputTypes = {}
+    for name in connections.outputs:
+        connection = getattr(connections, name)
+        datasetType = DatasetType(connection.name,
+                                  butler.registry.dimensions.extract(connection.dimensions),
+                                  connection.storageClass,
+                                  universe=butler.registry.dimensions)
+        if register:
+            butler.registry.registerDatasetType(datasetType)
+        outputTypes[name] = datasetType
+    return outputTypes
+
+
+def _makeQuanta(butler, connections, collections, where):
+    """Find data IDs of the task dimensions, for which all inputs exist
+
+    Returns
+    -------
+    dataIds : `list` [`dict`]
+        Data IDs as dictionaries, which can be passed to worker processes.
+    """
+    inputTypes = [getattr(connections, name).name for name in connections.inputs]
+    dataIds = butler.registry.queryDataIds(connections.dimensions, datasets=inputTypes,
+                                           collections=collections, where=where)
+    return [dict(dataId.byName()) for dataId in dataIds]
+
+
+def _initWorker(repo, pipeline, collections, staging):
+    """Create read-only butler and tasks once per worker process"""
+    from lsst.pipe.base import Pipeline
+
+    butler = Butler(repo, collections=collections, writeable=False)
+    configureReadCache(butler.config)
+    configureHandlePool(butler.config)
+    configure_instrumentation(butler.config)
+    try:
+        from ..core.spherex_hdf5 import configure_hdf5_decoding
+    except ImportError:
+        # h5py is an optional dependency
+        pass
+    else:
+        configure_hdf5_decoding(butler.config)
+    _worker["butler"] = butler
+    _worker["staging"] = staging
+    _worker["tasks"] = {}
+    for taskDef in Pipeline.fromFile(pipeline).toExpandedPipeline():
+        task = taskDef.taskClass(config=taskDef.config)
+        _worker["tasks"][taskDef.label] = (task, taskDef.connections)
+
+
+def _runBatch(label, dataIds, prefetch=0, prefetchBytes=None):
+    """Run a batch of quanta in a worker process, see `_runQuanta`,
+    and flush the instrumentation sinks"""
+    try:
+        return _runQuanta(label, dataIds, prefetch, prefetchBytes)
+    finally:
+        # pool workers exit without running the exit handlers
+        flush_instrumentation()
+
+
+def _runQuanta(label, dataIds, prefetch=0, prefetchBytes=None):
+    """Run a batch of quanta in a worker process
+
+    Returns
+    -------
+    results : `list` [`tuple`]
+        Data ID, outputs and timing of each quantum. Outputs are output file
+        path and formatter class by connection name, or the exception,
+        if the quantum failed. Timing is the time to read inputs, run
+        the task and write outputs.
+    """
+    butler = _worker["butler"]
+    task, connections = _worker["tasks"][label]
+    results = []
+
+    if prefetch == 0:
+        for dataId in dataIds:
+            start = time.perf_counter()
+            try:
+                inputs = {name: butler.get(getattr(connections, name).name, dataId)
+                          for name in connections.inputs}
+            except Exception as e:
+                results.append((dataId, e, None))
+                continue
+            results.append(_runQuantum(task, connections, dataId, inputs, time.perf_counter() - start))
+        return results
+
+    from ..tasks.prefetch import Prefetcher
+
+    def resolve(dataId):
+        # registry and datastore lookups stay on this thread, readers only read files
+        readers = {}
+        for name in connections.inputs:
+            datasetType = getattr(connections, name).name
+            ref = butler.registry.findDataset(datasetType, dataId, collections=butler.collections)
+            if ref is None:
+                raise LookupError(f"Dataset {datasetType} {dataId} not found")
+            # inputs are read with their stored formatters, as by butler.get
+            readers[name] = storedDatasetReader(butler, ref)
+        return readers
+
+    def sizeOf(readers):
+        return sum(os.path.getsize(path) for _, paths in readers.values() for path in paths)
+
+    def load(readers):
+        return {name: read() for name, (read, _) in readers.items()}
+
+    # failed lookups and reads are returned with their quanta
+    prefetcher = Prefetcher(dataIds, load, resolve=resolve, depth=prefetch, maxBytes=prefetchBytes,
+                            sizeOf=sizeOf if prefetchBytes is not None else None, returnExceptions=True)
+    waitTime = 0.
+    for dataId, inputs in prefetcher:
+        if isinstance(inputs, Exception):
+            results.append((dataId, inputs, None))
+        else:
+            results.append(_runQuantum(task, connections, dataId, inputs, prefetcher.waitTime - waitTime))
+        waitTime = prefetcher.waitTime
+        del inputs
+    if prefetcher.throttled:
+        logging.debug(f"Prefetching of {label} inputs throttled {prefetcher.throttled} times")
+    return results
+
+
+def _runQuantum(task, connections, dataId, inputs, readTime):
+    """Run the task on the inputs of a quantum and write its outputs
+    into the staging directory
+    """
+    butler = _worker["butler"]
+    start = time.perf_counter()
+    paths = []
+    try:
+        result = task.run(**inputs)
+        runEnd = time.perf_counter()
+
+        outputs = {}
+        for name in connections.outputs:
+            connection = getattr(connections, name)
+            datasetType = butler.registry.getDatasetType(connection.name)
+            ref = DatasetRef(datasetType, DataCoordinate.standardize(dataId, graph=datasetType.dimensions))
+            fileName = "_".join([connection.name] + [str(value) for value in ref.dataId.byName().values()])
+            location = Location(None, os.path.join(_worker["staging"], fileName))
+            formatter = butler.datastore.formatterFactory.getFormatter(
+                ref, FileDescriptor(location, storageClass=datasetType.storageClass), ref.dataId)
+            # the formatter adds its file extension to the location
+            paths.append(location)
+            formatter.write(getattr(result, name))
+            outputs[name] = (formatter.fileDescriptor.location.path, type(formatter),
+                             getattr(formatter, "writtenSummary", None))
+    except Exception as e:
+        # outputs of a failed quantum are not ingested, partial files included
+        _removeFiles(location.path for location in paths)
+        return dataId, e, None
+    writeEnd = time.perf_counter()
+    return dataId, outputs, (readTime, runEnd - start, writeEnd - runEnd)
+
+
+def _ingestOutputs(butler, outputTypes, dataId, outputs, run, index=None):
+    """Move quantum outputs into the datastore and register them,
+    staged files are removed if the ingest fails; summaries of the
+    ingested outputs are added to the summary index"""
+    try:
+        datasets = []
+        summaries = []
+        for name, (path, formatter, summary) in outputs.items():
+            datasetType = outputTypes[name]
+            ref = DatasetRef(datasetType, DataCoordinate.standardize(dataId, graph=datasetType.dimensions))
+            datasets.append(FileDataset(refs=ref, path=path, formatter=formatter))
+            summaries.append(summary)
+        with butler.transaction():
+            butler.ingest(*datasets, transfer="move", run=run)
+    finally:
+        # moved files are gone, the rest are outputs of a failed quantum
+        _removeFiles(path for path, *_ in outputs.values())
+    if index is not None:
+        # ingest resolves the references of the datasets
+        for dataset, summary in zip(datasets, summaries):
+            if summary is not None:
+                index.add(dataset.refs[0], run, summary)
+
+
+def _removeFiles(paths):
+    """Remove staged files, which exist"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _removeStaging(staging):
+    """Remove the staging directory with the files left by crashed workers"""
+    left = os.listdir(staging)
+    if left:
+        logging.warning(f"Removing {len(left)} files left in staging directory {staging}")
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def _logSummary(timings, elapsed, jobs):
+    if not timings:
+        logging.info(f"No quanta executed in {elapsed:.1f} s")
+        return
+    totals = [t.read + t.run + t.write for t in timings]
+    logging.info(f"Executed {len(timings)} quanta in {elapsed:.1f} s with {jobs} processes "
+                 f"({len(timings) / elapsed:.2f} quanta/s)")
+    for field in ("read", "run", "write", "ingest"):
+        values = [getattr(t, field) for t in timings]
+        logging.info(f"  {field:7s} mean {statistics.mean(values):.3f} s, max {max(values):.3f} s")
+    logging.info(f"  worker  mean {statistics.mean(totals):.3f} s, "
+                 f"sum {sum(totals):.1f} s ({sum(totals) / elapsed:.1f}x parallel speedup)")
@@ -1 +1,10 @@
-from .subtract import *
+from .._lazy import lazy_exports
+
+# submodules are imported, when their names are first accessed,
+# so that Prefetcher and the tiled helpers do not import lsst.pipe.base,
+# the lists must match their __all__
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+    "prefetch": ["Prefetcher"],
+    "tiled": ["iter_tiles", "TiledImageWriter", "run_tiled"],
+    "subtract": ["SubtractTaskConnections", "SubtractTaskConfig", "SubtractTask"],
+})
@@ -0,0 +1,132 @@
+# Read-ahead of task inputs on background threads
+#
+# While the caller computes on the inputs of the current item, the inputs
+# of the next items are read by a thread pool. The number of items read
+# ahead and the total size of the prefetched inputs are bounded:
+# when the budget is exhausted, reading of the next item waits until
+# the caller is done with the current one.
+
+__all__ = ["Prefetcher"]
+
+import collections
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class Prefetcher:
+    """Iterate over items with their inputs read ahead on background threads
+
+    Parameters
+    ----------
+    items : iterable
+        Items to process, for example, quantum data IDs.
+    load : callable
+        Function, which takes the result of ``resolve`` and returns
+        the loaded inputs. Called on a background thread.
+    resolve : callable, optional
+        Function, which takes an item and returns what ``load`` needs, for
+        example, file paths. Called on the iterating thread, so that
+        non-thread-safe lookups, like registry queries, stay on that thread.
+        By default, the item itself is passed to ``load``.
+    depth : `int`, optional
+        Maximum number of items read ahead of the current one.
+    maxBytes : `int`, optional
+        Memory budget: maximum total size of the inputs of the current and
+        prefetched items. At least one item is always read, even if it
+        exceeds the budget. `None` means no limit.
+    sizeOf : callable, optional
+        Function, which takes the result of ``resolve`` and returns the
+        size of the inputs in bytes, for example, the total size of their
+        files. Required with ``maxBytes``.
+    threads : `int`, optional
+        Number of reader threads, by default ``depth``.
+    returnExceptions : `bool`, optional
+        If `True`, an exception raised by ``resolve``, ``sizeOf`` or
+        ``load`` for an item is yielded in place of its inputs, and the
+        iteration continues with the next item.
+
+    Notes
+    -----
+    Iteration yields ``(item, inputs)`` pairs in the order of ``items``.
+    The inputs of an item are counted against the budget until the next
+    item is requested. Exceptions raised by ``resolve``, ``sizeOf`` or
+    ``load`` for an item read ahead are kept with the item and re-raised
+    (or yielded), when the item is reached, after all preceding items
+    are yielded. ``waitTime`` is the total time the caller was
+    blocked waiting for inputs.
+    """
+
+    def __init__(self, items, load, resolve=None, depth=1, maxBytes=None, sizeOf=None, threads=None,
+                 returnExceptions=False):
+        if depth < 1:
+            raise ValueError(f"depth must be positive, got {depth}")
+        if maxBytes is not None and sizeOf is None:
+            raise ValueError("sizeOf is required to limit prefetched bytes")
+        self._items = items
+        self._load = load
+        self._resolve = resolve if resolve is not None else (lambda item: item)
+        self._sizeOf = sizeOf if sizeOf is not None else (lambda resolved: 0)
+        self.depth = depth
+        self.maxBytes = maxBytes
+        self.threads = threads or depth
+        self.returnExceptions = returnExceptions
+        self.waitTime = 0.
+        self.throttled = 0
+
+    def __iter__(self):
+        items = iter(self._items)
+        # (item, future, nbytes) of the scheduled items
+        pending = collections.deque()
+        # resolved item, which did not fit into the budget
+        waiting = None
+        nbytes = 0
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            try:
+                while True:
+                    # current item and up to depth items ahead
+                    while len(pending) <= self.depth:
+                        if waiting is None:
+                            try:
+                                item = next(items)
+                            except StopIteration:
+                                break
+                            try:
+                                resolved = self._resolve(item)
+                                waiting = (item, resolved, self._sizeOf(resolved))
+                            except Exception as e:
+                                # raised, when the item is reached
+                                pending.append((item, _failed(e), 0))
+                                continue
+                        item, resolved, size = waiting
+                        if pending and self.maxBytes is not None and nbytes + size > self.maxBytes:
+                            # backpressure: wait until the current item is done
+                            self.throttled += 1
+                            break
+                        pending.append((item, pool.submit(self._load, resolved), size))
+                        nbytes += size
+                        waiting = None
+                    if not pending:
+                        return
+                    item, future, size = pending.popleft()
+                    start = time.perf_counter()
+                    try:
+                        inputs = future.result()
+                    except Exception as e:
+                        if not self.returnExceptions:
+                            raise
+                        inputs = e
+                    finally:
+                        self.waitTime += time.perf_counter() - start
+                    yield item, inputs
+                    del inputs
+                    nbytes -= size
+            finally:
+                for _, future, _ in pending:
+                    future.cancel()
+
+
+def _failed(exception):
+    """Future with the exception of an item, which could not be scheduled"""
+    future = Future()
+    future.set_exception(exception)
+    return future
@@ -1,9 +1,13 @@
-from astropy.io import fits
+__all__ = ["SubtractTaskConnections", "SubtractTaskConfig", "SubtractTask"]
 
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 import lsst.pipe.base.connectionTypes as cT
 
+from ..core import subtract_image
+from ..core.instrumentation import instrumented
+from .tiled import run_tiled
+
 
 class SubtractTaskConnections(pipeBase.PipelineTaskConnections,
                               dimensions={"instrument", "exposure", "detector"},
@@ -36,14 +40,14 @@ class SubtractTaskConfig(pipeBase.PipelineTaskConfig,
     """Configuration parameters for SubtractDark
 
     """
-    inputHDUNum = pexConfig.Field(
+    tileRows = pexConfig.Field(
         dtype=int,
-        doc="HDU number for input image",
-        default=0,
+        doc="Number of image rows per tile in runTiled, 0 for the full image height",
+        default=256,
     )
-    subtractHDUNum = pexConfig.Field(
+    tileColumns = pexConfig.Field(
         dtype=int,
-        doc="HDU number for image to be subtracted",
+        doc="Number of image columns per tile in runTiled, 0 for the full image width",
         default=0,
     )
 
@@ -58,37 +62,76 @@ class SubtractTask(pipeBase.PipelineTask):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    @instrumented("SubtractTask.run")
     def run(self, inputImage, subtractImage):
         """Subtract image pixels
 
         Parameters
         ----------
-        inputImage : `astropy.io.fits.HDUList`
-            Input image
-        subtractImage : `astropy.io.fits.HDUList`
+        inputImage : `spherex.core.SPHERExImage`
+            Input image, the result of subtraction is written into it,
+            unless its arrays are read-only (images from the read cache,
+            see `~spherex.formatters.ImageCache`): then they are copied.
+        subtractImage : `spherex.core.SPHERExImage`
             Image to be subtracted
 
         Returns
         -------
         result : `lsst.pipe.base.Struct`
             Result struct with component:
-            - ``outputImage`` : `astropy.io.fits.HDUList`
-                Image after subtraction.
+            - ``outputImage`` : `spherex.core.SPHERExImage`
+                Image after subtraction, variances added, flags and masks
+                combined.
         """
+        if not _isWriteable(inputImage):
+            inputImage = inputImage.copy()
+        try:
+            outputImage = subtract_image(inputImage, subtractImage)
+        except ValueError as e:
+            raise RuntimeError(f"unable to subtract images: {e}") from e
+        if hasattr(outputImage.meta, "add_comment"):
+            outputImage.meta.add_comment("Dark current subtracted")
+
+        return pipeBase.Struct(
+            outputImage=outputImage
+        )
 
-        inputHDUIdx = self.config.inputHDUNum
-        subtractHDUIdx = self.config.subtractHDUNum
+    @instrumented("SubtractTask.runTiled")
+    def runTiled(self, inputFile, subtractFile, outputFile, unit=None):
+        """Subtract images stored in FITS files a tile at a time
 
-        # basic validation
-        if inputImage[inputHDUIdx].data.shape != subtractImage[subtractHDUIdx].data.shape:
-            raise RuntimeError("input and subtract image shapes do not match")
+        Each tile is processed with `run`, the memory used depends on the
+        tile size (``tileRows`` and ``tileColumns`` config fields) rather
+        than on the image size.
 
-        hdu = inputImage[inputHDUIdx].copy()
-        hdu.data = inputImage[inputHDUIdx].data - subtractImage[subtractHDUIdx].data
-        hdu.header.add_comment("Dark current subtracted")
-        outputImage = fits.HDUList()
-        outputImage.append(hdu)
+        Parameters
+        ----------
+        inputFile : `str`
+            Input image file.
+        subtractFile : `str`
+            File of the image to be subtracted.
+        outputFile : `str`
+            Output image file, written incrementally.
+        unit : `astropy.units.Unit` or `str`, optional
+            Image unit, if it is not in the file headers.
 
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with component:
+            - ``nTiles`` : `int`
+                Number of processed tiles.
+        """
+        nTiles = run_tiled(lambda inputTile, subtractTile: self.run(inputTile, subtractTile).outputImage,
+                           [inputFile, subtractFile], outputFile,
+                           tile_shape=(self.config.tileRows, self.config.tileColumns), unit=unit)
         return pipeBase.Struct(
-            outputImage=outputImage
+            nTiles=nTiles
         )
+
+
+def _isWriteable(image):
+    """Check if the component arrays of an image can be modified in place"""
+    arrays = [image.data, image.mask, image.flags,
+              image.uncertainty.array if image.uncertainty is not None else None]
+    return all(array.flags.writeable for array in arrays if array is not None)
@@ -0,0 +1,282 @@
+# Tiled execution of pixel-level operations on SPHEREx images
+#
+# Input images are read from their FITS files a tile at a time (section reads),
+# an operation is applied to the tiles, and the output tiles are written into
+# a preallocated FITS file, so that the memory used depends on the tile size
+# rather than on the image size.
+
+__all__ = ["iter_tiles", "TiledImageWriter", "run_tiled"]
+
+import contextlib
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from ..core import SPHERExImage
+from ..core.spherex_image import (BLOCK_SIZE, _fits_dtype, _fits_encode, _flags_dtype, _image_header,
+                                  _image_planes, _read_frame, _read_hdus)
+
+# tiles of 256 full-width rows: 2 MB of float32 pixels for a 2048x2048 detector
+DEFAULT_TILE_SHAPE = (256, None)
+
+# image component written into each extension, see `spherex.core.spherex_image_writer`
+_PLANE_ARRAYS = {
+    'image': lambda image: image.data,
+    'flags': lambda image: image.flags,
+    'variance': lambda image: None if image.uncertainty is None else image.uncertainty.array,
+    'mask': lambda image: image.mask,
+}
+
+
+def iter_tiles(shape, tile_shape=DEFAULT_TILE_SHAPE):
+    """Iterate over the tiles of an image in file (row-major) order
+
+    Parameters
+    ----------
+    shape : `tuple` [`int`]
+        Image shape, (rows, columns).
+    tile_shape : `tuple` [`int` or None]
+        Tile shape, (rows, columns). None or zero means the full image
+        extent along the axis: ``(n, None)`` gives blocks of ``n`` rows.
+
+    Yields
+    ------
+    section : `tuple` [`slice`]
+        Tile section in numpy (row, column) order. Tiles at the right
+        and bottom edges may be smaller than ``tile_shape``.
+    """
+    if len(tile_shape) != len(shape):
+        raise ValueError(f"tile shape {tile_shape} does not match image dimensions {shape}")
+    steps = [size if not step else step for size, step in zip(shape, tile_shape)]
+    if any(step < 0 for step in steps):
+        raise ValueError(f"tile shape must not be negative, got {tile_shape}")
+    rows, columns = shape
+    row_step, column_step = steps
+    for row in range(0, rows, row_step):
+        for column in range(0, columns, column_step):
+            yield (slice(row, min(row + row_step, rows)),
+                   slice(column, min(column + column_step, columns)))
+
+
+class TiledImageWriter:
+    """Write `~spherex.core.SPHERExImage` to a FITS file a tile at a time
+
+    The file has the same layout as the uncompressed output of
+    `~spherex.core.spherex_image_writer`. The headers are written, and
+    the file is extended to its final size, when the writer is created.
+    Then every tile is written to its place in each image extension.
+
+    Parameters
+    ----------
+    filename : `str`
+        Output file path.
+    template : `~spherex.core.SPHERExImage`
+        Image with the header, WCS, unit and flag definitions of the output
+        image, and with the components (uncertainty, mask, flags) and data
+        types of the output tiles. Only the types of the template arrays are
+        used, not their shape or values, so a tile can be used as a template.
+    shape : `tuple` [`int`]
+        Output image shape.
+    overwrite : `bool`, optional
+        If `True`, overwrite the output file if it exists.
+    **kwargs
+        ``hdu_mask``, ``hdu_uncertainty``, ``hdu_flags``, ``wcs_relax``,
+        ``key_uncertainty_type`` and ``compact_flags`` arguments of
+        `~spherex.core.spherex_image_writer`. Flags are compacted by default,
+        if the template has flag definitions: the type of the flags holds
+        the highest defined bit.
+    """
+
+    def __init__(self, filename, template, shape, overwrite=False, **kwargs):
+        # flag values are not known in advance
+        kwargs.setdefault('compact_flags', bool(template.flag_defs))
+        planes = _image_planes(_placeholder(template, shape), **kwargs)
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if overwrite else os.O_EXCL)
+        self._fd = os.open(filename, flags, 0o666)
+        self._shape = tuple(shape)
+        # (extension, data offset, FITS data type) of the image extensions
+        self._planes = []
+        try:
+            # minimum header with EXTEND
+            offset = self._pwrite(fits.PrimaryHDU().header.tostring().encode('ascii'), 0)
+            for extension, header, array in planes:
+                offset = self._pwrite(_image_header(header, array).tostring().encode('ascii'), offset)
+                dtype = _fits_dtype(array.dtype)
+                self._planes.append((extension, offset, dtype))
+                nbytes = array.size * dtype.itemsize
+                offset += nbytes + (-nbytes % BLOCK_SIZE)
+            # data, which are not written yet, and padding read as zeros
+            os.ftruncate(self._fd, offset)
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, section, tile):
+        """Write a tile
+
+        Parameters
+        ----------
+        section : `tuple` [`slice`]
+            Tile section in numpy (row, column) order, with explicit
+            non-negative bounds, see `iter_tiles`.
+        tile : `~spherex.core.SPHERExImage`
+            Tile with the same components and data types as the template.
+        """
+        rows, columns = section
+        width = self._shape[1]
+        tile_shape = (rows.stop - rows.start, columns.stop - columns.start)
+        for extension, offset, dtype in self._planes:
+            array = _PLANE_ARRAYS[extension](tile)
+            if array is None:
+                raise ValueError(f"tile has no {extension} component")
+            array = np.asanyarray(array)
+            if array.shape != tile_shape:
+                raise ValueError(f"{extension} shape {array.shape} does not match section {section}")
+            if extension == 'flags' and array.dtype != dtype and array.dtype.kind in 'iu':
+                # flags are stored with a compact type, see spherex_image_writer
+                tile_dtype = _flags_dtype(array)
+                if tile_dtype is None or tile_dtype.itemsize > dtype.itemsize:
+                    raise ValueError(f"flags do not fit into {dtype} for the defined flag bits")
+                array = array.astype(dtype)
+            if _fits_dtype(array.dtype) != dtype:
+                raise ValueError(f"{extension} data type {array.dtype} does not match {dtype}")
+            start = offset + (rows.start * width + columns.start) * dtype.itemsize
+            if tile_shape[1] == width:
+                # full-width rows are contiguous in the file
+                self._pwrite(_fits_encode(array), start)
+            else:
+                for row in array:
+                    self._pwrite(_fits_encode(row), start)
+                    start += width * dtype.itemsize
+
+    def close(self):
+        """Close the output file"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _pwrite(self, buffer, offset):
+        """Write the whole buffer at the offset, return the end offset"""
+        buffer = memoryview(buffer)
+        while buffer:
+            written = os.pwrite(self._fd, buffer, offset)
+            buffer = buffer[written:]
+            offset += written
+        return offset
+
+
+def _placeholder(template, shape):
+    """Make image of the given shape with zero-strided components
+    of the template data types.
+    """
+    def stand_in(array):
+        if array is None:
+            return None
+        return np.broadcast_to(np.zeros((), dtype=np.asanyarray(array).dtype), shape)
+
+    uncertainty = template.uncertainty
+    if uncertainty is not None:
+        uncertainty = uncertainty.__class__(stand_in(uncertainty.array), unit=uncertainty.unit, copy=False)
+    return SPHERExImage(stand_in(template.data), meta=template.header, unit=template.unit,
+                        wcs=template.wcs, uncertainty=uncertainty, mask=stand_in(template.mask),
+                        flags=stand_in(template.flags), flag_defs=template.flag_defs)
+
+
+def _read_tile(hdus, frame, section, unit=None, **kwargs):
+    spherex_image, loaders = _read_hdus(hdus, unit=unit, section=section, frame=frame, **kwargs)
+    for name, load in loaders.items():
+        setattr(spherex_image, name, load())
+    return spherex_image
+
+
+def run_tiled(kernel, inputs, output, tile_shape=DEFAULT_TILE_SHAPE, unit=None, overwrite=False,
+              read_kwargs=None, write_kwargs=None):
+    """Apply a pixel-level operation to images stored in FITS files
+    a tile at a time
+
+    Parameters
+    ----------
+    kernel : callable
+        Function, which takes a tile of every input image, as
+        `~spherex.core.SPHERExImage` objects, and returns the output tile.
+        It may modify the input tiles and return one of them. Header cards
+        added to the output tile are written to the output file.
+    inputs : `list` [`str`]
+        Input FITS files with images of the same shape.
+    output : `str`
+        Output FITS file.
+    tile_shape : `tuple` [`int` or None], optional
+        Tile shape, see `iter_tiles`. Default are blocks of 256 rows.
+    unit : `~astropy.units.Unit` or str, optional
+        Unit of the input images, see `~spherex.core.spherex_image_reader`.
+    overwrite : `bool`, optional
+        If `True`, overwrite the output file if it exists.
+    read_kwargs : `dict`, optional
+        Additional `~spherex.core.spherex_image_reader` arguments, for
+        example ``hdu_uncertainty`` or ``hdu_flags``.
+    write_kwargs : `dict`, optional
+        Additional `TiledImageWriter` arguments.
+
+    Returns
+    -------
+    n_tiles : `int`
+        Number of processed tiles.
+
+    Notes
+    -----
+    Every input file is opened once, without memory mapping, and only the
+    pixels of the current tile are read from it. The output header and WCS
+    are those of the first input image, updated with the cards the kernel
+    adds to the first output tile. The peak memory is proportional to the
+    tile size times the number of inputs.
+    """
+    read_kwargs = dict(read_kwargs or {})
+    write_kwargs = write_kwargs or {}
+    if not inputs:
+        raise ValueError("at least one input file is required")
+
+    with contextlib.ExitStack() as stack:
+        hdus = [stack.enter_context(fits.open(path, memmap=False)) for path in inputs]
+        # image extension, header and WCS are parsed once, not for every tile
+        hdu = read_kwargs.pop('hdu', 0)
+        frames = [_read_frame(h, hdu) for h in hdus]
+        shape = hdus[0][frames[0][0]].shape
+        for path, h, frame in zip(inputs[1:], hdus[1:], frames[1:]):
+            if h[frame[0]].shape != shape:
+                raise ValueError(f"image shape {h[frame[0]].shape} of {path} does not match {shape}")
+
+        writer = None
+        n_tiles = 0
+        for section in iter_tiles(shape, tile_shape):
+            result = kernel(*[_read_tile(h, frame, section, unit=unit, **read_kwargs)
+                              for h, frame in zip(hdus, frames)])
+            if writer is None:
+                _, header, wcs = frames[0]
+                template = _frame_template(result, header, wcs)
+                writer = stack.enter_context(TiledImageWriter(output, template, shape,
+                                                              overwrite=overwrite, **write_kwargs))
+            writer.write(section, result)
+            n_tiles += 1
+    return n_tiles
+
+
+def _frame_template(tile, header, wcs):
+    """Make output template from the first output tile and the header
+    and WCS of the full frame.
+    """
+    tile_header = tile.header.copy()
+    # section offsets added by the reader
+    for key in ('LTV1', 'LTV2'):
+        tile_header.remove(key, ignore_missing=True)
+    meta = header.copy()
+    # add the cards from the kernel
+    meta.extend(tile_header, unique=True)
+    return SPHERExImage(tile.data, meta=meta, unit=tile.unit, wcs=wcs, uncertainty=tile.uncertainty,
+                        mask=tile.mask, flags=tile.flags, flag_defs=tile.flag_defs)
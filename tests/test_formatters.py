@@ -5,14 +5,24 @@ import tempfile
 import unittest
 
 import lsst.utils.tests
-from lsst.daf.butler import Butler, ButlerURI, Config, DatasetRef, FileDataset, StorageClassFactory, Timespan
+from lsst.daf.butler import (Butler, ButlerURI, Config, DatasetRef, FileDataset, FileDescriptor, Location,
+                             StorageClassFactory, Timespan)
 from lsst.daf.butler.tests import DatasetTestHelper, makeTestRepo, addDatasetType
 
 from astropy.io import fits
 from astropy.nddata import CCDData
 from spherex.core import SPHERExImage
+from spherex.instrument import SummaryIndex, getExposureCube, getExposureImages
 
-from spherex.formatters import AstropyImageFormatter, CCDDataFormatter, SPHERExImageFormatter
+from spherex.formatters import (AstropyImageFormatter, CCDDataFormatter, PooledHDUList, SPHERExHDF5Formatter,
+                                SPHERExImageFormatter, configureHandlePool, configureReadCache,
+                                storedDatasetReader)
+
+try:
+    import h5py
+except ImportError:
+    # h5py is an optional dependency of SPHERExHDF5Formatter
+    h5py = None
 
 TESTDIR = os.path.dirname(__file__)
 
@@ -77,6 +87,9 @@ class FormattersTests(DatasetTestHelper, lsst.utils.tests.TestCase):
 
         configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
         butlerConfig = Config(configURI.join("butler.yaml"))
+        if h5py is not None:
+            butlerConfig["datastore", "formatters", "spherex_hdf5"] = {
+                "formatter": "spherex.formatters.SPHERExHDF5Formatter", "parameters": {"chunks": [5, 6]}}
         # in-memory db is being phased out
         # butlerConfig["registry", "db"] = 'sqlite:///:memory:'
         cls.creatorButler = makeTestRepo(cls.root, data_ids, config=butlerConfig,
@@ -85,6 +98,9 @@ class FormattersTests(DatasetTestHelper, lsst.utils.tests.TestCase):
             datasetTypeName, storageClassName = (formatter["dataset_type"], formatter["storage_class"])
             storageClass = cls.storageClassFactory.getStorageClass(storageClassName)
             addDatasetType(cls.creatorButler, datasetTypeName, set(data_ids), storageClass)
+        if h5py is not None:
+            addDatasetType(cls.creatorButler, "spherex_hdf5", set(data_ids),
+                           cls.storageClassFactory.getStorageClass("SPHERExImage"))
 
     @classmethod
     def tearDownClass(cls):
@@ -113,6 +129,229 @@ class FormattersTests(DatasetTestHelper, lsst.utils.tests.TestCase):
             self.assertTrue(isinstance(retrievedobj, formatter["inmem_cls"]))
             self.assertTrue(retrievedobj.__class__.__name__, inmemobj.__class__.__name__)
 
+    def test_lazy_get(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        dataid = {"exposure": 22, "detector": 1, "instrument": INSTRUMENT_NAME}
+        inmemobj = read_spherex_image(fitsPath)
+        self.butler.put(inmemobj, "spherex_image", dataid)
+
+        retrievedobj = self.butler.get("spherex_image", dataid, parameters={"lazy": True})
+        self.assertTrue(isinstance(retrievedobj, SPHERExImage))
+        self.assertTrue((retrievedobj.data == inmemobj.data).all())
+        self.assertTrue((retrievedobj.flags == inmemobj.flags).all())
+        self.assertTrue((retrievedobj.uncertainty.array == inmemobj.uncertainty.array).all())
+
+    def test_bbox_get(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        dataid = {"exposure": 22, "detector": 2, "instrument": INSTRUMENT_NAME}
+        bbox = (3, 4, 10, 8)
+        for formatter in FORMATTERS[:2]:
+            inmemobj = formatter["reader"](fitsPath)
+            datasetTypeName = formatter["dataset_type"]
+            self.butler.put(inmemobj, datasetTypeName, dataid)
+
+            retrievedobj = self.butler.get(datasetTypeName, dataid, parameters={"bbox": bbox})
+            self.assertTrue(isinstance(retrievedobj, formatter["inmem_cls"]))
+            self.assertEqual(retrievedobj.shape, (4, 7))
+            self.assertTrue((retrievedobj.data == inmemobj.data[4:8, 3:10]).all())
+
+        inmemobj = read_spherex_image(fitsPath)
+        retrievedobj = self.butler.get("spherex_image", dataid,
+                                       parameters={"slices": (slice(4, 8), slice(3, 10)), "hdus": ["flags"]})
+        self.assertIsNone(retrievedobj.uncertainty)
+        self.assertTrue((retrievedobj.flags == inmemobj.flags[4:8, 3:10]).all())
+
+    def test_component_get(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        dataid = {"exposure": 22, "detector": 4, "instrument": INSTRUMENT_NAME}
+        inmemobj = read_spherex_image(fitsPath)
+        self.butler.put(inmemobj, "spherex_image", dataid)
+
+        metadata = self.butler.get("spherex_image.metadata", dataid)
+        self.assertTrue(isinstance(metadata, fits.Header))
+        self.assertEqual(metadata["FILTER"], inmemobj.meta["FILTER"])
+        self.assertEqual(self.butler.get("spherex_image.flag_defs", dataid), inmemobj.flag_defs)
+        self.assertTrue((self.butler.get("spherex_image.image", dataid) == inmemobj.data).all())
+        self.assertTrue((self.butler.get("spherex_image.flags", dataid) == inmemobj.flags).all())
+        variance = self.butler.get("spherex_image.variance", dataid, parameters={"bbox": (3, 4, 10, 8)})
+        self.assertEqual(variance.shape, (4, 7))
+
+    def test_summary_index(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        inmemobj = read_spherex_image(fitsPath)
+        for detector in range(2):
+            dataid = {"exposure": 11, "detector": detector, "instrument": INSTRUMENT_NAME}
+            self.butler.put(inmemobj, "spherex_image", dataid)
+
+        # summary is written by the formatter
+        summary = self.butler.get("spherex_image.summary", dataid)
+        self.assertEqual(summary["size"], inmemobj.data.size)
+        self.assertEqual(set(summary["flag_counts"]), set(inmemobj.flag_defs))
+
+        with SummaryIndex(os.path.join(self.root, "summary.sqlite3")) as index:
+            self.assertEqual(index.update(self.butler, "spherex_image", collections=[self.collection]), 2)
+            # indexed datasets are skipped
+            self.assertEqual(index.update(self.butler, "spherex_image", collections=[self.collection]), 0)
+            flag = next(iter(summary["flag_counts"]))
+            fraction = summary["flag_counts"][flag] / summary["size"]
+            rows = index.query("spherex_image", maxFlagFraction={flag: fraction + 0.01}, detector=1)
+            self.assertEqual([(row["exposure"], row["detector"]) for row in rows], [(11, 1)])
+            self.assertEqual(index.query("spherex_image", maxFlagFraction={flag: fraction}), [])
+
+            if h5py is not None:
+                # summaries are read by the formatter of the dataset
+                self.butler.put(inmemobj, "spherex_hdf5", dataid)
+                self.assertEqual(index.update(self.butler, "spherex_hdf5", collections=[self.collection]), 1)
+                rows = index.query("spherex_hdf5", maxFlagFraction={flag: fraction + 0.01})
+                self.assertEqual([row["size"] for row in rows], [summary["size"]])
+
+    def test_cached_get(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        dataid = {"exposure": 22, "detector": 3, "instrument": INSTRUMENT_NAME}
+        self.butler.put(read_spherex_image(fitsPath), "spherex_image", dataid)
+
+        cache = configureReadCache({"spherex": {"readCache": {"maxBytes": 1 << 30,
+                                                              "include": ["/spherex_image[._/]"]}}})
+        try:
+            first = self.butler.get("spherex_image", dataid)
+            second = self.butler.get("spherex_image", dataid)
+            # readers share read-only arrays, but not metadata
+            self.assertIsNot(first, second)
+            self.assertIs(first.data, second.data)
+            self.assertIsNot(first.meta, second.meta)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertGreater(cache.nbytes, 0)
+            self.assertFalse(first.data.flags.writeable)
+
+            # reads with parameters bypass the cache
+            retrievedobj = self.butler.get("spherex_image", dataid, parameters={"bbox": (0, 0, 2, 2)})
+            self.assertIsNot(retrievedobj, first)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # missing files are not read, with or without the cache
+            storageClass = self.storageClassFactory.getStorageClass("SPHERExImage")
+            for path in (os.path.join(self.root, "spherex_image_missing.fits"), "missing.fits"):
+                formatter = SPHERExImageFormatter(FileDescriptor(Location(None, path), storageClass))
+                self.assertIsNone(formatter.read(component="image"))
+        finally:
+            configureReadCache({})
+
+    def test_astropy_modes(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        storageClass = self.storageClassFactory.getStorageClass("MyImage")
+        descriptor = FileDescriptor(Location(None, fitsPath), storageClass)
+
+        hdus = AstropyImageFormatter(descriptor).read()
+        self.assertTrue(hdus.fileinfo(0)["file"].closed)
+        self.assertIsNotNone(hdus[1].data)
+
+        # the mode is a read parameter of butler.get
+        dataid = {"exposure": 11, "detector": 1, "instrument": INSTRUMENT_NAME}
+        self.butler.put(read_astropy_image(fitsPath), "astropy_image", dataid)
+        self.assertNotIsInstance(self.butler.get("astropy_image", dataid), PooledHDUList)
+        pool = configureHandlePool({"spherex": {"handlePool": {"maxOpen": 2}}})
+        try:
+            opened = [self.butler.get("astropy_image", dataid, parameters={"mode": "memmap"})
+                      for _ in range(3)]
+            self.assertIsInstance(opened[0], PooledHDUList)
+            self.assertEqual((len(pool), pool.evictions), (2, 1))
+            # the file closed by the pool is reopened on access
+            self.assertTrue((opened[0][1].data == hdus[1].data).all())
+            self.assertEqual((len(pool), pool.evictions), (2, 2))
+        finally:
+            configureHandlePool({})
+        self.assertEqual(len(pool), 0)
+
+        # or the default mode of the process
+        pool = configureHandlePool({"spherex": {"handlePool": {"mode": "memmap"}}})
+        try:
+            self.assertIsInstance(self.butler.get("astropy_image", dataid), PooledHDUList)
+            self.assertEqual(len(pool), 1)
+        finally:
+            configureHandlePool({})
+
+        with self.assertRaises(ValueError):
+            AstropyImageFormatter(FileDescriptor(Location(None, fitsPath), storageClass,
+                                                 parameters={"mode": "open"})).read()
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def test_hdf5_get(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        dataid = {"exposure": 22, "detector": 5, "instrument": INSTRUMENT_NAME}
+        inmemobj = read_spherex_image(fitsPath)
+        self.butler.put(inmemobj, "spherex_hdf5", dataid)
+        self.assertTrue(self.butler.getURI("spherex_hdf5", dataid).ospath.endswith(".h5"))
+
+        retrievedobj = self.butler.get("spherex_hdf5", dataid)
+        self.assertTrue(isinstance(retrievedobj, SPHERExImage))
+        self.assertTrue((retrievedobj.data == inmemobj.data).all())
+        self.assertTrue((retrievedobj.flags == inmemobj.flags).all())
+        self.assertEqual(retrievedobj.flag_defs, inmemobj.flag_defs)
+
+        retrievedobj = self.butler.get("spherex_hdf5", dataid, parameters={"bbox": (3, 4, 10, 8),
+                                                                           "hdus": ["flags"]})
+        self.assertTrue((retrievedobj.data == inmemobj.data[4:8, 3:10]).all())
+        self.assertIsNone(retrievedobj.uncertainty)
+        variance = self.butler.get("spherex_hdf5.variance", dataid, parameters={"bbox": (3, 4, 10, 8)})
+        self.assertEqual(variance.shape, (4, 7))
+        self.assertEqual(self.butler.get("spherex_hdf5.flag_defs", dataid), inmemobj.flag_defs)
+        # summary is written by default, as by SPHERExImageFormatter
+        summary = self.butler.get("spherex_hdf5.summary", dataid)
+        self.assertEqual(summary["size"], inmemobj.data.size)
+
+        # read by the stored formatter, with the lookups done up front
+        ref = self.butler.registry.findDataset("spherex_hdf5", dataid, collections=self.butler.collections)
+        read, paths = storedDatasetReader(self.butler, ref, {"bbox": (3, 4, 10, 8)})
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(paths[0].endswith(".h5"))
+        self.assertTrue((read().data == inmemobj.data[4:8, 3:10]).all())
+
+        # components of missing files are None, as with SPHERExImageFormatter
+        storageClass = self.storageClassFactory.getStorageClass("SPHERExImage")
+        formatter = SPHERExHDF5Formatter(FileDescriptor(Location(None, "missing.h5"), storageClass))
+        self.assertIsNone(formatter.read(component="image"))
+
+    def test_exposure_read(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        inmemobj = read_spherex_image(fitsPath)
+        for detector in range(6):
+            dataid = {"exposure": 11, "detector": detector, "instrument": INSTRUMENT_NAME}
+            self.butler.put(inmemobj, "spherex_image", dataid)
+
+        images = getExposureImages(self.butler, "spherex_image", 11, instrument=INSTRUMENT_NAME,
+                                   collections=[self.collection])
+        self.assertEqual(list(images), list(range(6)))
+        for image in images.values():
+            self.assertTrue(isinstance(image, SPHERExImage))
+            self.assertTrue((image.data == inmemobj.data).all())
+
+        cube, detectors = getExposureCube(self.butler, "spherex_image", 11, instrument=INSTRUMENT_NAME,
+                                          detectors=[1, 3], collections=[self.collection])
+        self.assertEqual(detectors, [1, 3])
+        self.assertEqual(cube.shape, (2,) + inmemobj.data.shape)
+        self.assertTrue(cube.dtype.isnative)
+        self.assertTrue((cube == inmemobj.data).all())
+
+    @unittest.skipIf(h5py is None, "h5py is not available")
+    def test_exposure_read_hdf5(self):
+        fitsPath = os.path.join(TESTDIR, "data", "small.fits")
+        inmemobj = read_spherex_image(fitsPath)
+        for detector in range(3):
+            dataid = {"exposure": 11, "detector": detector, "instrument": INSTRUMENT_NAME}
+            self.butler.put(inmemobj, "spherex_hdf5", dataid)
+
+        # files are read with the formatter they were stored with
+        images = getExposureImages(self.butler, "spherex_hdf5", 11, instrument=INSTRUMENT_NAME,
+                                   collections=[self.collection], parameters={"bbox": (3, 4, 10, 8)})
+        self.assertEqual(list(images), list(range(3)))
+        for image in images.values():
+            self.assertTrue((image.data == inmemobj.data[4:8, 3:10]).all())
+
+        cube, detectors = getExposureCube(self.butler, "spherex_hdf5", 11, instrument=INSTRUMENT_NAME,
+                                          collections=[self.collection])
+        self.assertEqual(detectors, [0, 1, 2])
+        self.assertTrue((cube == inmemobj.data).all())
+
     def test_ingest(self):
 
         fitsPath = os.path.join(TESTDIR, "data", "small.fits")
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from astropy.io import fits
+
+from spherex.formatters.handles import HandlePool
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestHandlePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir=TESTDIR)
+        self.paths = []
+        for i in range(5):
+            path = os.path.join(self.tmpdir, f"image_{i}.fits")
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(np.full((8, 8), i, dtype=np.float32)),
+                          fits.ImageHDU(np.zeros((8, 8), dtype=np.float32))]).writeto(path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_bounded(self):
+        pool = HandlePool(maxOpen=2)
+        opened = []
+        for path in self.paths:
+            hdus = pool.open(path)
+            # memory-mapped data stay valid after the file is closed
+            opened.append(hdus[1].data)
+        self.assertEqual((len(pool), pool.opened, pool.evictions), (2, 5, 3))
+        self.assertEqual([int(data[0, 0]) for data in opened], list(range(5)))
+        pool.closeAll()
+        self.assertEqual(len(pool), 0)
+
+    def test_reopen(self):
+        pool = HandlePool(maxOpen=2)
+        lists = [pool.open(path) for path in self.paths]
+        # files closed by the pool are reopened on access
+        self.assertEqual([int(hdus[1].data[0, 0]) for hdus in lists], list(range(5)))
+        self.assertEqual([len(hdus[2].data) for hdus in lists], [8] * 5)
+        self.assertEqual(len(pool), 2)
+        pool.closeAll()
+
+    def test_lru(self):
+        pool = HandlePool(maxOpen=2)
+        first = pool.open(self.paths[0])
+        pool.open(self.paths[1])
+        first[1].data
+        pool.open(self.paths[2])
+        # the least recently used file is closed, not the first opened one
+        opened = pool.opened
+        first[2].data
+        self.assertEqual(pool.opened, opened)
+        pool.closeAll()
+
+    def test_closed_by_user(self):
+        pool = HandlePool(maxOpen=2)
+        with pool.open(self.paths[0]) as hdus:
+            pass
+        self.assertEqual(len(pool), 0)
+        first = pool.open(self.paths[1])
+        pool.open(self.paths[2])
+        # the file closed by its user is dropped instead of an open one
+        self.assertEqual(pool.evictions, 0)
+        self.assertEqual(len(first[2].data), 8)
+        # and reopened if it is used again
+        self.assertEqual(int(hdus[1].data[0, 0]), 0)
+        self.assertEqual(pool.evictions, 1)
+        pool.closeAll()
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "requires /proc/self/fd")
+    def test_file_descriptors(self):
+        def count():
+            return len(os.listdir("/proc/self/fd"))
+
+        paths = []
+        for i in range(40):
+            paths.append(os.path.join(self.tmpdir, f"many_{i}.fits"))
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(np.full((8, 8), i, dtype=np.float32))]
+                         ).writeto(paths[-1])
+        pool = HandlePool(maxOpen=4)
+        before = count()
+        lists = [pool.open(path) for path in paths]
+        self.assertEqual(sum(float(hdus[1].data.sum()) for hdus in lists), 64 * sum(range(40)))
+        # a file and its memory map per open file
+        self.assertLessEqual(count() - before, 2 * pool.maxOpen)
+        # each referenced array keeps its memory map
+        kept = [hdus[1].data for hdus in lists]
+        self.assertGreaterEqual(count() - before, len(kept))
+        del kept
+        self.assertLessEqual(count() - before, 2 * pool.maxOpen)
+        pool.closeAll()
+        self.assertEqual(count(), before)
+
+    def test_missing(self):
+        pool = HandlePool()
+        with self.assertRaises(FileNotFoundError):
+            pool.open(os.path.join(self.tmpdir, "missing.fits"))
+        self.assertEqual(len(pool), 0)
+        with self.assertRaises(ValueError):
+            HandlePool(maxOpen=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
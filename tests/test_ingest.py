@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from spherex.core import disable_instrumentation, enable_instrumentation, instrumentation_enabled
+
+try:
+    from click.testing import CliRunner
+    from lsst.daf.butler import Butler, ButlerURI, Config
+    from spherex.cli.cmd.commands import ingest_simulated
+    from spherex.script.ingestSimulated import (INGEST_PHASES, PARSE_AHEAD_PER_JOB, IngestTimings,
+                                                appendCheckpoint, findSimulatedFiles, ingestSimulated,
+                                                logIngestTimings, parseSimulatedFiles, readCheckpoint,
+                                                syncExposureRecords)
+except ImportError:
+    # the ingest depends on lsst.daf.butler, which is not installed in CI
+    ingestSimulated = None
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+REGEX = r"sim_exposure_(\d+)_array_(\d).fits"
+RUN = "rawexpr"
+
+
+class ListSink:
+    """Sink, which keeps the records"""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def flush(self):
+        pass
+
+
+class Record:
+    """Stage record with a name, a wall time and labels"""
+
+    def __init__(self, name, wall, **labels):
+        self.name = name
+        self.wall = wall
+        self.labels = labels
+
+
+@unittest.skipIf(ingestSimulated is None, "lsst.daf.butler is not available")
+class TestIngestSimulated(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=TESTDIR)
+        self.dataDir = os.path.join(self.root, "sim")
+        self.paths = []
+        for exposure in range(3):
+            directory = os.path.join(self.dataDir, f"{exposure:03d}")
+            os.makedirs(directory)
+            for detector in range(1, 4):
+                path = os.path.join(directory, f"sim_exposure_{exposure:06d}_array_{detector}.fits")
+                shutil.copyfile(os.path.join(TESTDIR, "data", "small.fits"), path)
+                self.paths.append(path)
+        open(os.path.join(self.dataDir, "000", "notes.txt"), "w").close()
+
+    def tearDown(self):
+        disable_instrumentation()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def makeRepo(self):
+        repo = os.path.join(self.root, "repo")
+        configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
+        Butler.makeRepo(repo, config=Config(configURI.join("butler.yaml")),
+                        dimensionConfig=configURI.join("dimensions.yaml"))
+        return repo
+
+    def ingested(self, repo):
+        butler = Butler(repo, collections=[RUN])
+        return sorted((ref.dataId["exposure"], ref.dataId["detector"])
+                      for ref in butler.registry.queryDatasets("rawexp", collections=[RUN]))
+
+    def test_find(self):
+        found = findSimulatedFiles([self.dataDir], REGEX)
+        # files are found lazily
+        self.assertFalse(isinstance(found, list))
+        self.assertEqual(list(found), self.paths)
+        locations = [os.path.join(self.dataDir, "001"), self.paths[0], os.path.join(self.dataDir, "002")]
+        self.assertEqual(list(findSimulatedFiles(locations, REGEX, jobs=2)),
+                         self.paths[3:6] + self.paths[:1] + self.paths[6:])
+
+    def test_parse_bounded(self):
+        consumed = []
+
+        def files():
+            for path in self.paths * 10:
+                consumed.append(path)
+                yield path
+
+        jobs = 2
+        parsed = parseSimulatedFiles(files(), jobs=jobs)
+        path, first = next(parsed)
+        self.assertEqual((path, first.exposure_id, first.detector_id), (self.paths[0], 0, 1))
+        self.assertLessEqual(len(consumed), PARSE_AHEAD_PER_JOB * jobs + 1)
+        self.assertEqual(len(list(parsed)), len(self.paths) * 10 - 1)
+
+    def test_checkpoint(self):
+        checkpoint = os.path.join(self.root, "checkpoint.txt")
+        self.assertEqual(readCheckpoint(checkpoint), set())
+        appendCheckpoint(checkpoint, self.paths[:2])
+        appendCheckpoint(checkpoint, [os.path.relpath(self.paths[2])])
+        self.assertEqual(readCheckpoint(checkpoint), set(self.paths[:3]))
+
+    def test_chunked_resume(self):
+        repo = self.makeRepo()
+        checkpoint = os.path.join(self.root, "checkpoint.txt")
+        ingestSimulated(repo, [os.path.join(self.dataDir, "000")], REGEX, RUN, transfer="symlink",
+                        chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual(self.ingested(repo), [(0, 1), (0, 2), (0, 3)])
+        self.assertEqual(readCheckpoint(checkpoint), set(self.paths[:3]))
+
+        # interrupted after the last chunk was committed, before it was recorded
+        with open(checkpoint) as f:
+            lines = f.readlines()
+        with open(checkpoint, "w") as f:
+            f.writelines(lines[:2])
+        ingestSimulated(repo, [self.dataDir], REGEX, RUN, transfer="symlink", jobs=2,
+                        chunk_size=4, checkpoint=checkpoint)
+        self.assertEqual(self.ingested(repo), [(exposure, detector) for exposure in range(3)
+                                               for detector in range(1, 4)])
+        self.assertEqual(readCheckpoint(checkpoint), set(self.paths))
+
+    def test_sync_exposures(self):
+        repo = self.makeRepo()
+        ingestSimulated(repo, [os.path.join(self.dataDir, "000")], REGEX, RUN, transfer="symlink")
+        butler = Butler(repo, writeable=True)
+        records = [{"instrument": "simulator", "id": exposure, "name": f"{exposure:06d}",
+                    "group_name": "test"} for exposure in range(3)]
+        # only the exposures of the records are queried, in batches
+        with unittest.mock.patch("spherex.script.ingestSimulated.EXPOSURE_QUERY_BATCH", 2):
+            self.assertEqual(syncExposureRecords(butler, records), 2)
+            self.assertEqual(syncExposureRecords(butler, records), 0)
+        self.assertEqual(sorted(dataId["exposure"] for dataId in
+                                butler.registry.queryDataIds(["exposure"], instrument="simulator")),
+                         [0, 1, 2])
+
+    def test_log_timings(self):
+        timings = IngestTimings()
+        for name, wall in (("setup", 1.), ("wait", 0.5), ("wait/discover", 0.25), ("parse", 0.25),
+                           ("parse", 0.25), ("sync", 1.), ("ingest", 4.), ("checkpoint", 0.5),
+                           ("parseFile", 0.001), ("parseFile", 0.003)):
+            timings.emit(Record(name, wall))
+        timings.emit(Record("ingest/insert", 1., files=4))
+        timings.emit(Record("ingest/transfer", 1.5, files=3))
+        timings.emit(Record("ingest/transfer", 0.5, files=1))
+        self.assertEqual(timings.perFile["ingest/transfer"], [0.5] * 4)
+        with self.assertLogs(level="INFO") as logs:
+            logIngestTimings(timings, 10., 100)
+        lines = logs.records[0].getMessage().splitlines()
+        self.assertEqual(lines[0], "Ingest of 100 files took 10.000 s (10.0 files/s):")
+        self.assertEqual([line.split()[0] for line in lines[1:-3]],
+                         ["setup", "discover", "wait", "parse", "sync", "ingest", "insert", "transfer",
+                          "commit", "checkpoint", "other"])
+        self.assertEqual(len(lines), len(INGEST_PHASES) + 7)
+        self.assertIn(" discover          0.250 s    2.5%", lines[2])
+        self.assertIn(" wait              0.250 s    2.5%", lines[3])
+        self.assertIn(" parse             0.500 s    5.0%", lines[4])
+        self.assertIn(" commit          1.000 s   10.0%", lines[9])
+        self.assertIn(" other             2.500 s   25.0%", lines[11])
+        self.assertIn("per-file parse latency: p50 2.000 ms", lines[-3])
+        self.assertIn("per-file insert latency: p50 250.000 ms", lines[-2])
+        self.assertIn("per-file transfer latency: p50 500.000 ms", lines[-1])
+
+    def test_cli_options(self):
+        repo = self.makeRepo()
+        checkpoint = os.path.join(self.root, "checkpoint.txt")
+        profile = os.path.join(self.root, "ingest.prof")
+        sink = ListSink()
+        enable_instrumentation(sink)
+        with self.assertLogs(level="INFO") as logs:
+            result = CliRunner().invoke(ingest_simulated, [
+                repo, self.dataDir, "--run", RUN, "--transfer", "symlink", "-j", "2", "--chunk-size", "4",
+                "--checkpoint", checkpoint, "--timings", "--profile", profile])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(self.ingested(repo)), len(self.paths))
+        self.assertEqual(readCheckpoint(checkpoint), set(self.paths))
+        self.assertTrue(os.path.exists(profile))
+        self.assertTrue(any("Ingest of 9 files took" in message for message in logs.output))
+        # the configured instrumentation is restored and received the records too
+        self.assertTrue(instrumentation_enabled())
+        names = {record.name for record in sink.records}
+        self.assertTrue({"setup", "wait", "wait/discover", "parse", "sync", "ingest", "checkpoint"} <= names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from spherex.core import (SPHERExImage, configure_instrumentation, disable_instrumentation,
+                          enable_instrumentation, instrumentation_enabled, instrumentation_sinks,
+                          spherex_image_reader, spherex_image_writer, stage)
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class ListSink:
+    """Sink, which keeps the records"""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def flush(self):
+        pass
+
+    def byName(self):
+        return {record.name: record for record in self.records}
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir=TESTDIR)
+        self.sink = ListSink()
+
+    def tearDown(self):
+        disable_instrumentation()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_disabled(self):
+        with stage('outer') as record:
+            record.add(bytes_read=1)
+        self.assertFalse(record)
+        self.assertFalse(instrumentation_enabled())
+
+    def test_nested(self):
+        enable_instrumentation(self.sink)
+        with self.assertRaises(ValueError):
+            with stage('outer', path='a.fits'):
+                with stage('inner') as record:
+                    record.add(bytes_read=10, hdus=1)
+                with stage('inner') as record:
+                    record.add(bytes_written=5)
+                raise ValueError()
+        self.assertEqual([record.name for record in self.sink.records],
+                         ['outer/inner', 'outer/inner', 'outer'])
+        outer = self.sink.records[-1]
+        self.assertEqual((outer.bytes_read, outer.bytes_written, outer.hdus), (10, 5, 1))
+        self.assertEqual(outer.labels, {'path': 'a.fits'})
+        self.assertEqual(outer.error, 'ValueError')
+        self.assertGreaterEqual(outer.wall, sum(record.wall for record in self.sink.records[:2]))
+
+    def test_read_write(self):
+        path = os.path.join(self.tmpdir, 'image.fits')
+        image = SPHERExImage(np.ones((64, 32), dtype=np.float32), unit='adu',
+                             flags=np.zeros((64, 32), dtype=np.uint8), flag_defs={'HOT': 3})
+        enable_instrumentation(self.sink, trace_memory=True)
+        spherex_image_writer(image, path)
+        spherex_image_reader(path, section=(slice(0, 32), slice(None)))
+        records = self.sink.byName()
+        writer = records['spherex_image_writer']
+        self.assertEqual(writer.bytes_written, os.path.getsize(path))
+        self.assertEqual(writer.hdus, 2)
+        self.assertGreater(writer.peak_bytes, 0)
+        reader = records['spherex_image_reader']
+        self.assertEqual(reader.hdus, 2)
+        # half of the data spans (whole FITS blocks) of the image and the flags
+        self.assertEqual(reader.bytes_read, (3 * 2880 + 2880) // 2)
+        for name in ('open', 'header', 'wcs', 'decode'):
+            self.assertIn(f'spherex_image_reader/{name}', records)
+
+        # memory-mapped data are counted without reading their pages
+        self.sink.records.clear()
+        data = spherex_image_reader(path, lazy=True).data
+        records = self.sink.byName()
+        while not isinstance(data, mmap.mmap):
+            data = data.base
+        self.assertEqual(records['spherex_image_reader/decode'].bytes_read, 3 * 2880)
+
+    def test_added_sinks(self):
+        added = ListSink()
+        with instrumentation_sinks(added):
+            with stage('a'):
+                pass
+        self.assertFalse(instrumentation_enabled())
+        enable_instrumentation(self.sink)
+        with instrumentation_sinks(added):
+            with stage('b'):
+                pass
+        with stage('c'):
+            pass
+        # the configured sinks are kept
+        self.assertTrue(instrumentation_enabled())
+        self.assertEqual([record.name for record in added.records], ['a', 'b'])
+        self.assertEqual([record.name for record in self.sink.records], ['b', 'c'])
+
+    def test_sinks(self):
+        jsonPath = os.path.join(self.tmpdir, 'stages_{pid}.jsonl')
+        promPath = os.path.join(self.tmpdir, 'stages.prom')
+        self.assertTrue(configure_instrumentation({'spherex': {'instrumentation': {
+            'enabled': True, 'sinks': [{'type': 'json', 'path': jsonPath},
+                                       {'type': 'prometheus', 'path': promPath}]}}}))
+        for _ in range(3):
+            with stage('read') as record:
+                record.add(bytes_read=100)
+        disable_instrumentation()
+        with open(jsonPath.format(pid=os.getpid())) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0]['bytes_read'], 100)
+        with open(promPath) as f:
+            metrics = f.read()
+        self.assertIn('spherex_stage_calls_total{stage="read"} 3', metrics)
+        self.assertIn('spherex_stage_bytes_read_total{stage="read"} 300', metrics)
+        self.assertFalse(configure_instrumentation({}))
+        with self.assertRaises(ValueError):
+            configure_instrumentation({'spherex': {'instrumentation': {'enabled': True,
+                                                                       'sinks': [{'type': 'statsd'}]}}})
+
+
+if __name__ == "__main__":
+    unittest.main()
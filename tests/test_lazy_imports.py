@@ -0,0 +1,58 @@
+import ast
+import importlib
+import os
+import subprocess
+import sys
+import unittest
+
+import spherex.core
+import spherex.formatters
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+PYTHONDIR = os.path.join(os.path.dirname(TESTDIR), "python")
+
+
+def module_all(package, module):
+    """__all__ of a submodule, parsed without importing it"""
+    path = os.path.join(PYTHONDIR, *package.split("."), f"{module}.py")
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "__all__"
+                                                for target in node.targets):
+            return ast.literal_eval(node.value)
+    return []
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_exports(self):
+        for package, modules in (("spherex.core", ["arithmetic", "flags", "instrumentation",
+                                                   "spherex_hdf5", "spherex_image", "summary"]),
+                                 ("spherex.formatters", ["astropy_image", "cache", "ccddata_image",
+                                                         "delegate", "handles", "spherex_hdf5",
+                                                         "spherex_image", "stored"]),
+                                 ("spherex.tasks", ["prefetch", "subtract", "tiled"])):
+            expected = sorted(name for module in modules for name in module_all(package, module))
+            # only reads the lists, tasks submodules import lsst.pipe.base
+            exported = importlib.import_module(package).__all__
+            self.assertEqual(sorted(exported), expected, package)
+
+    def test_access(self):
+        self.assertIs(spherex.core.stage, sys.modules["spherex.core.instrumentation"].stage)
+        self.assertIn("stage", vars(spherex.core))
+        self.assertIn("SPHERExImageFormatter", dir(spherex.formatters))
+        with self.assertRaises(AttributeError):
+            spherex.core.no_such_name
+
+    def test_no_astropy(self):
+        code = ("import sys, spherex.core, spherex.formatters, spherex.core.instrumentation; "
+                "print(sorted(name for name in ('astropy', 'lsst.daf.butler') if name in sys.modules))")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([PYTHONDIR, os.environ.get("PYTHONPATH", "")]))
+        output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
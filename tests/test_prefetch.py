@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+try:
+    from spherex.tasks import Prefetcher
+except ImportError:
+    # spherex.tasks depends on lsst.pipe.base, which is not installed in CI
+    Prefetcher = None
+
+
+@unittest.skipIf(Prefetcher is None, "lsst.pipe.base is not available")
+class TestPrefetcher(unittest.TestCase):
+
+    def test_order(self):
+        prefetcher = Prefetcher(range(10), lambda item: item * 10, resolve=lambda item: item + 1, depth=3)
+        self.assertEqual(list(prefetcher), [(item, (item + 1) * 10) for item in range(10)])
+
+    def test_overlap(self):
+        """Inputs of the next items are read while the current one is processed"""
+        def load(item):
+            time.sleep(0.05)
+            return item
+
+        prefetcher = Prefetcher(range(8), load, depth=2)
+        for item, inputs in prefetcher:
+            time.sleep(0.05)
+        # only the first read is not overlapped
+        self.assertLess(prefetcher.waitTime, 0.2)
+
+    def test_budget(self):
+        lock = threading.Lock()
+        loaded = set()
+        released = set()
+        peak = [0]
+
+        def load(item):
+            with lock:
+                loaded.add(item)
+                peak[0] = max(peak[0], len(loaded - released))
+            return item
+
+        prefetcher = Prefetcher(range(10), load, depth=4, maxBytes=25, sizeOf=lambda item: 10)
+        for item, inputs in prefetcher:
+            time.sleep(0.01)
+            with lock:
+                released.add(item)
+        self.assertLessEqual(peak[0], 2)
+        self.assertGreater(prefetcher.throttled, 0)
+
+    def test_oversized(self):
+        """An item larger than the budget is read alone"""
+        prefetcher = Prefetcher(range(3), lambda item: item, depth=2, maxBytes=5, sizeOf=lambda item: 10)
+        self.assertEqual([inputs for _, inputs in prefetcher], [0, 1, 2])
+
+    def test_error(self):
+        def load(item):
+            if item == 2:
+                raise KeyError(item)
+            return item
+
+        results = []
+        with self.assertRaises(KeyError):
+            for item, inputs in Prefetcher(range(5), load, depth=2):
+                results.append(inputs)
+        self.assertEqual(results, [0, 1])
+
+    def test_resolve_error(self):
+        """Items before the failed one are yielded, the error is raised
+        at the failed item, although it is resolved ahead"""
+        def resolve(item):
+            if item == 3:
+                raise LookupError(item)
+            return item
+
+        results = []
+        with self.assertRaises(LookupError):
+            for item, inputs in Prefetcher(range(6), lambda item: item * 10, resolve=resolve, depth=3):
+                results.append(inputs)
+        self.assertEqual(results, [0, 10, 20])
+
+        prefetcher = Prefetcher(range(6), lambda item: item * 10, resolve=resolve, depth=3,
+                                returnExceptions=True)
+        results = list(prefetcher)
+        self.assertEqual([item for item, _ in results], list(range(6)))
+        self.assertIsInstance(results[3][1], LookupError)
+        self.assertEqual([inputs for item, inputs in results if item != 3], [0, 10, 20, 40, 50])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Prefetcher([], lambda item: item, depth=0)
+        with self.assertRaises(ValueError):
+            Prefetcher([], lambda item: item, maxBytes=10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+try:
+    from lsst.daf.butler import Butler, ButlerURI, Config, DatasetType
+    from spherex.instrument import SummaryIndex
+    from spherex.script.ingestSimulated import ingestSimulated
+    from spherex.tasks import SubtractTask, SubtractTaskConfig, SubtractTaskConnections
+    # the module, spherex.script.runPipeline is the function
+    runPipeline = importlib.import_module("spherex.script.runPipeline")
+except ImportError:
+    # runPipeline depends on lsst.daf.butler and lsst.pipe.base, not installed in CI
+    runPipeline = None
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+REGEX = r"sim_exposure_(\d+)_array_(\d).fits"
+RUN = "rawexpr"
+OUTPUT = "subtracted"
+
+
+@unittest.skipIf(runPipeline is None, "lsst.pipe.base is not available")
+class TestRunQuanta(unittest.TestCase):
+    """Failure handling of the quanta in a single process"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=TESTDIR)
+        dataDir = os.path.join(self.root, "sim")
+        os.makedirs(dataDir)
+        for detector in range(1, 3):
+            shutil.copyfile(os.path.join(TESTDIR, "data", "small.fits"),
+                            os.path.join(dataDir, f"sim_exposure_000000_array_{detector}.fits"))
+        self.repo = os.path.join(self.root, "repo")
+        configURI = ButlerURI("resource://spherex/configs", forceDirectory=True)
+        Butler.makeRepo(self.repo, config=Config(configURI.join("butler.yaml")),
+                        dimensionConfig=configURI.join("dimensions.yaml"))
+        ingestSimulated(self.repo, [dataDir], REGEX, RUN, transfer="symlink")
+
+        self.butler = Butler(self.repo, run=OUTPUT)
+        self.outputType = DatasetType("subtracted", ("instrument", "exposure", "detector"), "SPHERExImage",
+                                      universe=self.butler.registry.dimensions)
+        self.butler.registry.registerDatasetType(self.outputType)
+
+        config = SubtractTaskConfig()
+        config.connections.inputImage = "rawexp"
+        config.connections.subtractImage = "rawexp"
+        config.connections.outputImage = "subtracted"
+        self.staging = os.path.join(self.root, "staging")
+        os.makedirs(self.staging)
+        patcher = unittest.mock.patch.dict(runPipeline._worker, {
+            "butler": Butler(self.repo, collections=[RUN], writeable=False),
+            "staging": self.staging,
+            "tasks": {"subtract": (SubtractTask(config=config), SubtractTaskConnections(config=config))}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dataIds = [{"instrument": "simulator", "exposure": 0, "detector": detector}
+                        for detector in range(1, 3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def runQuanta(self, dataIds, prefetch):
+        results = runPipeline._runQuanta("subtract", dataIds, prefetch=prefetch)
+        self.assertEqual([dataId for dataId, _, _ in results], dataIds)
+        return [outputs for _, outputs, _ in results]
+
+    def test_missing_inputs(self):
+        missing = {"instrument": "simulator", "exposure": 1, "detector": 1}
+        for prefetch in (0, 2):
+            failed, outputs = self.runQuanta([missing, self.dataIds[0]], prefetch)
+            self.assertIsInstance(failed, Exception)
+            self.assertTrue(os.path.exists(outputs["outputImage"][0]))
+            os.remove(outputs["outputImage"][0])
+
+    def test_failed_run(self):
+        with unittest.mock.patch.object(SubtractTask, "run", side_effect=RuntimeError("run failed")):
+            for prefetch in (0, 2):
+                outputs = self.runQuanta(self.dataIds, prefetch)
+                self.assertTrue(all(isinstance(output, RuntimeError) for output in outputs))
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_failed_write(self):
+        def writeFile(formatter, inMemoryDataset):
+            # partially written file
+            open(formatter.fileDescriptor.location.path, "w").close()
+            raise OSError("disk full")
+
+        with unittest.mock.patch("spherex.formatters.SPHERExImageFormatter._writeFile", writeFile):
+            outputs = self.runQuanta(self.dataIds, 0)
+        self.assertTrue(all(isinstance(output, OSError) for output in outputs))
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_failed_ingest(self):
+        outputs = self.runQuanta(self.dataIds, 0)
+        outputTypes = {"outputImage": self.outputType}
+        with unittest.mock.patch.object(self.butler, "ingest", side_effect=RuntimeError("ingest failed")):
+            with self.assertRaises(RuntimeError):
+                runPipeline._ingestOutputs(self.butler, outputTypes, self.dataIds[0], outputs[0], OUTPUT)
+        self.assertEqual(len(os.listdir(self.staging)), 1)
+        runPipeline._ingestOutputs(self.butler, outputTypes, self.dataIds[1], outputs[1], OUTPUT)
+        self.assertEqual(os.listdir(self.staging), [])
+        self.assertEqual(len(list(self.butler.registry.queryDatasets("subtracted", collections=[OUTPUT]))), 1)
+
+    def test_summary_index(self):
+        outputs = self.runQuanta(self.dataIds, 0)
+        # summaries computed by the writer are returned with the files
+        summaries = [output["outputImage"][2] for output in outputs]
+        self.assertTrue(all(summary is not None for summary in summaries))
+        outputTypes = {"outputImage": self.outputType}
+        with SummaryIndex(os.path.join(self.root, "summary.sqlite3")) as index:
+            for dataId, output in zip(self.dataIds, outputs):
+                runPipeline._ingestOutputs(self.butler, outputTypes, dataId, output, OUTPUT, index)
+            rows = index.query("subtracted")
+            self.assertEqual([(row["run"], row["detector"]) for row in rows], [(OUTPUT, 1), (OUTPUT, 2)])
+            self.assertEqual([row["npix"] for row in rows], [summary["npix"] for summary in summaries])
+            # ingested outputs are indexed already
+            self.assertEqual(index.update(self.butler, "subtracted", collections=[OUTPUT]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
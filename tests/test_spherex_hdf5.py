@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from astropy import units as u
+from spherex.core import spherex_image_component_reader, spherex_image_reader
+
+try:
+    from spherex.core import (configure_hdf5_decoding, spherex_hdf5_component_reader, spherex_hdf5_reader,
+                              spherex_hdf5_writer)
+    from spherex.core.spherex_hdf5 import _shared_decode_pool
+except ImportError:
+    # h5py is an optional dependency
+    spherex_hdf5_reader = None
+
+TESTDIR = os.path.dirname(__file__)
+
+
+@unittest.skipIf(spherex_hdf5_reader is None, "h5py is not available")
+class TestSPHERExHDF5(unittest.TestCase):
+    root = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=TESTDIR)
+        cls.fits_path = os.path.join(TESTDIR, "data", "small.fits")
+        cls.image = spherex_image_reader(cls.fits_path, unit=(u.electron/u.s))
+        cls.image.mask = cls.image.data > np.median(cls.image.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.root is not None:
+            shutil.rmtree(cls.root, ignore_errors=True)
+
+    def write(self, name, **kwargs):
+        path = os.path.join(self.root, name)
+        spherex_hdf5_writer(self.image, path, overwrite=True, **kwargs)
+        return path
+
+    def assertImagesEqual(self, image, expected, section=(slice(None), slice(None))):
+        self.assertTrue((image.data == expected.data[section]).all())
+        self.assertTrue((image.flags == expected.flags[section]).all())
+        self.assertTrue((image.mask == expected.mask[section]).all())
+        self.assertEqual(type(image.uncertainty), type(expected.uncertainty))
+        self.assertTrue((image.uncertainty.array == expected.uncertainty.array[section]).all())
+
+    def test_read_write(self):
+        # chunks smaller than the 16x16 test image, not dividing it
+        for compression in ("gzip", "lzf", None):
+            path = self.write(f"image_{compression}.h5", chunks=(5, 6), compression=compression)
+            for jobs in (1, 4):
+                image = spherex_hdf5_reader(path, jobs=jobs)
+                self.assertImagesEqual(image, self.image)
+            self.assertEqual(image.unit, self.image.unit)
+            self.assertEqual(image.flag_defs, self.image.flag_defs)
+            self.assertEqual(image.wcs.to_header(), self.image.wcs.to_header())
+            self.assertEqual(image.meta["FILTER"], self.image.meta["FILTER"])
+
+        image = spherex_hdf5_reader(path, hdu_uncertainty=None, hdu_mask=None)
+        self.assertIsNone(image.uncertainty)
+        self.assertIsNone(image.mask)
+
+    def test_decoding_threads(self):
+        path = self.write("image.h5", chunks=(4, 4))
+        try:
+            self.assertEqual(configure_hdf5_decoding({"spherex": {"hdf5Decoding": {"threads": 1}}}), 1)
+            self.assertIsNone(_shared_decode_pool())
+            self.assertImagesEqual(spherex_hdf5_reader(path), self.image)
+            configure_hdf5_decoding({"spherex": {"hdf5Decoding": {"threads": 3}}})
+            pool = _shared_decode_pool()
+            self.assertEqual(pool._max_workers, 3)
+            self.assertImagesEqual(spherex_hdf5_reader(path), self.image)
+            # the pool is shared by the readers
+            self.assertIs(_shared_decode_pool(), pool)
+            with self.assertRaises(ValueError):
+                configure_hdf5_decoding({"spherex": {"hdf5Decoding": {"threads": 0}}})
+        finally:
+            # one thread per CPU by default
+            self.assertEqual(configure_hdf5_decoding({}), os.cpu_count())
+
+    def test_section_read(self):
+        path = self.write("image.h5", chunks=(4, 4))
+        section = (slice(3, 11), slice(5, 16))
+        image = spherex_hdf5_reader(path, section=section, jobs=3)
+        self.assertImagesEqual(image, self.image, section)
+        expected = spherex_image_reader(self.fits_path, unit=(u.electron/u.s), section=section)
+        self.assertEqual(image.meta["LTV1"], expected.meta["LTV1"])
+        self.assertEqual(image.meta["LTV2"], expected.meta["LTV2"])
+        self.assertTrue(np.allclose(image.wcs.wcs.crpix, expected.wcs.wcs.crpix))
+
+    def test_written_summary(self):
+        path = os.path.join(self.root, "summary.h5")
+        summary = spherex_hdf5_writer(self.image, path, summary=True)
+        self.assertEqual(summary["size"], self.image.data.size)
+        self.assertEqual(spherex_hdf5_component_reader(path, "summary"), summary)
+        self.assertIsNone(spherex_hdf5_writer(self.image, path, overwrite=True))
+
+    def test_component_read(self):
+        path = self.write("image.h5", chunks=(8, 8))
+        section = (slice(1, 9), slice(2, 4))
+        for component in ("flag_defs", "summary", "image", "flags", "variance"):
+            value = spherex_hdf5_component_reader(path, component, section=section)
+            expected = spherex_image_component_reader(self.fits_path, component, section=section)
+            if isinstance(expected, np.ndarray):
+                self.assertTrue((value == expected).all(), component)
+            else:
+                self.assertEqual(value, expected, component)
+        metadata = spherex_hdf5_component_reader(path, "metadata", section=section)
+        self.assertEqual(metadata["LTV1"], -2)
+        self.assertIsNotNone(spherex_hdf5_component_reader(path, "wcs"))
+        with self.assertRaises(ValueError):
+            spherex_hdf5_component_reader(path, "pixels")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,16 @@
 import os
 import shutil
 import tempfile
+import tracemalloc
 import unittest
 
+import numpy as np
 from astropy import units as u
 from astropy.io import fits
-from astropy.nddata import CCDData
-from spherex.core import SPHERExImage, spherex_image_reader, spherex_image_writer
+from astropy.nddata import CCDData, VarianceUncertainty, fits_ccddata_reader
+from spherex.core import (SPHERExImage, image_summary, spherex_image_component_reader, spherex_image_reader,
+                          spherex_image_writer, subtract_image)
+from spherex.formatters.cache import ImageCache
 
 TESTDIR = os.path.dirname(__file__)
 
@@ -52,6 +56,355 @@ class TestSPHERExImage(unittest.TestCase):
             # third extension - flags
             self.assertEqual(len(hdulist), 4)
 
+    def test_read_matches_ccddata_reader(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+
+        spherex_image = spherex_image_reader(file_path, unit="adu")
+        ccddata = fits_ccddata_reader(file_path, unit="adu", hdu_uncertainty=3)
+
+        np.testing.assert_array_equal(spherex_image.data, ccddata.data)
+        np.testing.assert_array_equal(spherex_image.uncertainty.array, ccddata.uncertainty.array)
+        self.assertIs(type(spherex_image.uncertainty), type(ccddata.uncertainty))
+        self.assertEqual(spherex_image.mask, ccddata.mask)
+        self.assertEqual(spherex_image.unit, ccddata.unit)
+        self.assertEqual(spherex_image.wcs.to_header(), ccddata.wcs.to_header())
+        self.assertEqual(dict(spherex_image.meta), dict(ccddata.meta))
+
+        with fits.open(file_path) as hdulist:
+            np.testing.assert_array_equal(spherex_image.flags, hdulist[2].data)
+
+    def test_lazy_read(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+
+        eager_image = spherex_image_reader(file_path, unit="adu")
+        lazy_image = spherex_image_reader(file_path, unit="adu", lazy=True)
+
+        # variance and flags are not read until accessed
+        self.assertEqual(set(lazy_image._deferred), {"uncertainty", "flags"})
+        np.testing.assert_array_equal(lazy_image.data, eager_image.data)
+        np.testing.assert_array_equal(lazy_image.uncertainty.array, eager_image.uncertainty.array)
+        self.assertEqual(set(lazy_image._deferred), {"flags"})
+        np.testing.assert_array_equal(lazy_image.flags, eager_image.flags)
+        self.assertEqual(lazy_image.flag_defs, eager_image.flag_defs)
+
+        # file is released, when all components are loaded
+        self.assertEqual(lazy_image._deferred, {})
+        self.assertIsNone(lazy_image._release)
+
+    def test_shallow_copy(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+        image = spherex_image_reader(file_path, unit="adu", lazy=True)
+        cache = ImageCache(maxBytes=1 << 30)
+        key = ("small.fits",)
+
+        # copies share read-only arrays, metadata are their own
+        first = cache.put(key, image)
+        second = cache.get(key)
+        self.assertIsNot(first, second)
+        self.assertEqual(image._deferred, {})
+        self.assertIs(first.data, second.data)
+        self.assertIs(first.flags, second.flags)
+        self.assertFalse(second.uncertainty.array.flags.writeable)
+        first.meta["OBSERVER"] = "test"
+        self.assertNotIn("OBSERVER", second.meta)
+        self.assertNotIn("OBSERVER", cache.get(key).meta)
+        flags = list(first.flag_defs)
+        first.flag_mask(any_of=flags)
+        self.assertEqual(second._flag_masks, {})
+        np.testing.assert_array_equal(second.flag_mask(any_of=flags), first.flag_mask(any_of=flags))
+        with self.assertRaises(ValueError):
+            subtract_image(second, first)
+        # deep copies are writeable
+        np.testing.assert_array_equal(subtract_image(second.copy(), first).data, 0)
+
+    def test_section_read(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+        section = (slice(2, 10), slice(5, None))
+
+        spherex_image = spherex_image_reader(file_path, unit="adu")
+        cutout = spherex_image_reader(file_path, unit="adu", section=section)
+
+        self.assertEqual(cutout.shape, (8, 11))
+        np.testing.assert_array_equal(cutout.data, spherex_image.data[section])
+        np.testing.assert_array_equal(cutout.uncertainty.array, spherex_image.uncertainty.array[section])
+        np.testing.assert_array_equal(cutout.flags, spherex_image.flags[section])
+        # cutout pixel (0, 0) is pixel (5, 2) of the original image
+        self.assertEqual(cutout.wcs.pixel_to_world(0, 0), spherex_image.wcs.pixel_to_world(5, 2))
+        self.assertEqual((cutout.meta["LTV1"], cutout.meta["LTV2"]), (-5, -2))
+
+        with self.assertRaises(ValueError):
+            spherex_image_reader(file_path, unit="adu", section=(slice(0, 10, 2), slice(None)))
+
+    def test_component_read(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+        section = (slice(2, 10), slice(5, None))
+
+        spherex_image = spherex_image_reader(file_path, unit="adu")
+        cutout = spherex_image_reader(file_path, unit="adu", section=section)
+
+        metadata = spherex_image_component_reader(file_path, "metadata")
+        self.assertEqual(dict(metadata), dict(spherex_image.meta))
+        self.assertEqual(spherex_image_component_reader(file_path, "wcs").to_header(),
+                         spherex_image.wcs.to_header())
+        self.assertEqual(spherex_image_component_reader(file_path, "wcs", section=section).to_header(),
+                         cutout.wcs.to_header())
+        self.assertEqual(spherex_image_component_reader(file_path, "flag_defs"), spherex_image.flag_defs)
+        np.testing.assert_array_equal(spherex_image_component_reader(file_path, "image"), spherex_image.data)
+        np.testing.assert_array_equal(spherex_image_component_reader(file_path, "flags", section=section),
+                                      cutout.flags)
+        # uncertainty is stored as standard deviation
+        np.testing.assert_allclose(spherex_image_component_reader(file_path, "variance"),
+                                   spherex_image.uncertainty.array ** 2)
+
+        with self.assertRaises(ValueError):
+            spherex_image_component_reader(file_path, "mask")
+
+    def test_compressed_write(self):
+        file_path = os.path.join(TESTDIR, "data", "small.fits")
+        spherex_image = spherex_image_reader(file_path, unit="adu")
+
+        out_path = os.path.join(self.root, "compressed.fits")
+        compression = {"image": {"compression_type": "RICE_1", "quantize_level": 16},
+                       "variance": "GZIP_2",
+                       "flags": "GZIP_2"}
+        spherex_image_writer(spherex_image, out_path, compression=compression)
+
+        with fits.open(out_path) as hdulist:
+            self.assertEqual(len(hdulist), 4)
+            for hdu in hdulist[1:]:
+                self.assertTrue(isinstance(hdu, fits.CompImageHDU))
+
+        # reader decompresses transparently, including section reads
+        for section in ((slice(None), slice(None)), (slice(2, 5), slice(3, 9))):
+            retrieved = spherex_image_reader(out_path, unit="adu", section=section)
+            # RICE compression of floating point data is lossy
+            np.testing.assert_allclose(retrieved.data, spherex_image.data[section], atol=0.1)
+            np.testing.assert_array_equal(retrieved.uncertainty.array,
+                                          spherex_image.uncertainty.array[section])
+            np.testing.assert_array_equal(retrieved.flags, spherex_image.flags[section])
+            self.assertEqual(retrieved.flag_defs, spherex_image.flag_defs)
+
+        with self.assertRaises(ValueError):
+            spherex_image_writer(spherex_image, out_path, compression={"unknown": "RICE_1"}, overwrite=True)
+
+    def test_write_memory(self):
+        shape = (1024, 1024)
+        rng = np.random.default_rng(42)
+        spherex_image = SPHERExImage(rng.normal(size=shape).astype(np.float32), unit="adu",
+                                     uncertainty=VarianceUncertainty(np.ones(shape, dtype=np.float32)),
+                                     mask=np.zeros(shape, dtype=bool),
+                                     flags=np.zeros(shape, dtype=np.int16),
+                                     flag_defs={"SATURATED": 0})
+        planes = (spherex_image.data, spherex_image.uncertainty.array,
+                  spherex_image.mask, spherex_image.flags)
+        dataset_size = sum(plane.nbytes for plane in planes)
+
+        # peak of the memory allocated on top of the dataset while writing
+        out_path = os.path.join(self.root, "streamed.fits")
+        tracemalloc.start()
+        try:
+            spherex_image_writer(spherex_image, out_path)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 0.25 * dataset_size)
+
+        retrieved = spherex_image_reader(out_path, unit="adu")
+        np.testing.assert_array_equal(retrieved.data, spherex_image.data)
+        np.testing.assert_array_equal(retrieved.uncertainty.array, spherex_image.uncertainty.array)
+        np.testing.assert_array_equal(retrieved.mask, spherex_image.mask)
+        np.testing.assert_array_equal(retrieved.flags, spherex_image.flags)
+
+    def test_flag_query(self):
+        flag_defs = {"SATURATED": 0, "COSMICRAY": 1, "NONFUNC": 2, "HOT": 3, "EDGE": 31}
+        flags = np.array([[0, 1, 8, 9], [4, 5, 12, 1 << 31]], dtype=np.uint32)
+        image = SPHERExImage(np.zeros(flags.shape), unit="adu", flags=flags, flag_defs=flag_defs)
+
+        mask = image.flag_mask(any_of=["SATURATED", "HOT"], none_of=["NONFUNC"])
+        expected = (((flags & 1) | (flags >> 3 & 1)) > 0) & ((flags >> 2 & 1) == 0)
+        np.testing.assert_array_equal(mask, expected)
+        np.testing.assert_array_equal(image.flag_mask(all_of=["SATURATED", "HOT"]), (flags & 9) == 9)
+        np.testing.assert_array_equal(image.flag_mask(any_of=["edge"]), flags >= 1 << 31)
+        rows, columns = image.flag_pixels(any_of=["NONFUNC"])
+        self.assertEqual(list(zip(rows, columns)), [(1, 0), (1, 1), (1, 2)])
+
+        # masks are cached until flags are replaced
+        self.assertIs(image.flag_mask(any_of=["HOT", "SATURATED"], none_of=["NONFUNC"]), mask)
+        self.assertFalse(mask.flags.writeable)
+        image.flags = np.zeros(flags.shape, dtype=np.int16)
+        self.assertFalse(image.flag_mask(any_of=["SATURATED", "HOT"]).any())
+
+        with self.assertRaises(ValueError):
+            image.flag_mask(any_of=["UNKNOWN"])
+        with self.assertRaises(ValueError):
+            image.flag_mask()
+        # bit 31 does not fit into int16 flags
+        with self.assertRaises(ValueError):
+            image.flag_mask(none_of=["EDGE"])
+
+    def test_summary(self):
+        flag_defs = {"SATURATED": 0, "HOT": 3, "PERSISTENT": 6}
+        data = np.arange(100, dtype=np.float32).reshape(10, 10)
+        data[0, 0] = np.nan
+        flags = np.zeros(data.shape, dtype=np.int32)
+        flags[:2] = 1
+        flags[5, :3] |= 1 << 6
+        image = SPHERExImage(data, unit="adu", flags=flags, flag_defs=flag_defs)
+
+        summary = image_summary(image.data, image.flags, image.flag_defs)
+        self.assertEqual((summary["size"], summary["npix"]), (100, 99))
+        self.assertEqual((summary["min"], summary["max"], summary["median"]), (1, 99, 50))
+        self.assertEqual(summary["flag_counts"], {"SATURATED": 20, "HOT": 0, "PERSISTENT": 3})
+
+        # larger images: exact extremes and counts, sampled quantiles
+        rng = np.random.default_rng(3)
+        large = rng.normal(10, 2, size=(1024, 700)).astype(np.float32)
+        large[::5, ::3] = np.nan
+        summary = image_summary(large)
+        finite = large[np.isfinite(large)]
+        self.assertEqual((summary["npix"], summary["min"], summary["max"]),
+                         (finite.size, finite.min(), finite.max()))
+        self.assertAlmostEqual(summary["median"], np.median(finite), delta=0.02)
+        self.assertAlmostEqual(summary["sigma"], 2, delta=0.02)
+
+        summary = image_summary(data, image.flags, image.flag_defs)
+        # summary is stored in the flags header
+        out_path = os.path.join(self.root, "summary.fits")
+        # the writer returns the summary it stored
+        self.assertEqual(spherex_image_writer(image, out_path, summary=True), summary)
+        self.assertEqual(spherex_image_component_reader(out_path, "summary"), summary)
+        with fits.open(out_path) as hdulist:
+            self.assertEqual(hdulist["FLAGS"].header["NP_HOT"], 0)
+
+        # without flags, in the image header, which is not copied, when rewritten
+        image = SPHERExImage(data, unit="adu")
+        written = spherex_image_writer(image, out_path, summary=True, overwrite=True)
+        self.assertEqual(spherex_image_component_reader(out_path, "summary"), written)
+        self.assertEqual(written["npix"], 99)
+        copy_path = os.path.join(self.root, "summary_copy.fits")
+        self.assertIsNone(spherex_image_writer(spherex_image_reader(out_path, unit="adu"), copy_path))
+        self.assertIsNone(spherex_image_component_reader(copy_path, "summary"))
+
+    def test_integer_round_trip(self):
+        out_path = os.path.join(self.root, "integers.fits")
+        for dtype in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64):
+            info = np.iinfo(dtype)
+            data = np.array([[info.min, info.min + 1, 0, 3],
+                             [-5 if info.min else 5, 1, info.max - 1, info.max]], dtype=dtype)
+            spherex_image_writer(SPHERExImage(data, unit="adu"), out_path, overwrite=True)
+            image = spherex_image_reader(out_path, unit="adu")
+            self.assertEqual(image.data.dtype.newbyteorder('='), dtype)
+            np.testing.assert_array_equal(image.data, data, err_msg=np.dtype(dtype).name)
+            # astropy reads the stored values the same way
+            with fits.open(out_path) as hdulist:
+                np.testing.assert_array_equal(hdulist[1].data, data, err_msg=np.dtype(dtype).name)
+
+    def test_compact_flags(self):
+        data = np.zeros((8, 8), dtype=np.float32)
+        flags = np.zeros(data.shape, dtype=np.int64)
+        flags[1, 2] = 1 << 6
+        out_path = os.path.join(self.root, "compact.fits")
+
+        # smallest unsigned type, which holds the highest defined bit
+        for flag_defs, dtype in (({"SATURATED": 0, "PERSISTENT": 6}, np.uint8),
+                                 ({"SATURATED": 0, "EDGE": 12}, np.uint16)):
+            image = SPHERExImage(data, unit="adu", flags=flags, flag_defs=flag_defs)
+            spherex_image_writer(image, out_path, overwrite=True)
+            with fits.open(out_path) as hdulist:
+                self.assertEqual(hdulist["FLAGS"].data.dtype, dtype)
+            flags_read = spherex_image_component_reader(out_path, "flags")
+            self.assertEqual(flags_read.dtype, dtype)
+            np.testing.assert_array_equal(flags_read, flags)
+
+        # set bits, which are not defined, are preserved
+        flags[0, 0] = 1 << 20
+        image = SPHERExImage(data, unit="adu", flags=flags, flag_defs={"SATURATED": 0})
+        spherex_image_writer(image, out_path, overwrite=True)
+        np.testing.assert_array_equal(spherex_image_component_reader(out_path, "flags"), flags)
+        self.assertEqual(spherex_image_component_reader(out_path, "flags").dtype, np.uint32)
+
+        spherex_image_writer(image, out_path, overwrite=True, compact_flags=False)
+        self.assertEqual(spherex_image_component_reader(out_path, "flags").dtype.name, "int64")
+
+    def test_subtract_image(self):
+        shape = (64, 32)
+        rng = np.random.default_rng(7)
+
+        def make_image(flag_bit):
+            flags = np.zeros(shape, dtype=np.int16)
+            flags[::flag_bit + 2] = 1 << flag_bit
+            return SPHERExImage(rng.normal(size=shape).astype(np.float32), unit="adu",
+                                uncertainty=VarianceUncertainty(rng.uniform(size=shape).astype(np.float32)),
+                                mask=rng.uniform(size=shape) > 0.9, flags=flags,
+                                flag_defs={"SATURATED": 0, "COSMICRAY": 1})
+
+        image, dark = make_image(0), make_image(1)
+        expected = (image.data - dark.data, image.uncertainty.array + dark.uncertainty.array,
+                    image.flags | dark.flags, image.mask | dark.mask)
+        buffers = (image.data, image.uncertainty.array, image.flags, image.mask)
+
+        # in place
+        result = subtract_image(image, dark)
+        self.assertIs(result, image)
+        for actual, buffer, value in zip((result.data, result.uncertainty.array, result.flags, result.mask),
+                                         buffers, expected):
+            self.assertIs(actual, buffer)
+            np.testing.assert_array_equal(actual, value)
+
+        # preallocated output, subtrahend without uncertainty and flags
+        dark.uncertainty = None
+        dark.flags = None
+        out = SPHERExImage(np.empty(shape, dtype=np.float32), unit="adu",
+                           uncertainty=VarianceUncertainty(np.empty(shape, dtype=np.float32)),
+                           mask=np.empty(shape, dtype=bool), flags=np.empty(shape, dtype=np.int16))
+        result = subtract_image(image, dark, out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out.data, image.data - dark.data)
+        np.testing.assert_array_equal(out.uncertainty.array, image.uncertainty.array)
+        np.testing.assert_array_equal(out.flags, image.flags)
+        np.testing.assert_array_equal(out.mask, image.mask | dark.mask)
+        self.assertEqual(out.flag_defs, image.flag_defs)
+
+        # flags of mixed types are widened instead of truncated
+        for flagsType, darkType, resultType in ((np.uint8, np.uint16, np.uint16),
+                                                (np.int16, np.uint16, np.int32),
+                                                (np.int32, np.int16, np.int32)):
+            flags = np.full(shape, 1, dtype=flagsType)
+            other = SPHERExImage(np.zeros(shape, dtype=np.float32), unit="adu",
+                                 flags=np.full(shape, 1 << 9, dtype=darkType))
+            result = subtract_image(SPHERExImage(np.zeros(shape, dtype=np.float32), unit="adu",
+                                                 flags=flags), other)
+            self.assertEqual(result.flags.dtype, resultType)
+            self.assertEqual(result.flags is flags, resultType == flagsType)
+            np.testing.assert_array_equal(result.flags, 1 | 1 << 9)
+        result = subtract_image(SPHERExImage(np.zeros(shape, dtype=np.float32), unit="adu",
+                                             flags=np.zeros(shape, dtype=np.uint8)), other,
+                                out=SPHERExImage(np.zeros(shape, dtype=np.float32), unit="adu",
+                                                 flags=np.zeros(shape, dtype=np.uint8)))
+        np.testing.assert_array_equal(result.flags, 1 << 9)
+
+        # integer data are subtracted into a new floating point array
+        for rawType, darkType, resultType in ((np.uint16, np.float32, np.float32),
+                                              (np.uint16, np.uint16, np.float32),
+                                              (np.int32, np.float32, np.float64)):
+            raw = np.full(shape, 10, dtype=rawType)
+            result = subtract_image(SPHERExImage(raw, unit="adu"),
+                                    SPHERExImage(np.full(shape, 12.5 if darkType == np.float32 else 12,
+                                                         dtype=darkType), unit="adu"))
+            self.assertEqual(result.data.dtype, resultType)
+            self.assertIsNot(result.data, raw)
+            np.testing.assert_array_equal(result.data, -2.5 if darkType == np.float32 else -2)
+        # float64 dark is subtracted in place from float32 data
+        data = np.full(shape, 1, dtype=np.float32)
+        result = subtract_image(SPHERExImage(data, unit="adu"), SPHERExImage(np.full(shape, 0.5), unit="adu"))
+        self.assertIs(result.data, data)
+        np.testing.assert_array_equal(data, 0.5)
+
+        with self.assertRaises(ValueError):
+            subtract_image(image, SPHERExImage(np.zeros((2, 2)), unit="adu"))
+        with self.assertRaises(ValueError):
+            subtract_image(image, SPHERExImage(np.zeros(shape), unit="electron"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from astropy.nddata import VarianceUncertainty
+from spherex.core import SPHERExImage, spherex_image_reader, spherex_image_writer, subtract_image
+from spherex.tasks.tiled import TiledImageWriter, iter_tiles, run_tiled
+
+TESTDIR = os.path.dirname(__file__)
+
+
+class TestTiled(unittest.TestCase):
+    root = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=TESTDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.root is not None:
+            shutil.rmtree(cls.root, ignore_errors=True)
+
+    def make_image(self, name, flag_bit, shape=(100, 70)):
+        rng = np.random.default_rng(flag_bit)
+        flags = np.zeros(shape, dtype=np.uint16)
+        flags[::3] = 1 << flag_bit
+        variance = VarianceUncertainty(rng.uniform(size=shape).astype(np.float32))
+        spherex_image = SPHERExImage(rng.normal(size=shape).astype(np.float32), unit="adu",
+                                     uncertainty=variance, mask=rng.uniform(size=shape) > 0.8,
+                                     flags=flags, flag_defs={"SATURATED": 0, "COSMICRAY": 1})
+        path = os.path.join(self.root, name)
+        spherex_image_writer(spherex_image, path, overwrite=True)
+        return path
+
+    def test_iter_tiles(self):
+        shape = (10, 7)
+        for tile_shape in [(3, None), (4, 3), (None, None), (10, 7)]:
+            covered = np.zeros(shape, dtype=int)
+            for section in iter_tiles(shape, tile_shape):
+                covered[section] += 1
+            np.testing.assert_array_equal(covered, 1)
+        self.assertEqual(len(list(iter_tiles(shape, (3, None)))), 4)
+
+    def test_run_tiled(self):
+        input_path = self.make_image("input.fits", 0)
+        subtract_path = self.make_image("dark.fits", 1)
+        expected = subtract_image(spherex_image_reader(input_path, unit="adu"),
+                                  spherex_image_reader(subtract_path, unit="adu"))
+
+        output_path = os.path.join(self.root, "output.fits")
+        for tile_shape in [(7, None), (16, 9), (None, None)]:
+            run_tiled(subtract_image, [input_path, subtract_path], output_path,
+                      tile_shape=tile_shape, unit="adu", overwrite=True)
+            output = spherex_image_reader(output_path, unit="adu")
+            np.testing.assert_array_equal(output.data, expected.data)
+            np.testing.assert_array_equal(output.uncertainty.array, expected.uncertainty.array)
+            np.testing.assert_array_equal(output.mask, expected.mask)
+            np.testing.assert_array_equal(output.flags, expected.flags)
+            self.assertEqual(output.flag_defs, expected.flag_defs)
+            self.assertNotIn("LTV1", output.header)
+
+    def test_tiled_writer_integers(self):
+        output_path = os.path.join(self.root, "integers.fits")
+        for dtype in (np.int8, np.uint16):
+            info = np.iinfo(dtype)
+            data = np.linspace(info.min, info.max, 60).astype(dtype).reshape(6, 10)
+            with TiledImageWriter(output_path, SPHERExImage(data, unit="adu"), data.shape,
+                                  overwrite=True) as writer:
+                for section in iter_tiles(data.shape, (4, 3)):
+                    writer.write(section, SPHERExImage(data[section], unit="adu"))
+            np.testing.assert_array_equal(spherex_image_reader(output_path, unit="adu").data, data)
+
+
+if __name__ == '__main__':
+    unittest.main()